@@ -0,0 +1,74 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Timestamps for MicroPython boards: the board's millisecond tick counter
+# plus an offset to wall-clock time, read from the RTC.  rtc.ntp_sync()
+# keeps syncing the RTC in the background, so instead of sleeping until it
+# is done, the script keeps sampling, and the offset is measured again
+# (each time the main loop calls update()) once the RTC is synced.
+# Timestamps never go backwards, even if the RTC is stepped
+# ************************************************************************
+
+import time
+
+def _two_digits(number):
+    return ('0' if number < 10 else '') + str(number)
+
+# rtc is a machine.RTC; its now() returns, for example, (2018, 6, 11, 19, 3,
+# 42, 62911, None); resync_seconds is how often the offset is measured again
+class OffsetClock:
+
+    def __init__(self, rtc, resync_seconds=600):
+        self.rtc = rtc
+        self.resync_ms = resync_seconds * 1000
+        self.synced = False
+        self.last_ms = 0
+        self._measure()
+
+    # Reads the RTC once, and keeps its offset from the tick counter; the
+    # tick counter wraps around, so it is only ever compared with the tick
+    # of the last measurement, which is never more than resync_seconds old
+    def _measure(self):
+        ticks = time.ticks_ms()
+        now = self.rtc.now()
+        seconds = time.mktime((now[0], now[1], now[2], now[3], now[4], now[5], 0, 0))
+        self.base_ticks = ticks
+        self.base_ms = seconds * 1000 + now[6] // 1000
+        self.measured_ticks = ticks
+
+    # Called from the main loop: measures the offset once the RTC is first
+    # synced, then every resync_seconds
+    def update(self):
+        if not self.synced and self.rtc.synced():
+            self.synced = True
+            self._measure()
+        elif time.ticks_diff(time.ticks_ms(), self.measured_ticks) >= self.resync_ms:
+            self._measure()
+
+    # Milliseconds since the epoch; never less than the last value returned
+    def now_ms(self):
+        now_ms = self.base_ms + time.ticks_diff(time.ticks_ms(), self.base_ticks)
+        if now_ms < self.last_ms:
+            now_ms = self.last_ms
+        self.last_ms = now_ms
+        return now_ms
+
+    # The current time in the ISO format needed by OMF, to the millisecond
+    def timestamp_string(self):
+        now_ms = self.now_ms()
+        t = time.gmtime(now_ms // 1000)
+        return '{0}-{1}-{2}T{3}:{4}:{5}.{6:03d}Z'.format(
+            t[0], _two_digits(t[1]), _two_digits(t[2]), _two_digits(t[3]), _two_digits(t[4]), _two_digits(t[5]),
+            now_ms % 1000)
@@ -0,0 +1,110 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# A small leveled logger for MicroPython boards, where printing a whole OMF
+# message to the serial console takes longer than sending it:
+#  - a message below the current level costs a single comparison, and is
+#    never formatted
+#  - messages are kept in a short buffer, and only written to the console
+#    when flush() is called (the main loop calls it just before it sleeps),
+#    so sending never waits on the serial port; if the buffer is full, the
+#    oldest message is dropped
+#  - warnings and errors are rate-limited per kind, so an endpoint that is
+#    down does not fill the console with one line per message
+# ************************************************************************
+
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+# level is one of the levels above; timestamp, if given, is a function that
+# returns the current time as a string (such as getCurrentTimestampString);
+# at most burst warnings or errors of each kind are kept per interval_seconds
+class Logger:
+
+    def __init__(self, level=INFO, timestamp=None, buffer_size=20, burst=3, interval_seconds=60):
+        self.level = level
+        self.timestamp = timestamp
+        self.buffer_size = buffer_size
+        self.burst = burst
+        self.interval_seconds = interval_seconds
+        self.buffer = []
+        self.dropped = 0
+        # Per kind: [start of the current interval, messages kept, messages suppressed]
+        self.rate_state = {}
+
+    def _allow(self, key):
+        now = time.time()
+        state = self.rate_state.get(key)
+        if state is None or now - state[0] >= self.interval_seconds:
+            suppressed = state[2] if state is not None else 0
+            self.rate_state[key] = [now, 1, 0]
+            return suppressed
+        if state[1] < self.burst:
+            state[1] += 1
+            suppressed = state[2]
+            state[2] = 0
+            return suppressed
+        state[2] += 1
+        return None
+
+    # message is a str.format template, only formatted when it is written;
+    # warnings and errors are rate-limited per key (by default, the template)
+    def log(self, level, message, args=(), key=None):
+        if level < self.level:
+            return
+        suppressed = 0
+        if level >= WARNING:
+            suppressed = self._allow(key if key is not None else message)
+            if suppressed is None:
+                return
+        if len(self.buffer) >= self.buffer_size:
+            self.buffer.pop(0)
+            self.dropped += 1
+        timestamp = self.timestamp() if self.timestamp else ''
+        self.buffer.append((timestamp, level, message, args, suppressed))
+
+    def debug(self, message, *args):
+        if DEBUG >= self.level:
+            self.log(DEBUG, message, args)
+
+    def info(self, message, *args):
+        if INFO >= self.level:
+            self.log(INFO, message, args)
+
+    def warning(self, message, *args, key=None):
+        self.log(WARNING, message, args, key)
+
+    def error(self, message, *args, key=None):
+        self.log(ERROR, message, args, key)
+
+    # Writes every buffered message to the console
+    def flush(self):
+        buffer = self.buffer
+        self.buffer = []
+        if self.dropped:
+            print('({0} log messages dropped)'.format(self.dropped))
+            self.dropped = 0
+        for timestamp, level, message, args, suppressed in buffer:
+            if args:
+                message = message.format(*args)
+            if suppressed:
+                message += ' ({0} similar messages suppressed)'.format(suppressed)
+            print(timestamp + ' ' + LEVEL_NAMES[level] + ' ' + message)
@@ -44,6 +44,8 @@ import pycom
 import time
 import urequest # Download this from https://github.com/micropython/micropython-lib/blob/master/urequests/urequests.py
 import json
+import omf_log # The logger in the lib folder
+import omf_clock # The timestamping service in the lib folder
 
 # Import any special packages needed for a particular hardware platform,
 # for example, for a Raspberry PI,
@@ -99,6 +101,20 @@ TARGET_URL = "https://lopezpiserver:777/ingress/messages"
 # uncomment the below line in order to set the target URL to the OCS OMF endpoint:
 #TARGET_URL = "https://dat-a.osisoft.com/api/omf"
 
+# Specify the NTP server that the RTC is synced with; the offset between the
+# board's tick counter and the RTC is measured again every CLOCK_RESYNC_SECONDS,
+# and data values are sent once the RTC is synced, or after
+# CLOCK_SYNC_TIMEOUT_SECONDS at the latest
+NTP_SERVER = "pool.ntp.org"
+CLOCK_RESYNC_SECONDS = 600
+CLOCK_SYNC_TIMEOUT_SECONDS = 30
+
+# Specify which messages to print: omf_log.DEBUG prints every outgoing message
+# and every response; omf_log.INFO (the default) only prints progress and
+# failures.  Messages are printed while the board waits between messages, and
+# repeated failures (such as while the endpoint is down) only a few times a minute
+LOG_LEVEL = omf_log.INFO
+
 # Specify the producer token, a unique token used to identify and authorize a given OMF producer. Consult the OSIsoft Cloud Services or PI Connector Relay documentation for further information.
 PRODUCER_TOKEN = "OMFv1"
 #PRODUCER_TOKEN = "778408" # An example
@@ -123,37 +139,17 @@ barometer = MPL3115A2(py, mode=ALTITUDE) # in Pa or meters
 # Enable the heartbeat LED
 pycom.heartbeat(True)
 
-# Prepare to sync the clock
+# Prepare to sync the clock; timestamps are the tick counter plus its offset from the rtc
 rtc = machine.RTC()
+clock = omf_clock.OffsetClock(rtc, CLOCK_RESYNC_SECONDS)
 
-# The following helper function prepends a zero to a number if it is less than
-# 10, in order to guarantee two-digit hour, month, day, and minute, and second
-def prependZeroIfNeeded(number):
-    if (number >= 10):
-        return ("" + str(number))
-    else:
-        return ("0" + str(number))
-
-# The following helper function pretty-prints out the current time from the rtc
+# The following helper function pretty-prints out the current time
 # in the ISO format needed by OMFv1
 def getCurrentTimestampString():
-    # The RTC returns a time in the format (2018, 6, 11, 19, 3, 42, 62911, None)
-    currentRTCTime = rtc.now()
-    timestamp = (
-        str(currentRTCTime[0]) +
-        "-" +
-        prependZeroIfNeeded(currentRTCTime[1]) +
-        "-" +
-        prependZeroIfNeeded(currentRTCTime[2]) +
-        "T" +
-        prependZeroIfNeeded(currentRTCTime[3]) +
-        ":" +
-        prependZeroIfNeeded(currentRTCTime[4]) +
-        ":" +
-        prependZeroIfNeeded(currentRTCTime[5]) +
-        "Z"
-    )
-    return timestamp
+    return clock.timestamp_string()
+
+# Create the logger used by the send function; its messages are stamped with the current time
+log = omf_log.Logger(LOG_LEVEL, getCurrentTimestampString)
 
 # The following function is where you can insert specific initialization code to set up
 # sensors for a particular IoT module or platform
@@ -168,11 +164,10 @@ def initialize_sensors():
         # Turn off the hearbeat LED
         pycom.heartbeat(False)
 
-        # Sync the clock!
+        # Start syncing the clock; the rtc keeps syncing in the background,
+        # so there is no need to wait for it here
         print("Syncing clock...")
-        rtc.ntp_sync("pool.ntp.org")
-        time.sleep(5)
-        print("Clock set to: " + getCurrentTimestampString());
+        rtc.ntp_sync(NTP_SERVER)
 
         print("--- Sensors initialized!")
 		# In short, in this example, by default,
@@ -255,31 +250,32 @@ def send_omf_message_to_endpoint(action, message_type, message_json):
             'messageformat': 'JSON',
             'omfversion': '1.0'
         }
-        # !!! Note: if desired, ucomment the below line to print the outgoing message
-        print('\nOutgoing message: ' + json.dumps(message_json));
-        # Send the request, and collect the response; json.dumps is used to
-        # properly format the message JSON so that it can be sent as a web request
+        # json.dumps is used to properly format the message JSON so that it
+        # can be sent as a web request; it is only encoded once
+        message_body = json.dumps(message_json)
+        # The outgoing message is only printed if LOG_LEVEL is omf_log.DEBUG
+        log.debug('Outgoing message: {0}', message_body)
+        # Send the request, and collect the response
         response = urequest.request(
             "POST",
             TARGET_URL,
             headers=web_request_header,
-            data=json.dumps(message_json)
-        )
-        # Print a debug message, if desired; note: you should receive a
-        # response code 200 or 202 if the request was successful!
-        print(
-            'Response from sending a message of type ' +
-            '"{0}" with action "{1}": {2} {3}'.format(
-                message_type,
-                action,
-                response.status_code,
-                response.text
-            )
+            data=message_body
         )
+        # Note: you should receive a response code 200 or 202 if the request
+        # was successful!  Any other response is printed as a warning; the
+        # response text is only read if it is printed
+        if response.status_code >= 300:
+            log.warning('Response from sending a message of type "{0}" with action "{1}": {2} {3}',
+                message_type, action, response.status_code, response.text, key=response.status_code)
+        elif log.level <= omf_log.DEBUG:
+            log.debug('Response from sending a message of type "{0}" with action "{1}": {2} {3}',
+                message_type, action, response.status_code, response.text)
+        else:
+            response.close()
     except Exception as ex:
         # Log any error, if it occurs
-        #print(str(datetime.datetime.now()) + " Error during web request: " + str(ex))
-        print(getCurrentTimestampString() + " Error during web request: " + str(ex))
+        log.error('Error during web request: {0}', ex)
 
 print(
     '\n--- Setup: targeting endpoint "' + TARGET_URL + '"...' +
@@ -484,6 +480,9 @@ initialize_sensors()
 # conforming to the value type that we defined earlier
 # ************************************************************************
 
+# Print the responses to the setup messages
+log.flush()
+
 print(
     '\n--- Now sending live data every ' + str(NUMBER_OF_SECONDS_BETWEEN_VALUE_MESSAGES) +
     ' second(s) for device "' + NEW_AF_ELEMENT_NAME + '"... (press CTRL+C to quit at any time)\n'
@@ -492,19 +491,27 @@ if not SEND_DATA_TO_OSISOFT_CLOUD_SERVICES:
     print(
         '--- (Look for a new AF Element named "' + NEW_AF_ELEMENT_NAME + '".)\n'
     )
+startTicks = time.ticks_ms()
 while True:
     # Turn on the hearbeat LED!
     pycom.rgbled(0x050000);
 
-    # Call the custom function that builds a JSON object that
-    # contains new data values; see the beginning of this script
-    VALUES_MESSAGE_JSON = create_data_values_message()
+    # Measure the clock offset, once the rtc is synced and every CLOCK_RESYNC_SECONDS
+    clock.update()
+
+    if not clock.synced and time.ticks_diff(time.ticks_ms(), startTicks) < CLOCK_SYNC_TIMEOUT_SECONDS * 1000:
+        log.info('Waiting for the clock to sync before sending data values...')
+    else:
+        # Call the custom function that builds a JSON object that
+        # contains new data values; see the beginning of this script
+        VALUES_MESSAGE_JSON = create_data_values_message()
 
-    # Send the JSON message to the target URL;
-    send_omf_message_to_endpoint("create", "Data", VALUES_MESSAGE_JSON)
+        # Send the JSON message to the target URL;
+        send_omf_message_to_endpoint("create", "Data", VALUES_MESSAGE_JSON)
 
     # Turn off the hearbeat LED!
     pycom.rgbled(0);
 
-    # Send the next message after the required interval
+    # Print any log messages, then send the next message after the required interval
+    log.flush()
     time.sleep(NUMBER_OF_SECONDS_BETWEEN_VALUE_MESSAGES)
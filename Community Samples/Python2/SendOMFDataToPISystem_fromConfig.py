@@ -0,0 +1,79 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# NOTE: this script was designed using the v1.0
+# version of the OMF specification, as outlined here:
+# http://omf-docs.readthedocs.io/en/v1.0/index.html
+
+# NOTE: this script does what each of the device scripts in this folder does,
+# for whichever device a configuration file describes: the endpoint, the
+# device name and location, the OMF types, and, for each container, the
+# source of its values (random values, a Raspberry Pi Sense HAT, a BeagleBone
+# Blue IMU, or a Phidget).  Example configuration files are in the "configs"
+# folder; to run this script with one of them, run, for example,
+#   python3 SendOMFDataToPISystem_fromConfig.py configs/sensehat.json
+# Each source only needs the libraries of its own hardware; see the device
+# script for the same hardware for how to install them.
+
+# ************************************************************************
+# Import necessary packages
+# ************************************************************************
+
+# Import packages
+import sys
+import requests
+
+# Shared helpers from the omf_edge folder next to this script
+from omf_edge.runner import DeviceRunner, load_config
+from omf_edge.log import get_logger
+
+# ************************************************************************
+# Read the configuration file
+# ************************************************************************
+
+# Specify the configuration file to use if none is given on the command line
+DEFAULT_CONFIG_FILE = "configs/random.json"
+
+CONFIG_FILE = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CONFIG_FILE
+config = load_config(CONFIG_FILE)
+
+# ************************************************************************
+# Turn off HTTPS warnings, if desired
+# (if the default certificate configuration was used by the PI Connector)
+# ************************************************************************
+
+# Messages are printed through the same logger as the shared helpers, so
+# that they come out in order
+log = get_logger("omf")
+
+# Suppress insecure HTTPS warnings, if an untrusted certificate is used by the target endpoint
+# Remove if targetting trusted targets
+try:
+    if not config["endpoint"]["verify_ssl"]:
+        requests.packages.urllib3.disable_warnings()
+
+except Exception as ex:
+        # Log any error, if it occurs
+        log.warning("Possible non-fatal error when disabling SSL validation: {0}", ex)
+
+# ************************************************************************
+# Send the types, containers, asset and links, initialize the sensors, and
+# then loop indefinitely, sending the values that they read
+# ************************************************************************
+
+runner = DeviceRunner(config)
+if not runner.start():
+    log.error("Error: the device could not be set up; see the errors above")
+    sys.exit(1)
+runner.run()
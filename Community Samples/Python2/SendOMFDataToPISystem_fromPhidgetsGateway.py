@@ -0,0 +1,229 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# NOTE: this script was designed using the v1.0
+# version of the OMF specification, as outlined here:
+# http://omf-docs.readthedocs.io/en/v1.0/index.html
+
+# NOTE: this example is a gateway for any number of Phidgets: it reads every
+# supported channel of every Phidget attached to this computer (directly over
+# USB, or through VINT hubs), such as accelerometers, temperature and humidity
+# sensors, and voltage inputs; see omf_edge/phidget_gateway.py for the list
+
+# NOTE: to install Linux Phidget support, see https://www.phidgets.com/docs/OS_-_Linux#Debian_Install
+# For general installation instructions, see https://www.phidgets.com/docs/Software_Overview#Operating_System_Support
+# To specifically enable Python support for the Phidgets, see
+# https://www.phidgets.com/docs/Language_-_Python#Getting_Started_with_Python
+
+# ************************************************************************
+# Import necessary packages
+# ************************************************************************
+
+# Import packages
+import sys
+import requests
+
+# Shared helpers from the omf_edge folder next to this script; the runner
+# sends the device's type, asset and links, and then the data values, and the
+# gateway sends the type, container, element and links of each channel it finds
+from omf_edge.runner import DeviceRunner, build_config
+from omf_edge.log import get_logger
+# (the gateway requires NumPy and the Phidget22 library; to install NumPy, run
+# "pip install numpy", and for the Phidget22 library, see the notes above)
+from omf_edge.phidget_gateway import PhidgetGateway
+
+# ************************************************************************
+# Specify constant values (names, target URLS, et centera) needed by the script
+# ************************************************************************
+
+# Specify the name of this device, or simply use the hostname; this is the name
+# of the PI AF Element that will be created, and it'll be included in the names
+# of PI Points that get created as well
+DEVICE_NAME = "Phidgets Gateway 01"
+#DEVICE_NAME = "MyCustomDeviceName"
+
+# Specify a device location (optional); this will be added as a static
+# string attribute to the AF Element that is created
+DEVICE_LOCATION = "IoT Test Lab"
+
+# Specify the name of the Assets type message; this will also end up becoming
+# part of the name of the PI AF Element template that is created; for example, this could be
+# "AssetsType_RaspberryPI" or "AssetsType_Dragonboard"
+# You will want to make this different for each general class of IoT module that you use
+ASSETS_MESSAGE_TYPE_NAME = DEVICE_NAME + "_assets_type"
+#ASSETS_MESSAGE_TYPE_NAME = "assets_type" + "IoT Device Model 74656" # An example
+# NoteL you can repalce DEVICE_NAME with DEVICE_TYPE if you'd like to use a common type for multiple assets
+
+# The data values types (one per kind of channel, such as "accelerometer") and
+# the containers (one per channel) are named after the device name as well; for
+# example, "Phidgets Gateway 01_temperature_data_values_type", and
+# "Phidgets Gateway 01 temperature 512345 port 2 channel 0_data_values_container"
+
+# Specify the number of seconds to sleep in between value messages
+NUMBER_OF_SECONDS_BETWEEN_VALUE_MESSAGES = 2
+
+# Specify the interval, in milliseconds, at which each Phidget channel reports
+# new values (its data rate); every value is kept, and the values of all channels
+# are sent together every NUMBER_OF_SECONDS_BETWEEN_VALUE_MESSAGES.  Set this to 0
+# to use the fastest rate that each device supports (its minimum data interval)
+PHIDGET_DATA_INTERVAL_MS = 100
+
+# Specify how many values of each channel can wait to be sent; if sending falls
+# further behind than this, new values are dropped (and counted)
+PHIDGET_BUFFER_SIZE = 6000
+
+# Specify the most events to send in one message, across all channels;
+# each event takes about 60 to 120 bytes, and a message must stay under 192 KB
+MAXIMUM_EVENTS_PER_MESSAGE = 1000
+
+# Print the state and counters of every channel, once every this many loops
+NUMBER_OF_LOOPS_BETWEEN_CAPTURE_REPORTS = 300
+
+# Specify whether you're sending data to OSIsoft cloud services or not
+SEND_DATA_TO_OSISOFT_CLOUD_SERVICES = False
+
+# Specify the address of the destination endpoint; it should be of the form
+# http://<host/ip>:<port>/ingress/messages
+# For example, "https://myservername:8118/ingress/messages"
+TARGET_URL = "https://lopezpiserver:777/ingress/messages"
+#TARGET_URL = "https://localhost:5000/edge/omf/tenants/default/namespaces/data"
+# !!! Note: if sending data to OSIsoft cloud services,
+# uncomment the below line in order to set the target URL to the OCS OMF endpoint:
+#TARGET_URL = "https://dat-a.osisoft.com/api/omf"
+
+# Specify the producer token, a unique token used to identify and authorize a given OMF producer. Consult the OSIsoft Cloud Services or PI Connector Relay documentation for further information.
+PRODUCER_TOKEN = "OMFv1"
+#PRODUCER_TOKEN = "778408" # An example
+# !!! Note: if sending data to OSIsoft cloud services, the producer token should be the
+# security token obtained for a particular Tenant and Publisher; see
+# http://qi-docs.readthedocs.io/en/latest/OMF_Ingress_Specification.html#headers
+#PRODUCER_TOKEN = ""
+
+# ************************************************************************
+# Specify options for sending web requests to the target
+# ************************************************************************
+
+# If self-signed certificates are used (true by default),
+# do not verify HTTPS SSL certificates; normally, leave this as is
+VERIFY_SSL = False
+
+# Specify the timeout, in seconds, for sending web requests
+# (if it takes longer than this to send a message, an error will be thrown)
+WEB_REQUEST_TIMEOUT_SECONDS = 30
+
+# Specify a file to keep the data messages that could not be sent (for
+# example, while the endpoint cannot be reached) until they can be; they are
+# sent again, in order, after the next message that gets through.  Set this to
+# None to drop them instead
+SPOOL_FILE = "omf_spool.jsonl"
+
+# A channel's type, container, element and links are sent again every this
+# many seconds until they are accepted, and its values are only read from then on
+DEFINITION_RETRY_SECONDS = 10
+
+# Specify the NTP server that this device's clock is measured against:
+# timestamps are taken from the monotonic clock plus the offset measured at
+# startup and again every CLOCK_RESYNC_SECONDS, so the system clock is never
+# stepped and timestamps always increase (set NTP_SERVER to None to measure
+# against the system clock, if ntpd or chronyd already keeps it in sync)
+NTP_SERVER = "pool.ntp.org"
+CLOCK_RESYNC_SECONDS = 600
+
+# Specify which messages to print: "DEBUG" prints every outgoing message and
+# every response; "INFO" (the default) only prints progress and failures.
+# Printing is done on a background thread, and repeated failures (such as
+# while the endpoint is down) are only printed a few times a minute
+LOG_LEVEL = "INFO"
+
+# To record every OMF message that this script sends to a trace file, so that
+# its traffic can be replayed later without the hardware (with
+# python3 -m omf_edge.trace replay <file>), set this to a path, such as
+# "device.omftrace"
+TRACE_FILE = None
+
+# ************************************************************************
+# Turn off HTTPS warnings, if desired
+# (if the default certificate configuration was used by the PI Connector)
+# ************************************************************************
+
+# Messages are printed through the same logger as the shared helpers, so
+# that they come out in order
+log = get_logger("omf")
+
+# Suppress insecure HTTPS warnings, if an untrusted certificate is used by the target endpoint
+# Remove if targetting trusted targets
+try:
+    if not VERIFY_SSL:
+        requests.packages.urllib3.disable_warnings()
+
+except Exception as ex:
+        # Log any error, if it occurs
+        log.warning("Possible non-fatal error when disabling SSL validation: {0}", ex)
+
+# ************************************************************************
+# Send the gateway's type, asset and links, start the Phidget Manager, and
+# then loop indefinitely, registering every channel that is attached and
+# sending the values that all of the channels reported, with the values of
+# many channels in each message
+# (the settings are the same as in a configuration file for
+# SendOMFDataToPISystem_fromConfig.py; see omf_edge/runner.py)
+# ************************************************************************
+
+runner = DeviceRunner(build_config({
+    "endpoint": {
+        "url": TARGET_URL,
+        "producer_token": PRODUCER_TOKEN,
+        "verify_ssl": VERIFY_SSL,
+        "timeout_seconds": WEB_REQUEST_TIMEOUT_SECONDS,
+        "omf_cloud": SEND_DATA_TO_OSISOFT_CLOUD_SERVICES
+    },
+    "device": {
+        "name": DEVICE_NAME,
+        "location": DEVICE_LOCATION,
+        "assets_type": ASSETS_MESSAGE_TYPE_NAME,
+        "sync_clock": True,
+        "ntp_server": NTP_SERVER,
+        "clock_resync_seconds": CLOCK_RESYNC_SECONDS
+    },
+    "send": {
+        "sample_interval_seconds": NUMBER_OF_SECONDS_BETWEEN_VALUE_MESSAGES,
+        "send_interval_seconds": NUMBER_OF_SECONDS_BETWEEN_VALUE_MESSAGES,
+        "max_events_per_message": MAXIMUM_EVENTS_PER_MESSAGE,
+        "spool_file": SPOOL_FILE,
+        "definition_retry_seconds": DEFINITION_RETRY_SECONDS,
+        "loops_between_counter_reports": NUMBER_OF_LOOPS_BETWEEN_CAPTURE_REPORTS,
+        "trace_file": TRACE_FILE
+    },
+    "log": {
+        "level": LOG_LEVEL
+    }
+}))
+
+# The device name that you specified earlier will be used as the AF Element
+# name of the gateway; each channel's element is linked under it
+runner.add_gateway(PhidgetGateway(
+    runner.send_omf_message,
+    DEVICE_NAME,
+    data_interval_ms = PHIDGET_DATA_INTERVAL_MS,
+    buffer_size = PHIDGET_BUFFER_SIZE,
+    # !!! Note: if sending data to OCS, static types (and so, per-channel elements) are not included!
+    assets_typeid = None if SEND_DATA_TO_OSISOFT_CLOUD_SERVICES else ASSETS_MESSAGE_TYPE_NAME,
+    parent_element_name = DEVICE_NAME,
+    location = DEVICE_LOCATION,
+    registration_retry_seconds = DEFINITION_RETRY_SECONDS
+))
+if not runner.start():
+    log.error("Error: the gateway could not be set up; see the errors above")
+    sys.exit(1)
+runner.run()
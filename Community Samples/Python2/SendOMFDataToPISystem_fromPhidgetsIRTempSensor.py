@@ -29,23 +29,15 @@
 # ************************************************************************
 
 # Import packages
-import json
-import time
-import platform
-import socket
-import datetime
-import random # Used to generate sample data; comment out this line if real data is used
+import sys
 import requests
 
-# Import any special packages
-# for example, for a Raspberry PI,
-# import RPi.GPIO as GPIO
-import sys         # Used to parse error messages
-import os          # Used to sync the internal clock
-from Phidget22.Devices.TemperatureSensor import *
-from Phidget22.PhidgetException import *
-from Phidget22.Phidget import *
-from Phidget22.Net import *
+# Shared helpers from the omf_edge folder next to this script; the runner
+# sends the types, containers, asset and links, and then the data values
+# (the Phidget is read by the "phidgets_temperature" source in
+# omf_edge/sources.py, with the Phidget22 library)
+from omf_edge.runner import DeviceRunner, build_config
+from omf_edge.log import get_logger
 
 # ************************************************************************
 # Specify constant values (names, target URLS, et centera) needed by the script
@@ -85,6 +77,26 @@ DATA_VALUES_CONTAINER_ID = DEVICE_NAME + "_data_values_container"
 # Specify the number of seconds to sleep in between value messages
 NUMBER_OF_SECONDS_BETWEEN_VALUE_MESSAGES = 2
 
+# Specify how many seconds to wait for the sensors to warm up before they are read
+SENSOR_WARM_UP_SECONDS = 10
+
+# Specify the interval, in milliseconds, at which the Phidget reports new values
+# (its data rate); every value it reports is kept, and all of them are sent every
+# NUMBER_OF_SECONDS_BETWEEN_VALUE_MESSAGES.  Set this to 0 to use the fastest
+# rate that the device supports (its minimum data interval)
+PHIDGET_DATA_INTERVAL_MS = 0
+
+# Specify how many values can wait to be sent; if sending falls further
+# behind than this, new values are dropped (and counted)
+PHIDGET_BUFFER_SIZE = 60000
+
+# Specify the most events to send in one message;
+# each event takes about 60 bytes, and a message must stay under 192 KB
+MAXIMUM_EVENTS_PER_MESSAGE = 2000
+
+# Print how many values were captured, dropped and missed, once every this many loops
+NUMBER_OF_LOOPS_BETWEEN_CAPTURE_REPORTS = 300
+
 # Specify whether you're sending data to OSIsoft cloud services or not
 SEND_DATA_TO_OSISOFT_CLOUD_SERVICES = False
 
@@ -117,209 +129,25 @@ VERIFY_SSL = False
 # (if it takes longer than this to send a message, an error will be thrown)
 WEB_REQUEST_TIMEOUT_SECONDS = 30
 
-# ************************************************************************
-# Helper function: run any code needed to initialize local sensors, if necessary for this hardware
-# ************************************************************************
-
-# Below is where you can initialize any global variables that are needed by your applicatio;
-# certain sensors, for example, will require global interface or sensor variables
-# myExampleInterfaceKitGlobalVar = None
-
-# Define a variable for the Phidget
-ch = 0
-
-# Define helper functions to handle when the Phidget is connected or disconnected
-def PhidgetAttached(self):
-    try:
-        attached = self
-        print("\nAttach Event Detected (Information Below)")
-        print("===========================================")
-        print("Library Version: %s" % attached.getLibraryVersion())
-        print("Serial Number: %d" % attached.getDeviceSerialNumber())
-        print("Channel: %d" % attached.getChannel())
-        print("Channel Class: %s" % attached.getChannelClass())
-        print("Channel Name: %s" % attached.getChannelName())
-        print("Device ID: %d" % attached.getDeviceID())
-        print("Device Version: %d" % attached.getDeviceVersion())
-        print("Device Name: %s" % attached.getDeviceName())
-        print("Device Class: %d" % attached.getDeviceClass())
-        print("\n")
-
-    except PhidgetException as e:
-        print("Phidget Exception %i: %s" % (e.code, e.details))
-        print("Press Enter to Exit...\n")
-        readin = sys.stdin.read(1)
-        exit(1)   
-    
-def PhidgetDetached(self):
-    detached = self
-    try:
-        print("\nDetach event on Port %d Channel %d" % (detached.getHubPort(), detached.getChannel()))
-    except PhidgetException as e:
-        print("Phidget Exception %i: %s" % (e.code, e.details))
-        print("Press Enter to Exit...\n")
-        readin = sys.stdin.read(1)
-        exit(1)   
-
-def ErrorEvent(self, eCode, description):
-    print("Error %i : %s" % (eCode, description))
-
-# The following function is where you can insert specific initialization code to set up
-# sensors for a particular IoT module or platform
-def initialize_sensors():
-    print("\n--- Sensors initializing...")
-    try:
-	#For a raspberry pi, for example, to set up pins 4 and 5, you would add
-        #GPIO.setmode(GPIO.BCM)
-	#GPIO.setup(4, GPIO.IN)
-	#GPIO.setup(5, GPIO.IN)
-        print("--- Waiting 10 seconds for sensors to warm up...")
-        time.sleep(10)
-
-        # Activate the Phidget
-        global ch
-        ch = TemperatureSensor()
-        
-        # Assign event handlers
-        ch.setOnAttachHandler(PhidgetAttached)
-        ch.setOnDetachHandler(PhidgetDetached)
-        ch.setOnErrorHandler(ErrorEvent)
-
-        # Wait for the sensor to be attached
-        print("--- Waiting for the Phidget Object to be attached...")
-        ch.openWaitForAttachment(5000)
-        print("--- Sensors initialized!")
-		
-        # Sync the time on this device to an internet time server
-        try:
-            print('\n--- Syncing time...')
-            os.system('sudo service ntpd stop')
-            time.sleep(1)
-            os.system('sudo ntpd -gq')
-            time.sleep(1)
-            os.system('sudo service ntpd start')
-            print('--- Success! Time is ' + str(datetime.datetime.now()))
-        except:
-            print('Error syncing time!')
-
-    except Exception as ex:
-		# Log any error, if it occurs
-        print(str(datetime.datetime.now()) + " Error when initializing sensors: " + str(ex))
-
-# ************************************************************************
-# Helper function: REQUIRED: create a JSON message that contains sensor data values
-# ************************************************************************
-
-# The following function you can customize to allow this script to send along any
-# number of different data values, so long as the values that you send here match
-# up with the values defined in the "DataValuesType" OMF message type (see the next section)
-# In this example, this function simply generates two random values for the sensor values,
-# but here is where you could change this function to reference a library that actually
-# reads from sensors attached to the device that's running the script
-
-def create_data_values_message():
-    # Get the current timestamp in ISO format
-    timestamp = datetime.datetime.utcnow().isoformat() + 'Z'
-    # Read the Phidget
-    temperature = ch.ambientSensor.Temperature * 9/5 + 32
-    # Assemble a JSON object containing the streamId and any data values
-    return [
-        {
-            "containerid": DATA_VALUES_CONTAINER_ID,
-            "values": [
-                {
-                    "Time": timestamp,
-                    # Again, in this example,
-                    # we're just sending along random values for these two "sensors"
-                    #"Raw Sensor Reading 1": 100*random.random(),
-                    #"Raw Sensor Reading 2": 100*random.random()
-                    "Temperature": temperature
-                    # If you wanted to read, for example, the digital GPIO pins
-                    # 4 and 5 on a Raspberry PI,
-                    # you would add to the earlier package import section:
-                    # import RPi.GPIO as GPIO
-                    # then add the below 3 lines to the above initialize_sensors
-                    # function to set up the GPIO pins:
-                    # GPIO.setmode(GPIO.BCM)
-                    # GPIO.setup(4, GPIO.IN)
-                    # GPIO.setup(5, GPIO.IN)
-                    # and then lastly, you would change the two Raw Sensor reading lines above to
-                    # "Raw Sensor Reading 1": GPIO.input(4),
-                    # "Raw Sensor Reading 2": GPIO.input(5)
-                }
-            ]
-        }
-    ]
-
-
-# ************************************************************************
-# Helper function: REQUIRED: wrapper function for sending an HTTPS message
-# ************************************************************************
-
-# Define a helper function to allow easily sending web request messages;
-# this function can later be customized to allow you to port this script to other languages.
-# All it does is take in a data object and a message type, and it sends an HTTPS
-# request to the target OMF endpoint
-def send_omf_message_to_endpoint(action, message_type, message_json):
-    try:
-        # Assemble headers that contain the producer token and message type
-        # Note: in this example, the only action that is used is "create",
-        # which will work totally fine;
-        # to expand this application, you could modify it to use the "update"
-        # action to, for example, modify existing AF element template types
-        web_request_header = {
-            'producertoken': PRODUCER_TOKEN,
-            'messagetype': message_type,
-            'action': action,
-            'messageformat': 'JSON',
-            'omfversion': '1.0'
-        }
-        # !!! Note: if desired, ucomment the below line to print the outgoing message
-        print('\nOutgoing message: ' + json.dumps(message_json));
-        # Send the request, and collect the response; json.dumps is used to
-        # properly format the message JSON so that it can be sent as a web request
-        response = requests.post(
-            TARGET_URL,
-            headers=web_request_header,
-            data=json.dumps(message_json),
-            verify=VERIFY_SSL,
-            timeout=WEB_REQUEST_TIMEOUT_SECONDS
-        )
-        # Print a debug message, if desired; note: you should receive a
-        # response code 200 or 202 if the request was successful!
-        print(
-            'Response from sending a message of type ' +
-            '"{0}" with action "{1}": {2} {3}'.format(
-                message_type,
-                action,
-                response.status_code,
-                response.text
-            )
-        )
-    except Exception as ex:
-        # Log any error, if it occurs
-        print(str(datetime.datetime.now()) + " Error during web request: " + str(ex))
-
-# ************************************************************************
-# Turn off HTTPS warnings, if desired
-# (if the default certificate configuration was used by the PI Connector)
-# ************************************************************************
-
-# Suppress insecure HTTPS warnings, if an untrusted certificate is used by the target endpoint
-# Remove if targetting trusted targets
-try:
-    if not VERIFY_SSL:
-        requests.packages.urllib3.disable_warnings()
-
-except Exception as ex:
-        # Log any error, if it occurs
-        print(str(datetime.datetime.now()) + " Possible non-fatal error when disabling SSL validation: " + str(ex))
-
-print(
-    '\n--- Setup: targeting endpoint "' + TARGET_URL + '"...' +
-    '\n--- Now sending types, defining containers, and creating assets and links...' +
-    '\n--- (Note: a successful message will return a 20X response code.)\n'
-)
+# Specify the NTP server that this device's clock is measured against:
+# timestamps are taken from the monotonic clock plus the offset measured at
+# startup and again every CLOCK_RESYNC_SECONDS, so the system clock is never
+# stepped and timestamps always increase (set NTP_SERVER to None to measure
+# against the system clock, if ntpd or chronyd already keeps it in sync)
+NTP_SERVER = "pool.ntp.org"
+CLOCK_RESYNC_SECONDS = 600
+
+# Specify which messages to print: "DEBUG" prints every outgoing message and
+# every response; "INFO" (the default) only prints progress and failures.
+# Printing is done on a background thread, and repeated failures (such as
+# while the endpoint is down) are only printed a few times a minute
+LOG_LEVEL = "INFO"
+
+# To record every OMF message that this script sends to a trace file, so that
+# its traffic can be replayed later without the hardware (with
+# python3 -m omf_edge.trace replay <file>), set this to a path, such as
+# "device.omftrace"
+TRACE_FILE = None
 
 # ************************************************************************
 # Create a JSON packet to define the types of streams that will be sent
@@ -330,13 +158,11 @@ DYNAMIC_TYPES_MESSAGE_JSON = [
     # ************************************************************************
     # There are several different message types that will be used by this script, but
     # you can customize this script for your own needs by modifying the types:
-    # First, you can modify the "AssetsType", which will allow you to customize which static
-    # attributes are added to the new PI AF Element that will be created, and second,
-    # you can modify the "DataValuesType", which will allow you to customize this script to send
-    # additional sensor values, in addition to (or instead of) the two shown here
+    # you can modify the "DataValuesType", which defines the values that are sent
+    # (the "AssetsType", which defines the static attributes of the new PI AF
+    # Element, is defined by the runner; see omf_edge/runner.py)
 
-    # This values type is going to be used to send real-time values; feel free to rename the
-    # values from "Raw Sensor Reading 1" to, say, "Temperature", or "Pressure"
+    # This values type is going to be used to send real-time values
     # Note:
     # all keywords ("id", "type", "classification", etc. are case sensitive!)
     # For a list of the specific keywords used in these messages,
@@ -352,182 +178,83 @@ DYNAMIC_TYPES_MESSAGE_JSON = [
                 "type": "string",
                 "isindex": True
             },
+            # The temperature is sent in Fahrenheit
             "Temperature": {
                 "type": "number"
             }
-            # For example, to allow you to send a string-type live data value,
-            # such as "Status", you would add
-            #"Status": {
-            #   "type": "string"
-            #}
         }
     }
 ]
 
 # ************************************************************************
-# Send the DYNAMIC types message, so that these types can be referenced in all later messages
+# Turn off HTTPS warnings, if desired
+# (if the default certificate configuration was used by the PI Connector)
 # ************************************************************************
 
-send_omf_message_to_endpoint("create", "Type", DYNAMIC_TYPES_MESSAGE_JSON)
-
-# !!! Note: if sending data to OCS, static types are not included!
-if not SEND_DATA_TO_OSISOFT_CLOUD_SERVICES:
-    STATIC_TYPES_MESSAGE_JSON = [
-        # This asset type is used to define a PI AF Element that will be created;
-        # this type also defines two static string attributes that will be created
-        # as well; feel free to rename these or add additional
-        # static attributes for each Element (PI Point attributes will be added later)
-        # The name of this type will also end up being part of the name of the PI AF Element template
-        # that is automatically created
-        {
-            "id": ASSETS_MESSAGE_TYPE_NAME,
-            "type": "object",
-            "classification": "static",
-            "properties": {
-                "Name": {
-                    "type": "string",
-                    "isindex": True
-                },
-                "Device Type": {
-                    "type": "string"
-                },
-                "Location": {
-                    "type": "string"
-                },
-                "Data Ingress Method": {
-                    "type": "string"
-                }
-                # For example, to add a number-type static
-                # attribute for the device model, you would add
-                # "Model": {
-                #   "type": "number"
-                #}
-            }
-        }
-    ]
-
-    # ************************************************************************
-    # Send the STATIC types message, so that these types can be referenced in all later messages
-    # ************************************************************************
-
-    send_omf_message_to_endpoint("create", "Type", STATIC_TYPES_MESSAGE_JSON)
-
-# ************************************************************************
-# Create a JSON packet to define containerids and the type
-# (using the types listed above) for each new data events container
-# ************************************************************************
+# Messages are printed through the same logger as the shared helpers, so
+# that they come out in order
+log = get_logger("omf")
 
-# The device name that you specified earlier will be used as the AF Element name!
-NEW_AF_ELEMENT_NAME = DEVICE_NAME
+# Suppress insecure HTTPS warnings, if an untrusted certificate is used by the target endpoint
+# Remove if targetting trusted targets
+try:
+    if not VERIFY_SSL:
+        requests.packages.urllib3.disable_warnings()
 
-CONTAINERS_MESSAGE_JSON = [
-    {
-        "id": DATA_VALUES_CONTAINER_ID,
-        "typeid": DATA_VALUES_MESSAGE_TYPE_NAME
-    }
-]
+except Exception as ex:
+        # Log any error, if it occurs
+        log.warning("Possible non-fatal error when disabling SSL validation: {0}", ex)
 
 # ************************************************************************
-# Send the container message, to instantiate this particular container;
-# we can now directly start sending data to it using its Id
+# Send the types, containers, asset and links, open the Phidget, and then
+# loop indefinitely, sending every value that it reported
+# (the settings are the same as in a configuration file for
+# SendOMFDataToPISystem_fromConfig.py; see omf_edge/runner.py)
 # ************************************************************************
 
-send_omf_message_to_endpoint("create", "Container", CONTAINERS_MESSAGE_JSON)
-
-# !!! Note: if sending data to OCS, static types are not included!
-if not SEND_DATA_TO_OSISOFT_CLOUD_SERVICES:
-    # ************************************************************************
-    # Create a JSON packet to containing the asset and
-    # linking data for the PI AF asset that will be made
-    # ************************************************************************
-
-    # Here is where you can specify values for the static PI AF attributes;
-    # in this case, we're auto-populating the Device Type,
-    # but you can manually hard-code in values if you wish
-    # we also add the LINKS to be made, which will both position the new PI AF
-    # Element, so it will show up in AF, and will associate the PI Points
-    # that will be created with that Element
-    ASSETS_AND_LINKS_MESSAGE_JSON = [
+runner = DeviceRunner(build_config({
+    "endpoint": {
+        "url": TARGET_URL,
+        "producer_token": PRODUCER_TOKEN,
+        "verify_ssl": VERIFY_SSL,
+        "timeout_seconds": WEB_REQUEST_TIMEOUT_SECONDS,
+        "omf_cloud": SEND_DATA_TO_OSISOFT_CLOUD_SERVICES
+    },
+    "device": {
+        "name": DEVICE_NAME,
+        "location": DEVICE_LOCATION,
+        "assets_type": ASSETS_MESSAGE_TYPE_NAME,
+        "sync_clock": True,
+        "ntp_server": NTP_SERVER,
+        "clock_resync_seconds": CLOCK_RESYNC_SECONDS,
+        "sensor_warm_up_seconds": SENSOR_WARM_UP_SECONDS
+    },
+    "send": {
+        "sample_interval_seconds": NUMBER_OF_SECONDS_BETWEEN_VALUE_MESSAGES,
+        "send_interval_seconds": NUMBER_OF_SECONDS_BETWEEN_VALUE_MESSAGES,
+        "max_events_per_message": MAXIMUM_EVENTS_PER_MESSAGE,
+        "loops_between_counter_reports": NUMBER_OF_LOOPS_BETWEEN_CAPTURE_REPORTS,
+        "trace_file": TRACE_FILE
+    },
+    "log": {
+        "level": LOG_LEVEL
+    },
+    "types": DYNAMIC_TYPES_MESSAGE_JSON,
+    "containers": [
         {
-            # This will end up creating a new PI AF Element with
-            # this specific name and static attribute values
-            "typeid": ASSETS_MESSAGE_TYPE_NAME,
-            "values": [
-                {
-                    "Name": NEW_AF_ELEMENT_NAME,
-                    "Device Type": (
-                        platform.machine() + " - " + platform.platform() + " - " + platform.processor()
-                    ),
-                    "Location": DEVICE_LOCATION,
-                    "Data Ingress Method": "OMF"
+            "id": DATA_VALUES_CONTAINER_ID,
+            "typeid": DATA_VALUES_MESSAGE_TYPE_NAME,
+            "source": {
+                "type": "phidgets_temperature",
+                "options": {
+                    "data_interval_ms": PHIDGET_DATA_INTERVAL_MS,
+                    "buffer_size": PHIDGET_BUFFER_SIZE
                 }
-            ]
-        },
-        {
-            "typeid": "__Link",
-            "values": [
-                # This first link will locate such a newly created AF Element under
-                # the root PI element targeted by the PI Connector in your target AF database
-                # This was specfied in the Connector Relay Admin page; note that a new
-                # parent element, with the same name as the PRODUCER_TOKEN, will also be made
-                {
-                    "Source": {
-                        "typeid": ASSETS_MESSAGE_TYPE_NAME,
-                        "index": "_ROOT"
-                    },
-                    "Target": {
-                        "typeid": ASSETS_MESSAGE_TYPE_NAME,
-                        "index": NEW_AF_ELEMENT_NAME
-                    }
-                },
-                # This second link will map new PI Points (created by messages
-                # sent to the data values container) to a newly create element
-                {
-                    "Source": {
-                        "typeid": ASSETS_MESSAGE_TYPE_NAME,
-                        "index": NEW_AF_ELEMENT_NAME
-                    },
-                    "Target": {
-                        "containerid": DATA_VALUES_CONTAINER_ID
-                    }
-                }
-            ]
+            }
         }
     ]
-
-    # ************************************************************************
-    # Send the message to create the PI AF asset; it won't appear in PI AF,
-    # though, because it hasn't yet been positioned...
-    # ************************************************************************
-
-    send_omf_message_to_endpoint("create", "Data", ASSETS_AND_LINKS_MESSAGE_JSON)
-
-# ************************************************************************
-# Initialize sensors prior to sending data (if needed), using the function defined earlier
-# ************************************************************************
-
-initialize_sensors()
-
-# ************************************************************************
-# Finally, loop indefinitely, sending random events
-# conforming to the value type that we defined earlier
-# ************************************************************************
-
-print(
-    '\n--- Now sending live data every ' + str(NUMBER_OF_SECONDS_BETWEEN_VALUE_MESSAGES) +
-    ' second(s) for device "' + NEW_AF_ELEMENT_NAME + '"... (press CTRL+C to quit at any time)\n'
-)
-if not SEND_DATA_TO_OSISOFT_CLOUD_SERVICES:
-    print(
-        '--- (Look for a new AF Element named "' + NEW_AF_ELEMENT_NAME + '".)\n'
-    )
-while True:
-    # Call the custom function that builds a JSON object that
-    # contains new data values; see the beginning of this script
-    VALUES_MESSAGE_JSON = create_data_values_message()
-
-    # Send the JSON message to the target URL
-    send_omf_message_to_endpoint("create", "Data", VALUES_MESSAGE_JSON)
-
-    # Send the next message after the required interval
-    time.sleep(NUMBER_OF_SECONDS_BETWEEN_VALUE_MESSAGES)
+}))
+if not runner.start():
+    log.error("Error: the device could not be set up; see the errors above")
+    sys.exit(1)
+runner.run()
@@ -0,0 +1,106 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Benchmark: dict-per-event OMF encoding vs. columnar NumPy encoding, for one
+# second of a 1 kHz source with 10 number properties (like a 10-axis IMU)
+#
+# Run from the Python2 folder with: python benchmarks/bench_columnar.py
+# ************************************************************************
+
+# Import packages
+import datetime
+import json
+import os
+import sys
+import timeit
+
+import numpy as np
+
+# Make the omf_edge folder (next to the device scripts) importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from omf_edge.columnar import ColumnarBuffer, now_timestamp_us
+
+SAMPLE_RATE_HZ = 1000
+PROPERTY_NAMES = [
+    "X-acceleration", "Y-acceleration", "Z-acceleration",
+    "X-rotation", "Y-rotation", "Z-rotation",
+    "X-magnetic field", "Y-magnetic field", "Z-magnetic field",
+    "Board Temperature"
+]
+CONTAINER_ID = "benchmark_data_values_container"
+REPEATS = 20
+
+# One second of simulated samples, generated up front so that only encoding is timed
+start_us = now_timestamp_us()
+TIMESTAMPS_US = start_us + np.arange(SAMPLE_RATE_HZ, dtype=np.int64) * (1000000 // SAMPLE_RATE_HZ)
+SAMPLES = np.random.standard_normal((SAMPLE_RATE_HZ, len(PROPERTY_NAMES)))
+SAMPLE_ROWS = SAMPLES.tolist()
+TIMESTAMP_LIST = TIMESTAMPS_US.tolist()
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# The existing path: one dict per event, with a datetime timestamp, then json.dumps
+def encode_dict_per_event():
+    values = []
+    for timestamp_us, row in zip(TIMESTAMP_LIST, SAMPLE_ROWS):
+        event = {"Time": (EPOCH + datetime.timedelta(microseconds=timestamp_us)).isoformat() + 'Z'}
+        for name, value in zip(PROPERTY_NAMES, row):
+            event[name] = value
+        values.append(event)
+    return json.dumps([{"containerid": CONTAINER_ID, "values": values}])
+
+# The columnar path, one append per sample (as a sampling loop would do it)
+buffer = ColumnarBuffer(CONTAINER_ID, PROPERTY_NAMES, capacity=SAMPLE_RATE_HZ)
+def encode_columnar_per_sample():
+    buffer.clear()
+    for timestamp_us, row in zip(TIMESTAMP_LIST, SAMPLE_ROWS):
+        buffer.append(timestamp_us, row)
+    return buffer.encode_message()
+
+# The columnar path, with the samples appended as one block (as a driver that
+# delivers FIFO blocks of samples would do it)
+def encode_columnar_block():
+    buffer.clear()
+    buffer.append_block(TIMESTAMPS_US, SAMPLES)
+    return buffer.encode_message()
+
+# As above, but with floats written at 6 significant digits
+rounded_buffer = ColumnarBuffer(CONTAINER_ID, PROPERTY_NAMES, capacity=SAMPLE_RATE_HZ, float_format='%.6g')
+def encode_columnar_block_6g():
+    rounded_buffer.clear()
+    rounded_buffer.append_block(TIMESTAMPS_US, SAMPLES)
+    return rounded_buffer.encode_message()
+
+def report(label, function, baseline=None):
+    seconds = min(timeit.repeat(function, number=1, repeat=REPEATS))
+    per_event_us = seconds / SAMPLE_RATE_HZ * 1000000
+    line = '{0:<36} {1:8.2f} ms per block  {2:6.2f} us per event'.format(label, seconds * 1000, per_event_us)
+    if baseline is not None:
+        line += '  ({0:.1f}x faster)'.format(baseline / seconds)
+    print(line)
+    return seconds
+
+if __name__ == '__main__':
+    # Check that every path decodes to the same events before timing anything
+    expected = json.loads(encode_dict_per_event())
+    assert json.loads(encode_columnar_per_sample()) == expected
+    assert json.loads(encode_columnar_block()) == expected
+
+    print('\n--- {0} events/s x {1} properties, best of {2} runs\n'.format(
+        SAMPLE_RATE_HZ, len(PROPERTY_NAMES), REPEATS))
+    baseline = report('dict per event + json.dumps', encode_dict_per_event)
+    report('columnar, append per sample', encode_columnar_per_sample, baseline)
+    report('columnar, append as one block', encode_columnar_block, baseline)
+    report('columnar, one block, %.6g floats', encode_columnar_block_6g, baseline)
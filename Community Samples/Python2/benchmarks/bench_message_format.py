@@ -0,0 +1,93 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+
+# ************************************************************************
+# Benchmark: bytes per event and encoding time per event of the message
+# formats, for data messages of 1 to 1000 events (one container each):
+# plain JSON, JSON and gzip (as the sender sends it when compression is on),
+# the compiled, validating JSON encoder and gzip, and MessagePack, with and
+# without gzip.  Every encoded message is decoded again and compared with
+# the original
+#
+# Run from the Python2 folder with: python benchmarks/bench_message_format.py
+# (the MessagePack rows need: pip install msgpack)
+# ************************************************************************
+
+# Import packages
+import gzip
+import json
+import os
+import sys
+import timeit
+
+# Make the omf_edge folder (next to the device scripts) importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from omf_edge.message_format import JSONFormat, MessagePackFormat
+from omf_edge.schema import SchemaRegistry
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_schema import CONTAINERS_MESSAGE, TYPES_MESSAGE, random_event
+
+BATCH_SIZES = (1, 10, 100, 1000)
+REPEATS = 20
+
+def gzipped(body):
+    return gzip.compress(body.encode('utf-8') if isinstance(body, str) else body)
+
+def body_length(body):
+    return len(body.encode('utf-8') if isinstance(body, str) else body)
+
+if __name__ == '__main__':
+    registry = SchemaRegistry()
+    registry.add_types(TYPES_MESSAGE)
+    registry.add_containers(CONTAINERS_MESSAGE)
+    json_format = JSONFormat()
+    encoders = [
+        ('json.dumps', lambda message: json.dumps(message), json_format.decode),
+        ('json + gzip', lambda message: gzipped(json.dumps(message)),
+         lambda body: json_format.decode(gzip.decompress(body))),
+        ('validated json + gzip', lambda message: gzipped(registry.encode_data_message(message)),
+         lambda body: json_format.decode(gzip.decompress(body)))
+    ]
+    try:
+        msgpack_format = MessagePackFormat()
+    except ImportError as ex:
+        print('Skipping the MessagePack rows: {0}'.format(ex))
+    else:
+        msgpack_format.add_types(TYPES_MESSAGE)
+        msgpack_format.add_containers(CONTAINERS_MESSAGE)
+        encoders += [
+            ('msgpack', lambda message: msgpack_format.encode('data', message), msgpack_format.decode),
+            ('msgpack + gzip', lambda message: gzipped(msgpack_format.encode('data', message)),
+             lambda body: msgpack_format.decode(gzip.decompress(body)))
+        ]
+
+    property_counts = dict((type_definition["id"], len(type_definition["properties"]))
+                           for type_definition in TYPES_MESSAGE)
+    for container in CONTAINERS_MESSAGE:
+        print('\n--- {0} ({1} properties), best of {2} runs\n'.format(
+            container["typeid"], property_counts[container["typeid"]], REPEATS))
+        print('{0:<24} {1:>8} {2:>14} {3:>16}'.format('format', 'events', 'bytes/event', 'encode ns/event'))
+        for batch_size in BATCH_SIZES:
+            message = [{
+                "containerid": container["id"],
+                "values": [random_event(container["typeid"]) for _ in range(batch_size)]
+            }]
+            for name, encode, decode in encoders:
+                body = encode(message)
+                assert decode(body) == message, name
+                seconds = min(timeit.repeat(lambda: encode(message), number=1, repeat=REPEATS))
+                print('{0:<24} {1:>8} {2:>14.1f} {3:>16,.0f}'.format(
+                    name, batch_size, body_length(body) / float(batch_size), seconds * 1e9 / batch_size))
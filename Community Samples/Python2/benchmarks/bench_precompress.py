@@ -0,0 +1,148 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+
+# ************************************************************************
+# Benchmark: how much smaller data messages get with the pre-compression
+# stage of omf_edge.precompress, on a sensor trace cut into batches of
+# 10 to 1000 events.  For each batch size, it compares the bytes per event of:
+#   "json + gzip"          - the events as they arrived (one entry per
+#                            container per sample, as the device scripts
+#                            send them), json.dumps and gzip
+#   "grouped + gzip"       - grouped by container and type, written by the
+#                            compiled encoder (properties in type order), gzip
+#   "grouped + dictionary" - the same, compressed with the preset dictionary
+# By default the trace is a simulated one: a BeagleBone Blue IMU (10 slowly
+# drifting, noisy readings at 100 Hz) and the tutorial's three dynamic
+# containers.  To use a recorded trace instead, pass one or more spool or
+# dead-letter files of the runner (one data message per line) with --trace,
+# and the runner configuration file that defines their types with --config.
+#
+# Run from the Python2 folder with: python benchmarks/bench_precompress.py
+# ************************************************************************
+
+# Import packages
+import argparse
+import datetime
+import gzip
+import json
+import os
+import random
+import sys
+
+# Make the omf_edge folder (next to the device scripts) importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from omf_edge.precompress import MessagePreCompressor, deflate, dictionary_id, inflate
+from omf_edge.runner import load_config
+from omf_edge.schema import SchemaRegistry
+# The tutorial's types, and the BeagleBone Blue type
+from bench_schema import CONTAINERS_MESSAGE, TYPES_MESSAGE, random_event
+
+BATCH_SIZES = (10, 100, 1000)
+
+# ************************************************************************
+# Traces: lists of (containerid, event), in the order they were read
+# ************************************************************************
+
+def simulated_trace(seconds, rate_hz=100):
+    imu_names = [name for name in TYPES_MESSAGE[3]["properties"] if name != "Time"]
+    levels = dict((name, random.uniform(-10, 10)) for name in imu_names)
+    start = datetime.datetime(2018, 6, 11, 19, 3, 42)
+    trace = []
+    for sample in range(int(seconds * rate_hz)):
+        timestamp = (start + datetime.timedelta(seconds=float(sample) / rate_hz)).isoformat() + 'Z'
+        event = {"Time": timestamp}
+        for name in imu_names:
+            levels[name] += random.gauss(0, 0.01)
+            # Readings as a driver returns them: a drifting level, quantized noise
+            event[name] = levels[name] + round(random.gauss(0, 0.05), 3)
+        trace.append(("BBBlueContainer", event))
+        if sample % rate_hz == 0:
+            # The tutorial's containers, once a second
+            for container in CONTAINERS_MESSAGE[:3]:
+                event = random_event(container["typeid"])
+                event[list(event)[0]] = timestamp
+                trace.append((container["id"], event))
+    return trace
+
+def recorded_trace(paths):
+    trace = []
+    for path in paths:
+        with open(path) as trace_file:
+            for line in trace_file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get('messagetype', 'data').lower() != 'data' or entry.get('encoding'):
+                    continue
+                for stream in json.loads(entry['body']):
+                    if 'containerid' in stream:
+                        trace.extend((stream['containerid'], event) for event in stream['values'])
+    return trace
+
+# The events of a trace, as they arrived: one entry per event
+def as_arrived(trace):
+    return [{"containerid": containerid, "values": [event]} for containerid, event in trace]
+
+# ************************************************************************
+# The benchmark
+# ************************************************************************
+
+def run(trace, types_message, containers_message):
+    registry = SchemaRegistry()
+    registry.add_types(types_message)
+    registry.add_containers(containers_message)
+    precompressor = MessagePreCompressor()
+    precompressor.add_types(types_message)
+    precompressor.add_containers(containers_message)
+    dictionary = precompressor.dictionary()
+    dictionaries = {dictionary_id(dictionary): dictionary}
+
+    print('\n--- {0} events; preset dictionary of {1} bytes\n'.format(len(trace), len(dictionary)))
+    print('{0:>8} {1:>14} {2:>14} {3:>16} {4:>22} {5:>12}'.format(
+        'events', 'json bytes', 'json + gzip', 'grouped + gzip', 'grouped + dictionary', 'improvement'))
+    for batch_size in BATCH_SIZES:
+        totals = [0, 0, 0, 0]
+        for first in range(0, len(trace), batch_size):
+            message = as_arrived(trace[first:first + batch_size])
+            body = json.dumps(message)
+            grouped = precompressor.group(message)
+            grouped_body = registry.encode_data_message(grouped)
+            compressed = deflate(grouped_body, dictionary)
+            assert json.loads(inflate(compressed, dictionaries).decode('utf-8')) == grouped
+            totals[0] += len(body)
+            totals[1] += len(gzip.compress(body.encode('utf-8')))
+            totals[2] += len(gzip.compress(grouped_body.encode('utf-8')))
+            totals[3] += len(compressed)
+        per_event = [float(total) / len(trace) for total in totals]
+        print('{0:>8} {1:>14.1f} {2:>8.1f} ({3:>3.1f}x) {4:>9.1f} ({5:>3.1f}x) {6:>15.1f} ({7:>3.1f}x) {8:>11.2f}x'.format(
+            batch_size, per_event[0], per_event[1], per_event[0] / per_event[1], per_event[2],
+            per_event[0] / per_event[2], per_event[3], per_event[0] / per_event[3], per_event[1] / per_event[3]))
+    print('\n(bytes per event, with the compression ratio against plain JSON; the improvement is'
+          ' "json + gzip" divided by "grouped + dictionary")')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compression of data messages with and without pre-compression')
+    parser.add_argument('--trace', nargs='*', default=[], help='spool or dead-letter files of the runner')
+    parser.add_argument('--config', help='the runner configuration file that defines the types of the trace')
+    parser.add_argument('--seconds', type=float, default=60, help='length of the simulated trace')
+    args = parser.parse_args()
+    if args.trace:
+        if not args.config:
+            parser.error('--trace needs --config, for the types of the trace')
+        config = load_config(args.config)
+        run(recorded_trace(args.trace), config["types"],
+            [{"id": container["id"], "typeid": container["typeid"]} for container in config["containers"]])
+    else:
+        run(simulated_trace(args.seconds), TYPES_MESSAGE, CONTAINERS_MESSAGE)
@@ -0,0 +1,105 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Benchmark: memory per buffered reading, for the OMF message tree that
+# create_data_values_message returns vs. compact reading records, using the
+# BeagleBone Blue data values type (10 number properties plus "Time")
+#
+# Run from the Python2 folder with: python benchmarks/bench_records.py
+# ************************************************************************
+
+# Import packages
+import datetime
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# Make the omf_edge folder (next to the device scripts) importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from omf_edge.records import make_reading_class, PackedReadings
+
+NUMBER_OF_READINGS = 10000
+CONTAINER_ID = "BBBlue Robot Controller 01_data_values_container"
+
+# Same properties as the type in SendOMFDataToPISystemFromBeagleBoneBlue.py
+DATA_VALUES_TYPE = {
+    "id": "BBBlue Robot Controller 01_data_values_type",
+    "type": "object",
+    "classification": "dynamic",
+    "properties": {
+        "Time": {"format": "date-time", "type": "string", "isindex": True},
+        "X-acceleration": {"type": "number"},
+        "Y-acceleration": {"type": "number"},
+        "Z-acceleration": {"type": "number"},
+        "X-rotation": {"type": "number"},
+        "Y-rotation": {"type": "number"},
+        "Z-rotation": {"type": "number"},
+        "X-magnetic field": {"type": "number"},
+        "Y-magnetic field": {"type": "number"},
+        "Z-magnetic field": {"type": "number"},
+        "Board Temperature": {"type": "number"}
+    }
+}
+PROPERTY_NAMES = [name for name in DATA_VALUES_TYPE["properties"] if name != "Time"]
+BBBlueReading = make_reading_class(DATA_VALUES_TYPE)
+
+def sample():
+    return [random.random() for _ in PROPERTY_NAMES]
+
+# What the device scripts build today, once per reading
+def buffer_message_trees():
+    readings = []
+    for _ in range(NUMBER_OF_READINGS):
+        values = sample()
+        event = {"Time": datetime.datetime.utcnow().isoformat() + 'Z'}
+        for name, value in zip(PROPERTY_NAMES, values):
+            event[name] = value
+        readings.append([{"containerid": CONTAINER_ID, "values": [event]}])
+    return readings
+
+def buffer_slots_records():
+    return [BBBlueReading(time.time(), *sample()) for _ in range(NUMBER_OF_READINGS)]
+
+def buffer_packed_readings():
+    readings = PackedReadings(BBBlueReading)
+    for _ in range(NUMBER_OF_READINGS):
+        readings.append(time.time(), *sample())
+    return readings
+
+# Measures the memory still allocated once the buffer has been built
+def bytes_per_reading(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    buffered = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del buffered
+    return (after - before) / float(NUMBER_OF_READINGS)
+
+if __name__ == '__main__':
+    print('\n--- Memory per buffered reading ({0} readings of {1} numbers + timestamp)\n'.format(
+        NUMBER_OF_READINGS, len(PROPERTY_NAMES)))
+    baseline = bytes_per_reading(buffer_message_trees)
+    print('{0:<34} {1:7.0f} bytes'.format('OMF message tree (list/dict)', baseline))
+    for label, build in (
+        ('__slots__ reading record', buffer_slots_records),
+        ('PackedReadings (array of doubles)', buffer_packed_readings)
+    ):
+        size = bytes_per_reading(build)
+        print('{0:<34} {1:7.0f} bytes  ({2:.1f}x smaller)'.format(label, size, baseline / size))
@@ -0,0 +1,103 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Benchmark: throughput of the compiled (validating) OMF encoder vs. the
+# unvalidated json.dumps path, for the tutorial's dynamic types (with their
+# integer, float64, StringEnum and IntegerEnum properties) and for the
+# BeagleBone Blue data values type
+#
+# Run from the Python2 folder with: python benchmarks/bench_schema.py
+# ************************************************************************
+
+# Import packages
+import datetime
+import json
+import os
+import random
+import sys
+import timeit
+
+# Make the omf_edge folder (next to the device scripts) importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from omf_edge.schema import SchemaRegistry
+
+EVENTS_PER_CONTAINER = 250
+REPEATS = 20
+
+def timestamp_property():
+    return {"format": "date-time", "type": "string", "isindex": True}
+
+# The dynamic types from Tutorials/Python_PI/Python_PI.py, and the BeagleBone Blue type
+TYPES_MESSAGE = [
+    {"id": "FirstDynamicType", "classification": "dynamic", "type": "object", "properties": {
+        "timestamp": timestamp_property(),
+        "IntegerProperty": {"type": "integer"}}},
+    {"id": "SecondDynamicType", "classification": "dynamic", "type": "object", "properties": {
+        "timestamp": timestamp_property(),
+        "NumberProperty1": {"type": "number", "format": "float64"},
+        "NumberProperty2": {"type": "number", "format": "float64"},
+        "StringEnum": {"type": "string", "enum": ["False", "True"]}}},
+    {"id": "ThirdDynamicType", "classification": "dynamic", "type": "object", "properties": {
+        "timestamp": timestamp_property(),
+        "IntegerEnum": {"type": "integer", "format": "int16", "enum": [0, 1]}}},
+    {"id": "BBBlueType", "classification": "dynamic", "type": "object", "properties": dict(
+        [("Time", timestamp_property())] +
+        [(name, {"type": "number"}) for name in (
+            "X-acceleration", "Y-acceleration", "Z-acceleration", "X-rotation", "Y-rotation",
+            "Z-rotation", "X-magnetic field", "Y-magnetic field", "Z-magnetic field", "Board Temperature")])}
+]
+CONTAINERS_MESSAGE = [
+    {"id": "Container1", "typeid": "FirstDynamicType"},
+    {"id": "Container3", "typeid": "SecondDynamicType"},
+    {"id": "Container4", "typeid": "ThirdDynamicType"},
+    {"id": "BBBlueContainer", "typeid": "BBBlueType"}
+]
+
+def now():
+    return datetime.datetime.utcnow().isoformat() + 'Z'
+
+def random_event(typeid):
+    if typeid == "FirstDynamicType":
+        return {"timestamp": now(), "IntegerProperty": int(100 * random.random())}
+    if typeid == "SecondDynamicType":
+        return {"timestamp": now(), "NumberProperty1": 100 * random.random(),
+                "NumberProperty2": 100 * random.random(), "StringEnum": random.choice(["False", "True"])}
+    if typeid == "ThirdDynamicType":
+        return {"timestamp": now(), "IntegerEnum": random.choice([0, 1])}
+    event = {"Time": now()}
+    for name in TYPES_MESSAGE[3]["properties"]:
+        if name != "Time":
+            event[name] = random.random()
+    return event
+
+if __name__ == '__main__':
+    registry = SchemaRegistry()
+    registry.add_types(TYPES_MESSAGE)
+    registry.add_containers(CONTAINERS_MESSAGE)
+
+    print('\n--- Events per second, {0} events per container, best of {1} runs\n'.format(
+        EVENTS_PER_CONTAINER, REPEATS))
+    print('{0:<20} {1:>16} {2:>20}'.format('type', 'json.dumps', 'validate + encode'))
+    for container in CONTAINERS_MESSAGE:
+        message = [{
+            "containerid": container["id"],
+            "values": [random_event(container["typeid"]) for _ in range(EVENTS_PER_CONTAINER)]
+        }]
+        assert json.loads(registry.encode_data_message(message)) == message
+        unvalidated = min(timeit.repeat(lambda: json.dumps(message), number=1, repeat=REPEATS))
+        validated = min(timeit.repeat(lambda: registry.encode_data_message(message), number=1, repeat=REPEATS))
+        print('{0:<20} {1:16,.0f} {2:20,.0f}  ({3:.2f}x)'.format(
+            container["typeid"], EVENTS_PER_CONTAINER / unvalidated,
+            EVENTS_PER_CONTAINER / validated, unvalidated / validated))
@@ -0,0 +1,304 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Benchmark: end-to-end throughput of the OMF send path (encode, compress,
+# POST) against the local ingress emulator, for two senders:
+#   "tutorial" - the path of Tutorials/Python_PI/Python_PI.py: json.dumps,
+#                gzip.compress, and a new requests.post for every message
+#   "runner"   - the path of the configuration-driven runner: the compiled
+#                SchemaRegistry encoder, and an OMFSender with a pooled session
+# swept over batch size (events per message), container count, compression
+# on and off, and concurrency (sending threads).  For each combination it
+# reports events per second, bytes sent per event, p50/p99 request latency
+# and client CPU time per event, and checks with the emulator that every
+# event arrived.  The emulator runs in its own process, so that its CPU time
+# is not counted.  Results are written to a JSON file; pass an earlier one
+# with --baseline to compare against it.
+#
+# Run from the Python2 folder with: python benchmarks/bench_send_path.py
+# (or with --quick for a short sweep)
+# ************************************************************************
+
+# Import packages
+import argparse
+import datetime
+import gzip
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+# Make the omf_edge folder (next to the device scripts) importable
+PYTHON2_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PYTHON2_FOLDER)
+from omf_edge.schema import SchemaRegistry
+from omf_edge.sender import OMFSender, omf_headers
+# The tutorial's types and random values
+from bench_schema import TYPES_MESSAGE, random_event
+
+PRODUCER_TOKEN = 'benchmark'
+
+# ************************************************************************
+# The emulator, in its own process
+# ************************************************************************
+
+def free_port():
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+def start_emulator(latency_ms):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'omf_edge.ingress_emulator', '--port', str(port), '--latency-ms', str(latency_ms)],
+        cwd=PYTHON2_FOLDER, stdout=subprocess.DEVNULL
+    )
+    base_url = 'http://127.0.0.1:{0}'.format(port)
+    for _ in range(100):
+        try:
+            requests.get(base_url + '/stats', timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('The ingress emulator did not start')
+
+# ************************************************************************
+# The two send paths; each returns (status code, bytes sent, latency)
+# ************************************************************************
+
+class TutorialPath(object):
+
+    def __init__(self, url, compression):
+        self.url = url
+        self.compression = compression
+
+    def send(self, message_type, message_json):
+        start = time.perf_counter()
+        if self.compression:
+            body = gzip.compress(bytes(json.dumps(message_json), 'utf-8'))
+        else:
+            body = json.dumps(message_json).encode('utf-8')
+        headers = omf_headers(PRODUCER_TOKEN, message_type, compression=self.compression)
+        response = requests.post(self.url, headers=headers, data=body, timeout=30)
+        return response.status_code, len(body), time.perf_counter() - start
+
+class RunnerPath(object):
+
+    def __init__(self, url, compression, registry):
+        self.sender = OMFSender(url, PRODUCER_TOKEN, compression=compression)
+        self.registry = registry
+
+    def send(self, message_type, message_json):
+        start = time.perf_counter()
+        if message_type == 'data':
+            body = self.registry.encode_data_message(message_json)
+        else:
+            body = json.dumps(message_json)
+        response = self.sender.post(message_type, body)
+        sent_bytes = len(response.request.body) if response.request.body is not None else 0
+        return response.status_code, sent_bytes, time.perf_counter() - start
+
+# ************************************************************************
+# One benchmark run
+# ************************************************************************
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def make_containers(count):
+    dynamic_types = [t for t in TYPES_MESSAGE if t['classification'] == 'dynamic']
+    return [
+        {'id': 'bench_container_{0}'.format(index), 'typeid': dynamic_types[index % len(dynamic_types)]['id']}
+        for index in range(count)
+    ]
+
+# Builds every data message of a run up front, so that generating the
+# values is not part of what is measured
+def make_messages(containers, total_events, batch_size):
+    messages = []
+    per_container = max(1, total_events // len(containers))
+    for container in containers:
+        events = [random_event(container['typeid']) for _ in range(per_container)]
+        for first in range(0, len(events), batch_size):
+            messages.append([{'containerid': container['id'], 'values': events[first:first + batch_size]}])
+    # Interleave the containers, as a device sending them in turn would
+    random.shuffle(messages)
+    return messages
+
+def run_one(base_url, path_name, batch_size, container_count, compression, concurrency, total_events):
+    url = base_url + '/ingress/messages'
+    requests.delete(base_url + '/stats')
+    containers = make_containers(container_count)
+    registry = SchemaRegistry()
+    registry.add_types(TYPES_MESSAGE)
+    registry.add_containers(containers)
+
+    def make_path():
+        if path_name == 'tutorial':
+            return TutorialPath(url, compression)
+        return RunnerPath(url, compression, registry)
+
+    setup = make_path()
+    setup.send('type', TYPES_MESSAGE)
+    setup.send('container', containers)
+    messages = make_messages(containers, total_events, batch_size)
+    events = sum(len(message[0]['values']) for message in messages)
+
+    latencies = []
+    sent_bytes = [0]
+    failures = [0]
+    lock = threading.Lock()
+
+    def worker(share):
+        path = make_path()
+        local_latencies = []
+        local_bytes = 0
+        local_failures = 0
+        for message in share:
+            status_code, body_bytes, latency = path.send('data', message)
+            local_latencies.append(latency)
+            local_bytes += body_bytes
+            if status_code >= 300:
+                local_failures += 1
+        with lock:
+            latencies.extend(local_latencies)
+            sent_bytes[0] += local_bytes
+            failures[0] += local_failures
+
+    threads = [threading.Thread(target=worker, args=(messages[index::concurrency],)) for index in range(concurrency)]
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - wall_start
+    cpu_seconds = time.process_time() - cpu_start
+
+    received = requests.get(base_url + '/stats').json()['events_per_stream']
+    received_events = sum(received.get(container['id'], 0) for container in containers)
+    latencies.sort()
+    return {
+        'path': path_name,
+        'batch_size': batch_size,
+        'containers': container_count,
+        'compression': compression or 'none',
+        'concurrency': concurrency,
+        'events': events,
+        'messages': len(messages),
+        'failed_messages': failures[0],
+        'lost_events': events - received_events,
+        'events_per_second': events / wall_seconds,
+        'bytes_per_event': float(sent_bytes[0]) / events,
+        'latency_p50_ms': percentile(latencies, 0.50) * 1000,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+        'cpu_us_per_event': cpu_seconds / events * 1e6
+    }
+
+# ************************************************************************
+# Comparing with an earlier results file
+# ************************************************************************
+
+KEY_FIELDS = ('path', 'batch_size', 'containers', 'compression', 'concurrency')
+
+def result_key(result):
+    return tuple(result[field] for field in KEY_FIELDS)
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = dict((result_key(r), r) for r in json.load(baseline_file)['results'])
+    print('\n--- Compared with ' + baseline_path + ' (events/s and CPU/event, new / old)\n')
+    for result in results:
+        old = baseline.get(result_key(result))
+        if old is None:
+            continue
+        print('{0:<9} batch {1:>5}  containers {2:>3}  {3:<5} x{4:<3} {5:6.2f}x events/s  {6:6.2f}x CPU/event'.format(
+            result['path'], result['batch_size'], result['containers'], result['compression'],
+            result['concurrency'], result['events_per_second'] / old['events_per_second'],
+            result['cpu_us_per_event'] / old['cpu_us_per_event']))
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=PYTHON2_FOLDER,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def int_list(text):
+    return [int(item) for item in text.split(',')]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end throughput of the OMF send path')
+    parser.add_argument('--paths', default='tutorial,runner')
+    parser.add_argument('--batch-sizes', type=int_list, default=[1, 10, 100, 1000])
+    parser.add_argument('--containers', type=int_list, default=[1, 10])
+    parser.add_argument('--compression', default='none,gzip')
+    parser.add_argument('--concurrency', type=int_list, default=[1, 4])
+    parser.add_argument('--events', type=int, default=5000, help='events per run')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='latency added by the emulator')
+    parser.add_argument('--output', default='bench_send_path_results.json')
+    parser.add_argument('--baseline', default=None, help='an earlier results file to compare with')
+    parser.add_argument('--quick', action='store_true', help='a short sweep, for a quick check')
+    args = parser.parse_args()
+    if args.quick:
+        args.batch_sizes, args.containers, args.concurrency, args.events = [1, 100], [1], [1], 1000
+
+    process, base_url = start_emulator(args.latency_ms)
+    results = []
+    try:
+        print('\n{0:<9} {1:>6} {2:>11} {3:<5} {4:>4} {5:>12} {6:>11} {7:>9} {8:>9} {9:>10} {10:>5}'.format(
+            'path', 'batch', 'containers', 'comp', 'thr', 'events/s', 'bytes/evt', 'p50 ms', 'p99 ms',
+            'CPU us/evt', 'lost'))
+        for path_name, batch_size, container_count, compression, concurrency in itertools.product(
+                args.paths.split(','), args.batch_sizes, args.containers, args.compression.split(','),
+                args.concurrency):
+            result = run_one(base_url, path_name, batch_size, container_count,
+                             None if compression == 'none' else compression, concurrency, args.events)
+            results.append(result)
+            print('{path:<9} {batch_size:>6} {containers:>11} {compression:<5} {concurrency:>4} '
+                  '{events_per_second:12,.0f} {bytes_per_event:11.1f} {latency_p50_ms:9.2f} '
+                  '{latency_p99_ms:9.2f} {cpu_us_per_event:10.1f} {lost_events:>5}'.format(**result))
+    finally:
+        process.terminate()
+        process.wait()
+
+    with open(args.output, 'w') as output_file:
+        json.dump({
+            'benchmark': 'send_path',
+            'time': datetime.datetime.utcnow().isoformat() + 'Z',
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'emulator_latency_ms': args.latency_ms,
+            'results': results
+        }, output_file, indent=2)
+    print('\n--- Results written to ' + args.output)
+    if args.baseline:
+        print_comparison(results, args.baseline)
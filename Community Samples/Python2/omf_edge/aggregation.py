@@ -0,0 +1,215 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Edge aggregation: for high-rate sources (such as an accelerometer read
+# hundreds of times per second), rather than sending every raw sample, keep
+# running statistics (min, max, mean, standard deviation, count, last) per
+# property over fixed time windows, and send one compact OMF event per window
+# per property instead
+# ************************************************************************
+
+# Import packages
+import math
+import threading
+
+from omf_edge.records import iso_timestamp, parse_iso_timestamp
+
+# The statistics that can be sent, in the order they appear in the OMF type
+STATISTICS = ('Minimum', 'Maximum', 'Mean', 'StdDev', 'Count', 'Last')
+
+# ************************************************************************
+# Running statistics for one property over one window; O(1) per sample
+# ************************************************************************
+
+class WindowStatistics(object):
+    __slots__ = ('count', 'mean', 'm2', 'minimum', 'maximum', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.last = None
+
+    # Welford's method, which stays accurate for long windows of
+    # large values, unlike keeping a running sum of squares
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        self.last = value
+
+    # Population standard deviation of the samples in the window
+    def stddev(self):
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+    def values(self):
+        return {
+            'Minimum': self.minimum,
+            'Maximum': self.maximum,
+            'Mean': self.mean,
+            'StdDev': self.stddev(),
+            'Count': self.count,
+            'Last': self.last
+        }
+
+# ************************************************************************
+# The aggregator for one source container
+# ************************************************************************
+
+# Windows are aligned to multiples of window_seconds since the Unix epoch (so
+# 1-minute windows start on the minute), and each window's event is stamped
+# with the window's start time.  Each source property gets its own container,
+# named "<source container>.<property>.<window>s", which all share one
+# generated "aggregate" OMF type.
+#
+# Typical use:
+#   aggregator = WindowAggregator(DATA_VALUES_CONTAINER_ID, ["X Acceleration", ...], 1.0)
+#   send_omf_message_to_endpoint("create", "Type", aggregator.types_message())
+#   send_omf_message_to_endpoint("create", "Container", aggregator.containers_message())
+#   ... for every raw sample: aggregator.add(time.time(), [x, y, z])
+#   ... periodically: message = aggregator.take_message(time.time())
+class WindowAggregator(object):
+
+    def __init__(self, source_containerid, property_names, window_seconds,
+                 statistics=STATISTICS, typeid=None):
+        for statistic in statistics:
+            if statistic not in STATISTICS:
+                raise ValueError('Unknown statistic "{0}"; use any of {1}'.format(statistic, STATISTICS))
+        self.source_containerid = source_containerid
+        self.property_names = list(property_names)
+        self.window_seconds = window_seconds
+        self.statistics = tuple(statistics)
+        self.typeid = typeid or '{0}_aggregate_{1}s_type'.format(source_containerid, _seconds_label(window_seconds))
+        self.containerids = [
+            '{0}.{1}.{2}s'.format(source_containerid, name, _seconds_label(window_seconds))
+            for name in self.property_names
+        ]
+        self._window_start = None
+        self._window = None
+        # Samples before this time belong to windows that were already closed
+        self._closed_until = None
+        # Completed windows: (window start, [WindowStatistics per property])
+        self._completed = []
+        # Samples may be added on a sampling thread while messages are taken
+        # on the sending thread
+        self._lock = threading.Lock()
+
+    # The OMF dynamic type shared by all of this aggregator's containers
+    def types_message(self):
+        properties = {
+            "Time": {"format": "date-time", "type": "string", "isindex": True}
+        }
+        for statistic in self.statistics:
+            if statistic == 'Count':
+                properties[statistic] = {"type": "integer", "format": "int64"}
+            else:
+                properties[statistic] = {"type": "number", "format": "float64"}
+        return [
+            {
+                "id": self.typeid,
+                "type": "object",
+                "classification": "dynamic",
+                "description": "Statistics over {0} s windows".format(_seconds_label(self.window_seconds)),
+                "properties": properties
+            }
+        ]
+
+    def containers_message(self):
+        return [{"id": containerid, "typeid": self.typeid} for containerid in self.containerids]
+
+    # The "__Link" values that attach each aggregate container to an AF element
+    def link_values(self, asset_typeid, asset_index):
+        return [
+            {
+                "Source": {"typeid": asset_typeid, "index": asset_index},
+                "Target": {"containerid": containerid}
+            }
+            for containerid in self.containerids
+        ]
+
+    def _window_for(self, timestamp):
+        return math.floor(timestamp / self.window_seconds) * self.window_seconds
+
+    def _close_window(self):
+        if self._window is not None:
+            self._completed.append((self._window_start, self._window))
+            self._closed_until = self._window_start + self.window_seconds
+        self._window_start = None
+        self._window = None
+
+    # Adds one raw sample; timestamp is in seconds since the epoch (for example
+    # from time.time()), and values are given in property_names order (a value
+    # of None is skipped).  Samples for a window that was already closed are
+    # dropped, and False is returned.
+    def add(self, timestamp, values):
+        window_start = self._window_for(timestamp)
+        with self._lock:
+            if window_start != self._window_start:
+                if self._closed_until is not None and window_start < self._closed_until:
+                    return False
+                if self._window_start is not None and window_start < self._window_start:
+                    return False
+                self._close_window()
+                self._window_start = window_start
+                self._window = [WindowStatistics() for _ in self.property_names]
+            for statistics, value in zip(self._window, values):
+                if value is not None:
+                    statistics.add(value)
+        return True
+
+    # Adds one event from an OMF "values" array of the source container
+    def add_event(self, event, index_property='Time'):
+        return self.add(
+            parse_iso_timestamp(event[index_property]),
+            [event.get(name) for name in self.property_names]
+        )
+
+    # Returns an OMF data message with one event per completed window for each
+    # property container (or None if no window has completed yet); passing the
+    # current time also closes the current window once its end has passed, so
+    # that a source that went quiet still has its last window sent
+    def take_message(self, now=None):
+        with self._lock:
+            if now is not None and self._window_start is not None:
+                if now >= self._window_start + self.window_seconds:
+                    self._close_window()
+            completed = self._completed
+            self._completed = []
+        message = []
+        for index, containerid in enumerate(self.containerids):
+            values = []
+            for window_start, window in completed:
+                statistics = window[index]
+                if statistics.count == 0:
+                    continue
+                all_values = statistics.values()
+                event = {"Time": iso_timestamp(window_start)}
+                for statistic in self.statistics:
+                    event[statistic] = all_values[statistic]
+                values.append(event)
+            if values:
+                message.append({"containerid": containerid, "values": values})
+        return message or None
+
+# Formats a window length for use in type and container ids, e.g. 1.0 -> "1", 0.5 -> "0.5"
+def _seconds_label(seconds):
+    return ('%f' % seconds).rstrip('0').rstrip('.')
@@ -0,0 +1,158 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Adaptive batch sizing: rather than sending a fixed number of events at a
+# fixed interval, the batch size and the flush interval follow how the
+# endpoint responds.  While messages are accepted within the target latency,
+# the batch grows by a fixed step and the flush interval shrinks by a fixed
+# step (additive increase); as soon as a message is slow or the endpoint
+# reports that it is busy, the batch is cut in half and the flush interval
+# doubled (multiplicative decrease), the same way TCP backs off
+# ************************************************************************
+
+# Import packages
+import math
+
+from omf_edge.compat import monotonic
+from omf_edge.log import get_logger
+
+log = get_logger('omf.batching')
+
+# The largest OMF message that the PI Connector Relay and OSIsoft Cloud
+# Services accept, in bytes
+MAXIMUM_MESSAGE_BYTES = 192 * 1024
+
+# ************************************************************************
+# The controller
+# ************************************************************************
+
+# Typical use:
+#   batch_controller = AdaptiveBatchController(target_latency_seconds=1.0)
+#   ... every batch_controller.flush_interval_seconds:
+#       events = pending[:batch_controller.batch_size]
+#       ... send them, timing the request ...
+#       batch_controller.observe(len(events), message_bytes, latency_seconds, status_code)
+class AdaptiveBatchController(object):
+
+    def __init__(self, target_latency_seconds=1.0, initial_batch_size=100, minimum_batch_size=1,
+                 maximum_batch_size=10000, batch_size_step=50, initial_flush_seconds=2.0,
+                 minimum_flush_seconds=0.1, maximum_flush_seconds=30.0, flush_seconds_step=0.1,
+                 decrease_factor=0.5, maximum_message_bytes=MAXIMUM_MESSAGE_BYTES, headroom=0.9):
+        self.target_latency_seconds = target_latency_seconds
+        self.minimum_batch_size = minimum_batch_size
+        self.maximum_batch_size = maximum_batch_size
+        self.batch_size_step = batch_size_step
+        self.minimum_flush_seconds = minimum_flush_seconds
+        self.maximum_flush_seconds = maximum_flush_seconds
+        self.flush_seconds_step = flush_seconds_step
+        self.decrease_factor = decrease_factor
+        # Batches are kept to this many bytes, which leaves some room for
+        # events that are larger than the average
+        self.message_byte_limit = int(maximum_message_bytes * headroom)
+        self.batch_size = initial_batch_size
+        self.flush_interval_seconds = initial_flush_seconds
+        # Running averages (exponentially weighted) of the bytes per event and
+        # of the latency of accepted messages
+        self.bytes_per_event = None
+        self.average_latency_seconds = None
+        self.last_latency_seconds = None
+        self.last_status_code = None
+        # Counters of the controller's decisions
+        self.increases = 0
+        self.decreases = 0
+        self.too_large = 0
+        self.events_sent = 0
+        self.messages_sent = 0
+        self._start_time = monotonic()
+
+    def _average(self, average, value, weight=0.2):
+        return value if average is None else average + weight * (value - average)
+
+    # The most events that fit in one message, from the average event size
+    def size_limit(self):
+        if not self.bytes_per_event:
+            return self.maximum_batch_size
+        return max(self.minimum_batch_size, int(self.message_byte_limit / self.bytes_per_event))
+
+    def _clamp(self):
+        self.batch_size = int(max(self.minimum_batch_size,
+                                  min(self.batch_size, self.maximum_batch_size, self.size_limit())))
+        self.flush_interval_seconds = max(self.minimum_flush_seconds,
+                                          min(self.flush_interval_seconds, self.maximum_flush_seconds))
+
+    # Records the outcome of one message: how many events it held, its size in
+    # bytes (before compression), how long the request took, and the HTTP
+    # status code (None if the endpoint could not be reached)
+    def observe(self, events, message_bytes, latency_seconds, status_code):
+        self.last_latency_seconds = latency_seconds
+        self.last_status_code = status_code
+        if events:
+            self.bytes_per_event = self._average(self.bytes_per_event, float(message_bytes) / events)
+        if status_code == 413:
+            # Too large: the next batch only holds half of the events, whatever the latency
+            self.too_large += 1
+            self.batch_size = min(self.batch_size, max(1, events // 2))
+        elif status_code is None or status_code in (429, 503) or status_code >= 500 \
+                or latency_seconds > self.target_latency_seconds:
+            # Congestion: back off
+            self.decreases += 1
+            self.batch_size = int(math.floor(self.batch_size * self.decrease_factor))
+            self.flush_interval_seconds = self.flush_interval_seconds / self.decrease_factor
+        elif status_code < 300:
+            self.increases += 1
+            self.events_sent += events
+            self.messages_sent += 1
+            self.average_latency_seconds = self._average(self.average_latency_seconds, latency_seconds)
+            # Only grow when the last batch was full; a batch that was not full
+            # says nothing about whether a larger one would be accepted in time
+            if events >= self.batch_size:
+                self.batch_size += self.batch_size_step
+            self.flush_interval_seconds -= self.flush_seconds_step
+        # Other errors (such as 400 for a bad type) say nothing about load
+        self._clamp()
+
+    # ************************************************************************
+    # Metrics
+    # ************************************************************************
+
+    def metrics(self):
+        elapsed = monotonic() - self._start_time
+        return {
+            'batch_size': self.batch_size,
+            'flush_interval_seconds': self.flush_interval_seconds,
+            'size_limit': self.size_limit(),
+            'bytes_per_event': self.bytes_per_event,
+            'last_latency_seconds': self.last_latency_seconds,
+            'average_latency_seconds': self.average_latency_seconds,
+            'last_status_code': self.last_status_code,
+            'increases': self.increases,
+            'decreases': self.decreases,
+            'too_large': self.too_large,
+            'events_sent': self.events_sent,
+            'messages_sent': self.messages_sent,
+            'events_per_second': self.events_sent / elapsed if elapsed > 0 else 0.0
+        }
+
+    def print_metrics(self):
+        metrics = self.metrics()
+        log.info(
+            '--- Batch controller: {batch_size} events every {flush_interval_seconds:.2f} s '
+            '(at most {size_limit} fit in a message), {events_per_second:.1f} events/s, '
+            'average latency {latency}; {increases} increases, {decreases} decreases, '
+            '{too_large} messages too large'.format(
+                latency='{0:.3f} s'.format(metrics['average_latency_seconds'])
+                if metrics['average_latency_seconds'] is not None else 'unknown',
+                **metrics)
+        )
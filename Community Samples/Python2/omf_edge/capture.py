@@ -0,0 +1,300 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# High-rate capture: a sensor is sampled at a fixed rate on its own thread
+# (or as fast as a blocking, interrupt-paced read returns), samples go into a
+# preallocated ring buffer, and the sending loop periodically takes them out
+# as multi-event OMF data messages; sensors that push their own data events
+# (such as Phidgets) can fill the same kind of buffer from their callbacks.
+# Counters show whether the sending side keeps up with the sampling side
+# ************************************************************************
+
+# Import packages
+import json
+import threading
+import time
+
+# NumPy is required by this module; to install it, run "pip install numpy"
+import numpy as np
+
+from omf_edge.clock import now_us
+from omf_edge.columnar import ColumnarEncoder
+from omf_edge.compat import monotonic
+from omf_edge.log import get_logger
+
+log = get_logger('omf.capture')
+
+# ************************************************************************
+# A fixed-capacity ring buffer of samples
+# ************************************************************************
+
+# All memory is allocated up front: an int64 column of timestamps (in
+# microseconds since the Unix epoch) and one row of values per slot.  Only
+# the producer (one sampling thread or sensor callback) changes _written, and
+# only the consumer (the sending loop) changes _read, and a slot is filled
+# before _written is advanced, so one producer and one consumer need no lock.
+# When the ring is full, new samples are dropped (and counted) rather than
+# overwriting samples that have not been sent yet.
+class SampleRing(object):
+
+    def __init__(self, capacity, width, dtype=np.float64):
+        self.capacity = capacity
+        self.width = width
+        self.timestamps_us = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, width), dtype=dtype)
+        # Total numbers of samples ever written and ever taken
+        self._written = 0
+        self._read = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._written - self._read
+
+    # Called by the producer; returns False if the sample was dropped
+    def put(self, timestamp_us, values):
+        if self._written - self._read >= self.capacity:
+            self.dropped += 1
+            return False
+        slot = self._written % self.capacity
+        self.timestamps_us[slot] = timestamp_us
+        self.values[slot] = values
+        self._written += 1
+        return True
+
+    # Called by the consumer; returns copies of up to max_count of the oldest
+    # samples, as (timestamps_us with shape (n,), values with shape (n, width))
+    def take(self, max_count=None):
+        count = self._written - self._read
+        if max_count is not None:
+            count = min(count, max_count)
+        slots = (self._read + np.arange(count)) % self.capacity
+        timestamps_us = self.timestamps_us[slots]
+        values = self.values[slots]
+        self._read += count
+        return timestamps_us, values
+
+# ************************************************************************
+# Shared by both kinds of capture: taking samples out as OMF messages, and counters
+# ************************************************************************
+
+# Values are written at full precision, as json.dumps writes them; a
+# float_format such as "%.6g" formats them faster, but rounds every value
+# to that precision, so a caller only passes one if it can lose the digits
+class RingCapture(object):
+
+    def __init__(self, property_names, capacity, timestamp_property='Time', float_format=None):
+        self.property_names = list(property_names)
+        self.ring = SampleRing(capacity, len(self.property_names))
+        self.encoder = ColumnarEncoder(self.property_names, timestamp_property, float_format)
+        self.captured = 0
+        # Samples that were never taken because the thread fell behind the timer
+        self.missed = 0
+        self.read_errors = 0
+        self.last_error = None
+        self.started_at = monotonic()
+
+    def _store(self, timestamp_us, values):
+        if self.ring.put(timestamp_us, values):
+            self.captured += 1
+
+    # Takes up to max_events of the oldest samples, as (timestamps_us, values)
+    def take_block(self, max_events=None):
+        return self.ring.take(max_events)
+
+    # Takes every waiting sample, and returns them encoded as complete OMF data
+    # message bodies of at most max_events_per_message events each (keep each
+    # message under the 192 KB limit of the endpoint)
+    def take_messages(self, containerid, max_events_per_message):
+        return take_multiplexed_messages([(containerid, self)], max_events_per_message)
+
+    def counters(self):
+        elapsed = monotonic() - self.started_at
+        return {
+            'captured': self.captured,
+            'dropped': self.ring.dropped,
+            'missed': self.missed,
+            'read errors': self.read_errors,
+            'waiting': len(self.ring),
+            # The rate at which samples actually came in
+            'rate': (self.captured + self.ring.dropped) / elapsed if elapsed > 0 else 0.0
+        }
+
+    # Prints the counters; if "dropped" grows, samples are taken out (and sent)
+    # more slowly than they come in, and if "missed" grows, the sensor cannot
+    # be read at the configured rate
+    def print_counters(self):
+        counters = self.counters()
+        line = ('--- Capture counters ({rate:.1f} samples/s): {captured} captured, {dropped} dropped (buffer full), '
+                '{missed} missed (late), {read errors} read errors, {waiting} waiting to be sent').format(**counters)
+        if self.last_error is not None:
+            line += '; last read error: ' + str(self.last_error)
+        log.info(line)
+
+# ************************************************************************
+# Capture on a thread: the sensor is read at a fixed rate
+# ************************************************************************
+
+# read_sample is called once per sample and returns the sample's values in
+# property_names order.  With a timer (the default), it is called every
+# 1/sample_rate_hz seconds; with interrupt_driven=True, it is expected to
+# block until the sensor has a new sample (for example, rcpy.mpu9250.read()
+# with the DMP enabled), and it is called again as soon as it returns.
+#
+# Typical use:
+#   capture = SampleCapture(read_imu_sample, ["X-acceleration", ...], 200)
+#   capture.start()
+#   ... periodically:
+#   for message_body in capture.take_messages(DATA_VALUES_CONTAINER_ID, 400):
+#       send_omf_message_to_endpoint("create", "Data", message_body)
+class SampleCapture(RingCapture):
+
+    def __init__(self, read_sample, property_names, sample_rate_hz, capacity=None,
+                 interrupt_driven=False, timestamp_property='Time', float_format=None):
+        # By default, hold 30 seconds of samples
+        RingCapture.__init__(self, property_names, capacity or int(sample_rate_hz * 30),
+                             timestamp_property, float_format)
+        self.read_sample = read_sample
+        self.sample_rate_hz = sample_rate_hz
+        self.interrupt_driven = interrupt_driven
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='capture')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _capture_one(self):
+        try:
+            values = self.read_sample()
+        except Exception as ex:
+            self.read_errors += 1
+            self.last_error = ex
+            return
+        self._store(now_us(), values)
+
+    def _run(self):
+        if self.interrupt_driven:
+            while not self._stop.is_set():
+                self._capture_one()
+            return
+        period = 1.0 / self.sample_rate_hz
+        next_sample = monotonic()
+        while not self._stop.is_set():
+            self._capture_one()
+            # Deadlines are kept on a fixed schedule, so that the time taken
+            # by each read does not add up into a slower rate
+            next_sample += period
+            delay = next_sample - monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -period:
+                # More than a whole period late (a slow read, or the thread was
+                # not scheduled): skip the missed samples, rather than bursting
+                # to catch up, and count them
+                missed = int(-delay / period)
+                self.missed += missed
+                next_sample += missed * period
+
+# ************************************************************************
+# Capture from callbacks: the sensor pushes its own data events
+# ************************************************************************
+
+# push is called from the sensor library's data event handler (for example, a
+# Phidget22 OnAccelerationChange handler), with the values in property_names
+# order and, if the device provides one, the device's own timestamp in
+# milliseconds (which counts from an arbitrary start, such as when the channel
+# was opened).  Device timestamps are turned into wall-clock time with an
+# offset: event handlers always run a little after the device took the sample,
+# so the smallest offset seen so far is the best estimate.  The offset is set
+# again if the device timestamps restart (after the device is detached and
+# attached again) or drift from the wall clock by more than resync_seconds.
+#
+# Typical use:
+#   capture = CallbackCapture(["X Acceleration", ...], capacity=30000)
+#   def AccelerationChanged(self, acceleration, timestamp):
+#       capture.push(acceleration, timestamp)
+#   ... periodically: capture.take_messages(DATA_VALUES_CONTAINER_ID, 400)
+class CallbackCapture(RingCapture):
+
+    def __init__(self, property_names, capacity, timestamp_property='Time',
+                 float_format=None, resync_seconds=1.0):
+        RingCapture.__init__(self, property_names, capacity, timestamp_property, float_format)
+        self.resync_us = int(resync_seconds * 1000000)
+        self.resyncs = 0
+        self._offset_us = None
+        self._last_device_us = None
+
+    def push(self, values, device_timestamp_ms=None):
+        wall_us = now_us()
+        if device_timestamp_ms is None:
+            self._store(wall_us, values)
+            return
+        device_us = int(device_timestamp_ms * 1000)
+        offset_us = wall_us - device_us
+        if self._offset_us is None or offset_us < self._offset_us:
+            self._offset_us = offset_us
+        elif device_us < self._last_device_us or offset_us - self._offset_us > self.resync_us:
+            self._offset_us = offset_us
+            self.resyncs += 1
+        self._last_device_us = device_us
+        self._store(device_us + self._offset_us, values)
+
+    def counters(self):
+        counters = RingCapture.counters(self)
+        counters['resyncs'] = self.resyncs
+        return counters
+
+# ************************************************************************
+# Helper function: send the samples of many captures in shared messages
+# ************************************************************************
+
+# Takes every waiting sample of each (containerid, capture) pair, and returns
+# OMF data message bodies that each hold up to max_events_per_message events,
+# from as many containers as fit, rather than one message per container.
+# With counts=True, each message is returned as a (body, number of events)
+# pair; taken, if given, is a dict that the number of samples taken from each
+# container is added to
+def take_multiplexed_messages(captures, max_events_per_message, counts=False, taken=None):
+    messages = []
+    parts = []
+    room = max_events_per_message
+    for containerid, capture in captures:
+        head = '{"containerid":' + json.dumps(containerid) + ',"values":'
+        # Samples that arrive while this runs are left for the next call
+        waiting = len(capture.ring)
+        if taken is not None and waiting:
+            taken[containerid] = taken.get(containerid, 0) + waiting
+        while waiting > 0:
+            timestamps_us, values = capture.ring.take(min(waiting, room))
+            waiting -= len(timestamps_us)
+            room -= len(timestamps_us)
+            parts.append(head + capture.encoder.encode_values(timestamps_us, values.T) + '}')
+            if room == 0:
+                messages.append(('[' + ','.join(parts) + ']', max_events_per_message))
+                parts = []
+                room = max_events_per_message
+    if parts:
+        messages.append(('[' + ','.join(parts) + ']', max_events_per_message - room))
+    if counts:
+        return messages
+    return [body for body, events in messages]
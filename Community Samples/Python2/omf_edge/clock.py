@@ -0,0 +1,237 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Timestamping service: event timestamps are the monotonic clock plus an
+# offset to wall-clock time that is measured again every so often (against
+# an NTP server, or else against the system clock), instead of stopping
+# ntpd and stepping the system clock at startup.  Startup never waits for a
+# clock step, and a new measurement never makes timestamps jump: a small
+# correction is slewed in gradually, so timestamps always increase
+# ************************************************************************
+
+# Import packages
+import socket
+import struct
+import threading
+import time
+
+from omf_edge.compat import monotonic
+from omf_edge.log import get_logger
+from omf_edge.records import iso_timestamp
+
+log = get_logger('omf.clock')
+
+# ************************************************************************
+# Helper function: one SNTP measurement
+# ************************************************************************
+
+# Seconds from the NTP epoch (1900) to the Unix epoch (1970)
+NTP_EPOCH_OFFSET = 2208988800
+
+def _ntp_seconds(packet, position):
+    seconds, fraction = struct.unpack('!II', packet[position:position + 8])
+    return seconds - NTP_EPOCH_OFFSET + fraction / 4294967296.0
+
+# Asks an NTP server for the time (RFC 4330) and returns (offset, round
+# trip): the offset is what to add to monotonic() to get wall-clock
+# time, in seconds since the Unix epoch.  Raises socket errors (including
+# a timeout) if the server does not answer
+def measure_ntp_offset(server, port=123, timeout_seconds=2.0):
+    request = b'\x23' + 47 * b'\0'    # version 4, client mode
+    address = socket.getaddrinfo(server, port, 0, socket.SOCK_DGRAM)[0][4]
+    ntp_socket = socket.socket(socket.AF_INET6 if ':' in address[0] else socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        ntp_socket.settimeout(timeout_seconds)
+        sent = monotonic()
+        ntp_socket.sendto(request, address)
+        packet = ntp_socket.recvfrom(48)[0]
+        received = monotonic()
+    finally:
+        ntp_socket.close()
+    if len(packet) < 48 or bytearray(packet)[1] == 0:
+        raise ValueError('Unusable answer from NTP server "{0}"'.format(server))
+    server_received = _ntp_seconds(packet, 32)
+    server_sent = _ntp_seconds(packet, 40)
+    offset = ((server_received - sent) + (server_sent - received)) / 2
+    return offset, (received - sent) - (server_sent - server_received)
+
+# Returns (offset, 0.0): the offset from monotonic() to the system
+# clock (which may itself be kept in sync by a running ntpd or chronyd)
+def measure_system_offset():
+    before = monotonic()
+    wall = time.time()
+    after = monotonic()
+    return wall - (before + after) / 2, 0.0
+
+# ************************************************************************
+# The clock
+# ************************************************************************
+
+# now() is monotonic() plus an offset.  sync() measures the offset
+# again, against ntp_server if one is given (falling back to the system
+# clock if it cannot be reached), and start() does so every resync_seconds
+# on a background thread.
+#
+# The first measurement is used as is.  After that, the offset is moved
+# towards each new measurement at no more than max_slew (seconds per
+# second, 500 ppm by default, as ntpd does), so timestamps never go
+# backwards and never jump; only an error larger than step_seconds is
+# corrected at once, and only if the correction is forward in time.
+#
+# Typical use:
+#   clock = OffsetClock('pool.ntp.org')
+#   clock.start()
+#   event = {"Time": clock.iso_now(), ...}
+class OffsetClock(object):
+
+    def __init__(self, ntp_server=None, resync_seconds=600.0, max_slew=0.0005, step_seconds=1.0):
+        self.ntp_server = ntp_server
+        self.resync_seconds = resync_seconds
+        self.max_slew = max_slew
+        self.step_seconds = step_seconds
+        # The offset is slewed from base_offset (at monotonic time base_time)
+        # towards target_offset
+        self._base_time = monotonic()
+        self._base_offset = self._target_offset = measure_system_offset()[0]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # About the last measurement
+        self.synced = False
+        self.source = 'system clock'
+        self.round_trip_seconds = None
+        self.last_sync_error = None
+        self.syncs = 0
+        self.sync_failures = 0
+
+    # Called with the lock held
+    def _slewed_offset(self, monotonic_time):
+        remaining = self._target_offset - self._base_offset
+        limit = self.max_slew * (monotonic_time - self._base_time)
+        return self._base_offset + max(-limit, min(limit, remaining))
+
+    def offset(self, monotonic_time=None):
+        if monotonic_time is None:
+            monotonic_time = monotonic()
+        with self._lock:
+            return self._slewed_offset(monotonic_time)
+
+    # Seconds since the Unix epoch (UTC), like time.time()
+    def now(self):
+        monotonic_time = monotonic()
+        return monotonic_time + self.offset(monotonic_time)
+
+    # Microseconds since the Unix epoch, as the capture buffers keep them
+    def now_us(self):
+        return int(self.now() * 1000000)
+
+    def iso_now(self):
+        return iso_timestamp(self.now())
+
+    # Turns a monotonic() reading (for example, taken when a sample was
+    # read) into wall-clock time
+    def from_monotonic(self, monotonic_time):
+        return monotonic_time + self.offset(monotonic_time)
+
+    def _measure(self):
+        if self.ntp_server:
+            try:
+                offset, round_trip = measure_ntp_offset(self.ntp_server)
+                return offset, round_trip, 'ntp ' + self.ntp_server
+            except (socket.error, ValueError) as ex:
+                self.sync_failures += 1
+                self.last_sync_error = ex
+                log.warning('Could not reach NTP server "{0}", using the system clock: {1}',
+                            self.ntp_server, ex, key=self.ntp_server)
+        offset, round_trip = measure_system_offset()
+        return offset, round_trip, 'system clock'
+
+    # Measures the offset once; takes at most a couple of seconds (the NTP
+    # timeout), and never changes the system clock
+    def sync(self):
+        offset, round_trip, source = self._measure()
+        now = monotonic()
+        with self._lock:
+            current = self._slewed_offset(now)
+            self._base_time = now
+            if not self.synced or offset - current > self.step_seconds:
+                # The first measurement, or far behind: step forward at once
+                self._base_offset = offset
+            else:
+                self._base_offset = current
+            self._target_offset = offset
+            self.synced = True
+        self.source = source
+        self.round_trip_seconds = round_trip
+        self.syncs += 1
+        return offset - current
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='clock sync')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.resync_seconds):
+            try:
+                self.sync()
+            except Exception as ex:
+                self.sync_failures += 1
+                self.last_sync_error = ex
+                log.error('Error when syncing the clock: {0}', ex)
+
+    def print_status(self):
+        log.info('--- Clock: synced {0} time(s) against the {1}; offset error being slewed: {2:+.6f} s{3}'.format(
+            self.syncs, self.source, self._target_offset - self.offset(),
+            '; round trip {0:.3f} s'.format(self.round_trip_seconds) if self.round_trip_seconds else ''))
+
+# ************************************************************************
+# The clock shared by the helpers (capture buffers, sources) and scripts
+# ************************************************************************
+
+_default_clock = []
+
+def default_clock():
+    if not _default_clock:
+        _default_clock.append(OffsetClock())
+    return _default_clock[0]
+
+def now():
+    return default_clock().now()
+
+def now_us():
+    return default_clock().now_us()
+
+def iso_now():
+    return default_clock().iso_now()
+
+# Sets up the shared clock, measures its offset once, and keeps measuring
+# it every resync_seconds; meant to be a startup phase, for example:
+#   startup.add_phase('clock', lambda: start_clock('pool.ntp.org'))
+def start_clock(ntp_server=None, resync_seconds=600.0):
+    clock = default_clock()
+    clock.ntp_server = ntp_server
+    clock.resync_seconds = resync_seconds
+    clock.sync()
+    if clock._thread is None:
+        clock.start()
+    log.info('--- Clock offset measured against the {0}; time is {1}', clock.source, clock.iso_now())
+    return clock
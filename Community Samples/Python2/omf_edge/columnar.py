@@ -0,0 +1,167 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Columnar value buffers: for high-rate sources (for example, accelerometer
+# or IMU samples taken hundreds of times per second), building one Python
+# dict per event is the bottleneck; instead, a ColumnarBuffer keeps one NumPy
+# array per OMF property plus an int64 timestamp column, and encodes a whole
+# block of events into the OMF "values" JSON array in one vectorized pass
+# ************************************************************************
+
+# Import packages
+import json
+import time
+
+# NumPy is required by this module; to install it, run "pip install numpy"
+import numpy as np
+
+# Timestamps are stored as int64 microseconds since the Unix epoch (UTC),
+# which is the same precision that datetime.utcnow().isoformat() produces
+def now_timestamp_us():
+    return int(time.time() * 1000000)
+
+# ************************************************************************
+# Helper function: turn a block of timestamps into ISO 8601 strings at once
+# ************************************************************************
+
+# For example, 1525983767360123 becomes "2018-05-10T20:22:47.360123Z"
+def format_timestamps_us(timestamps_us):
+    iso_strings = np.datetime_as_string(
+        np.asarray(timestamps_us, dtype=np.int64).astype('datetime64[us]'),
+        unit='us'
+    )
+    return np.char.add(iso_strings, 'Z')
+
+# JSON has no literal for NaN or infinity; json.dumps writes them as below, so
+# the vectorized encoder does the same, to decode to exactly the same values
+_NON_FINITE_LITERALS = ((np.isnan, 'NaN'), (np.isposinf, 'Infinity'), (np.isneginf, '-Infinity'))
+
+# Returns the "%" placeholder and the list of cell values for one column.
+# Without a float_format, numbers are written with "%s", which gives the same
+# shortest round-trip text that json.dumps writes; with a float_format such as
+# "%.6g", floats are formatted at that precision instead, which is much faster
+# (and shorter) for sensor readings that never had that many digits anyway
+def _column_cells(column, float_format):
+    if column.dtype.kind != 'f':
+        return '%s', column.tolist()
+    finite = np.isfinite(column)
+    if finite.all():
+        return (float_format or '%s'), column.tolist()
+    # Rare path: the column has NaN or infinity, so it is formatted to text here
+    converted = column.astype(object)
+    if float_format:
+        converted[finite] = [float_format % value for value in column[finite].tolist()]
+    for test, literal in _NON_FINITE_LITERALS:
+        converted[test(column)] = literal
+    return '%s', converted.tolist()
+
+# ************************************************************************
+# Encoder: turn a block of events into the OMF "values" JSON array text
+# ************************************************************************
+
+# Property names are JSON-escaped once per type; for each block, a row template
+# is built and the whole block is formatted with one "%" operation over a flat
+# tuple of row-major values, so no per-event dicts are ever created
+class ColumnarEncoder(object):
+
+    def __init__(self, property_names, timestamp_property='Time', float_format=None):
+        self.property_names = list(property_names)
+        self.timestamp_property = timestamp_property
+        self.float_format = float_format
+        # Any "%" in a property name is doubled, so it is not taken as a placeholder
+        self._timestamp_key = json.dumps(timestamp_property).replace('%', '%%') + ':"%s"'
+        self._keys = [json.dumps(name).replace('%', '%%') + ':' for name in self.property_names]
+
+    # timestamps_us is an int64 array of length n, and columns is a sequence of
+    # numeric arrays (one per property, in property_names order) of length n
+    def encode_values(self, timestamps_us, columns):
+        count = len(timestamps_us)
+        if count == 0:
+            return '[]'
+        cells = np.empty((count, len(columns) + 1), dtype=object)
+        cells[:, 0] = format_timestamps_us(timestamps_us).tolist()
+        fields = [self._timestamp_key]
+        for index, column in enumerate(columns):
+            placeholder, cells[:, index + 1] = _column_cells(np.asarray(column)[:count], self.float_format)
+            fields.append(self._keys[index] + placeholder)
+        rows_template = ','.join(['{' + ','.join(fields) + '}'] * count)
+        return '[' + (rows_template % tuple(cells.ravel().tolist())) + ']'
+
+# ************************************************************************
+# A fixed-capacity, per-container buffer of events stored column by column
+# ************************************************************************
+
+class ColumnarBuffer(object):
+
+    def __init__(self, containerid, property_names, capacity=1000,
+                 dtype=np.float64, timestamp_property='Time', float_format=None):
+        self.containerid = containerid
+        self.property_names = list(property_names)
+        self.capacity = capacity
+        self.timestamps_us = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty((len(self.property_names), capacity), dtype=dtype)
+        self.count = 0
+        self.encoder = ColumnarEncoder(self.property_names, timestamp_property, float_format)
+
+    def __len__(self):
+        return self.count
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+    # Appends one event; values are given in property_names order.
+    # Returns False (and stores nothing) if the buffer is already full
+    def append(self, timestamp_us, values):
+        if self.count >= self.capacity:
+            return False
+        self.timestamps_us[self.count] = timestamp_us
+        self.values[:, self.count] = values
+        self.count += 1
+        return True
+
+    # Appends a whole block at once: timestamps_us has shape (n,), and block has
+    # shape (n, number of properties); returns the number of events stored,
+    # which is less than n if the buffer ran out of room
+    def append_block(self, timestamps_us, block):
+        stored = min(len(timestamps_us), self.capacity - self.count)
+        end = self.count + stored
+        self.timestamps_us[self.count:end] = timestamps_us[:stored]
+        self.values[:, self.count:end] = np.asarray(block)[:stored].T
+        self.count = end
+        return stored
+
+    def clear(self):
+        self.count = 0
+
+    # Encodes the buffered events as the JSON text of the "values" array
+    def encode_values(self):
+        return self.encoder.encode_values(self.timestamps_us[:self.count], self.values[:, :self.count])
+
+    # Encodes the buffered events as a complete OMF data message body; it decodes
+    # to the same as json.dumps([{"containerid": ..., "values": [...]}]), but
+    # is written without the optional spaces after separators
+    def encode_message(self):
+        return encode_data_message([self])
+
+# Encodes several buffers (for example, one per container) as one OMF data message body
+def encode_data_message(buffers):
+    parts = []
+    for buffer in buffers:
+        if len(buffer):
+            parts.append(
+                '{"containerid":' + json.dumps(buffer.containerid) +
+                ',"values":' + buffer.encode_values() + '}'
+            )
+    return '[' + ','.join(parts) + ']'
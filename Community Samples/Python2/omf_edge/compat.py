@@ -0,0 +1,130 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Python 2 and 3 compatibility: the device scripts in this folder still run
+# on Python 2.7 (as shipped on many of the boards they target), so the
+# shared helpers take the few names that differ between the two from here
+# ************************************************************************
+
+# Import packages
+import gzip
+import io
+import logging
+import math
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+PY2 = sys.version_info[0] == 2
+
+# logging.handlers has QueueHandler and QueueListener from Python 3.2; on
+# Python 2, these do the same, for what omf_edge/log.py needs of them
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    class QueueHandler(logging.Handler):
+
+        def __init__(self, record_queue):
+            logging.Handler.__init__(self)
+            self.queue = record_queue
+
+        def enqueue(self, record):
+            self.queue.put_nowait(record)
+
+        # Formats the message now, on the caller's thread
+        def prepare(self, record):
+            message = self.format(record)
+            record.message = message
+            record.msg = message
+            record.args = None
+            record.exc_info = None
+            return record
+
+        def emit(self, record):
+            try:
+                self.enqueue(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+    class QueueListener(object):
+
+        def __init__(self, record_queue, *handlers):
+            self.queue = record_queue
+            self.handlers = handlers
+            self._thread = None
+
+        def start(self):
+            self._thread = threading.Thread(target=self._monitor)
+            self._thread.daemon = True
+            self._thread.start()
+
+        def _monitor(self):
+            while True:
+                record = self.queue.get(True)
+                try:
+                    if record is None:
+                        break
+                    for handler in self.handlers:
+                        handler.handle(record)
+                finally:
+                    self.queue.task_done()
+
+        def stop(self):
+            self.queue.put_nowait(None)
+            self._thread.join()
+            self._thread = None
+
+# The types of text values (JSON strings are unicode on Python 2)
+if PY2:
+    string_types = (str, unicode)
+else:
+    string_types = (str,)
+
+# Python 2 has no monotonic clock in the standard library; the wall clock
+# is used instead (which, there, can jump when the system clock is stepped)
+monotonic = getattr(time, 'monotonic', time.time)
+perf_counter = getattr(time, 'perf_counter', time.time)
+
+# Preset dictionaries for zlib (the "zdict" argument) need Python 3.3
+ZLIB_PRESET_DICTIONARIES = sys.version_info >= (3, 3)
+
+def isfinite(value):
+    return not (math.isinf(value) or math.isnan(value))
+
+def gzip_compress(data):
+    if not PY2:
+        return gzip.compress(data)
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as gzip_file:
+        gzip_file.write(data)
+    return buffer.getvalue()
+
+def gzip_decompress(data):
+    if not PY2:
+        return gzip.decompress(data)
+    with gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb') as gzip_file:
+        return gzip_file.read()
@@ -0,0 +1,255 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Report-by-exception: per-property deadband and compression filters that
+# sit between create_data_values_message and the sender, so that values of
+# slowly changing properties (a board temperature, say) are only sent when
+# they actually change, plus at least once every max_interval seconds
+# ************************************************************************
+
+# Import packages
+import copy
+import numbers
+
+from omf_edge.log import get_logger
+from omf_edge.records import parse_iso_timestamp
+
+log = get_logger('omf.deadband')
+
+# What a property filter wants done with the value it was just given
+REPORT_NOTHING = 0
+REPORT_CURRENT = 1   # send the value that was just given
+REPORT_PREVIOUS = 2  # send the value given before it (swinging door only)
+
+# ************************************************************************
+# Property filters; each one keeps the state for one property of one container
+# ************************************************************************
+
+# Base class: reports every value that is not a number whenever it changes,
+# and any value at all once max_interval seconds have passed since the last
+# report (a heartbeat, so that PI can tell a steady value from a dead sensor)
+class PropertyFilter(object):
+
+    def __init__(self, max_interval=None):
+        self.max_interval = max_interval
+        self.last_reported_time = None
+        self.last_reported_value = None
+
+    # Returns REPORT_NOTHING, REPORT_CURRENT, or REPORT_PREVIOUS
+    def offer(self, timestamp, value):
+        if self.last_reported_time is None:
+            decision = REPORT_CURRENT
+        elif _is_number(value) and _is_number(self.last_reported_value):
+            decision = self._decide(timestamp, value)
+        else:
+            decision = REPORT_CURRENT if value != self.last_reported_value else REPORT_NOTHING
+        if decision == REPORT_NOTHING and self.max_interval is not None:
+            if timestamp - self.last_reported_time >= self.max_interval:
+                decision = REPORT_CURRENT
+        if decision == REPORT_CURRENT:
+            self.reported(timestamp, value)
+        return decision
+
+    # Tells the filter that this value was sent (by itself, or as part of a whole event)
+    def reported(self, timestamp, value):
+        self.last_reported_time = timestamp
+        self.last_reported_value = value
+
+    # Overridden by subclasses: decides what to do with a new numeric value
+    def _decide(self, timestamp, value):
+        return REPORT_CURRENT
+
+# Any real number (Python 2 longs and NumPy scalars included), but not a bool
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+# Reports a value when it differs from the last reported value by more than
+# a fixed amount, e.g. AbsoluteDeadband(0.5) for a temperature in degrees
+class AbsoluteDeadband(PropertyFilter):
+
+    def __init__(self, deadband, max_interval=None):
+        PropertyFilter.__init__(self, max_interval)
+        self.deadband = deadband
+
+    def _decide(self, timestamp, value):
+        if abs(value - self.last_reported_value) > self.deadband:
+            return REPORT_CURRENT
+        return REPORT_NOTHING
+
+# Reports a value when it differs from the last reported value by more than a
+# percentage; of the given span (the range of the sensor), or if there is no
+# span, of the last reported value itself
+class PercentDeadband(PropertyFilter):
+
+    def __init__(self, percent, span=None, max_interval=None):
+        PropertyFilter.__init__(self, max_interval)
+        self.percent = percent
+        self.span = span
+
+    def _decide(self, timestamp, value):
+        reference = self.span if self.span is not None else abs(self.last_reported_value)
+        if abs(value - self.last_reported_value) > reference * self.percent / 100.0:
+            return REPORT_CURRENT
+        return REPORT_NOTHING
+
+# The swinging door compression used by the PI Data Archive: a value is only
+# reported when the values since the last report can no longer be drawn as a
+# straight line (within +/- deviation); the value reported is then the one
+# just before the line broke, so reports lag by one value
+class SwingingDoor(PropertyFilter):
+
+    def __init__(self, deviation, max_interval=None):
+        PropertyFilter.__init__(self, max_interval)
+        self.deviation = deviation
+        self.held = None
+        self.slope_low = float('-inf')
+        self.slope_high = float('inf')
+
+    def reported(self, timestamp, value):
+        PropertyFilter.reported(self, timestamp, value)
+        self.held = None
+        self.slope_low = float('-inf')
+        self.slope_high = float('inf')
+
+    # Narrows the door (the range of slopes, starting at the last reported
+    # value, that stay within +/- deviation of every value since), and holds
+    # on to this value in case it has to be reported later
+    def _hold(self, timestamp, value):
+        elapsed = timestamp - self.last_reported_time
+        self.slope_low = max(self.slope_low, (value - self.deviation - self.last_reported_value) / elapsed)
+        self.slope_high = min(self.slope_high, (value + self.deviation - self.last_reported_value) / elapsed)
+        self.held = (timestamp, value)
+
+    def _decide(self, timestamp, value):
+        elapsed = timestamp - self.last_reported_time
+        if elapsed <= 0:
+            return REPORT_CURRENT
+        slope = (value - self.last_reported_value) / elapsed
+        if self.slope_low <= slope <= self.slope_high:
+            self._hold(timestamp, value)
+            return REPORT_NOTHING
+        if self.held is None:
+            return REPORT_CURRENT
+        # The door broke: report the held value, and start a new door from it
+        held_timestamp, held_value = self.held
+        self.reported(held_timestamp, held_value)
+        self._hold(timestamp, value)
+        return REPORT_PREVIOUS
+
+# ************************************************************************
+# The filter applied to whole OMF data messages
+# ************************************************************************
+
+# "filters" maps property names to a filter (used as a template, and copied
+# for each container); properties without a filter are always sent.
+#
+# !!! Note: when an event does not include one of the properties of its type,
+# the PI Connector Relay writes the default value (such as zero) for it; so,
+# by default (whole_events=True), an event is either sent whole, when any of
+# its properties has to be reported, or not at all.  Only set whole_events to
+# False for endpoints that leave missing properties alone; then only the
+# properties that have to be reported are sent.
+class ExceptionFilter(object):
+
+    def __init__(self, filters, whole_events=True, index_property='Time'):
+        self.filters = filters
+        self.whole_events = whole_events
+        self.index_property = index_property
+        self._container_filters = {}
+        # containerid -> (last event, whether that whole event was sent)
+        self._last_events = {}
+        # containerid -> property -> [values received, values sent]
+        self.counters = {}
+
+    def _filters_for(self, containerid):
+        if containerid not in self._container_filters:
+            self._container_filters[containerid] = dict(
+                (name, copy.deepcopy(template)) for name, template in self.filters.items())
+            self.counters[containerid] = {}
+        return self._container_filters[containerid]
+
+    def _count(self, containerid, event, position):
+        counters = self.counters[containerid]
+        for name in event:
+            if name != self.index_property:
+                counters.setdefault(name, [0, 0])[position] += 1
+
+    # Filters one container's list of events; returns the events to send
+    def filter_values(self, containerid, events):
+        filters = self._filters_for(containerid)
+        output = []
+        for event in events:
+            self._count(containerid, event, 0)
+            timestamp = parse_iso_timestamp(event[self.index_property])
+            last_event, last_event_sent = self._last_events.get(containerid, (None, True))
+            current = {}
+            previous = {}
+            for name, value in event.items():
+                if name == self.index_property:
+                    continue
+                property_filter = filters.get(name)
+                decision = REPORT_CURRENT if property_filter is None else property_filter.offer(timestamp, value)
+                if decision == REPORT_CURRENT:
+                    current[name] = value
+                elif decision == REPORT_PREVIOUS and last_event is not None and name in last_event:
+                    previous[name] = last_event[name]
+            if self.whole_events:
+                to_send = []
+                if previous and not last_event_sent:
+                    to_send.append(last_event)
+                if current:
+                    to_send.append(event)
+                # Every property went out as part of a whole event, so each
+                # filter has to carry on from the value that was really sent
+                for sent_event in to_send:
+                    sent_timestamp = parse_iso_timestamp(sent_event[self.index_property])
+                    for name, property_filter in filters.items():
+                        if name in sent_event and property_filter.last_reported_time != sent_timestamp:
+                            property_filter.reported(sent_timestamp, sent_event[name])
+                self._last_events[containerid] = (event, bool(current))
+            else:
+                to_send = []
+                if previous:
+                    previous[self.index_property] = last_event[self.index_property]
+                    to_send.append(previous)
+                if current:
+                    current[self.index_property] = event[self.index_property]
+                    to_send.append(current)
+                self._last_events[containerid] = (event, False)
+            for sent_event in to_send:
+                self._count(containerid, sent_event, 1)
+            output.extend(to_send)
+        return output
+
+    # Filters an OMF data message (as returned by create_data_values_message);
+    # returns the message to send, or None if there is nothing left to send
+    def filter_message(self, data_message):
+        filtered = []
+        for entry in data_message:
+            if 'containerid' not in entry:
+                filtered.append(entry)
+                continue
+            values = self.filter_values(entry['containerid'], entry['values'])
+            if values:
+                filtered.append(dict(entry, values=values))
+        return filtered or None
+
+    # Prints, for each property, how many values were sent and how many were dropped
+    def print_counters(self):
+        lines = ['--- Report-by-exception counters (values sent / dropped):']
+        for containerid, counters in self.counters.items():
+            for name, (received, sent) in sorted(counters.items()):
+                lines.append('    {0} / {1}: {2} / {3}'.format(containerid, name, sent, received - sent))
+        log.info('\n'.join(lines))
@@ -0,0 +1,228 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Fan-out sender: sends the same OMF messages to several endpoints at once
+# (for example, an on-premises PI Connector Relay and OSIsoft Cloud
+# Services).  Each message is serialized, and compressed, once; every
+# endpoint then has its own queue, worker thread, retries and spool file,
+# so a slow or unreachable endpoint never holds back the others
+# ************************************************************************
+
+# Import packages
+import threading
+import time
+
+from omf_edge.compat import gzip_compress, perf_counter, queue
+from omf_edge.log import get_logger
+from omf_edge.sender import OMFSender
+
+log = get_logger('omf.fanout')
+
+# ************************************************************************
+# One endpoint: its sender, its queue of messages, and the thread that sends them
+# ************************************************************************
+
+# Messages are sent in the order they were queued, so types still reach each
+# endpoint before the containers and data that use them.  A message that
+# fails because the endpoint could not be reached (or answered with a server
+# error) is retried, waiting retry_seconds, then twice as long, and so on (up
+# to max_retry_seconds).  A data message is retried up to retries times, and
+# then spooled; the spool is sent again after the next data message that goes
+# through.  A type or container message is retried until it goes through, so
+# the data queued after it (and the spool) is only sent once the endpoint
+# knows its types and containers.  If the queue is
+# full (the endpoint is falling behind), new data messages go straight to the
+# spool file, or are dropped if there is none.
+class FanOutEndpoint(object):
+
+    def __init__(self, sender, omf_cloud=False, queue_size=1000, retries=3, retry_seconds=1.0,
+                 max_retry_seconds=60.0):
+        self.sender = sender
+        # OSIsoft Cloud Services takes no static types, assets or links
+        self.omf_cloud = omf_cloud
+        self.retries = retries
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.queue = queue.Queue(queue_size)
+        self.messages_retried = 0
+        self.messages_dropped = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='fan-out: ' + (self.sender.name or self.sender.url))
+        self._thread.daemon = True
+        self._thread.start()
+
+    # Queues one message (called from the sending loop; never waits on the
+    # endpoint, except for a type or container message when the queue is full,
+    # since those must not be lost)
+    def put(self, message_type, body, action, gzipped_body):
+        item = (message_type, body, action, gzipped_body)
+        if message_type.lower() != 'data':
+            self.queue.put(item)
+            return True
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            if self.sender.spool_path is not None:
+                self.sender.spool(message_type, body, action)
+            else:
+                self.messages_dropped += 1
+            return False
+
+    def _send(self, message_type, body, action, gzipped_body):
+        is_data = message_type.lower() == 'data'
+        delay = self.retry_seconds
+        attempt = 0
+        while True:
+            if attempt:
+                self.messages_retried += 1
+                if self.sender.metrics is not None:
+                    self.sender.metrics.retries.inc((self.sender.name or self.sender.url,))
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_seconds)
+            if self.sender.send(message_type, body, action, gzipped_body, spool=False):
+                return True
+            if not self.sender.can_retry():
+                if not is_data:
+                    log.error('{0} rejected a {1} message with status {2}; the data that uses it will be rejected too',
+                              self.sender.url, message_type, self.sender.last_status_code, key=self.sender.url)
+                return False
+            attempt += 1
+            if is_data and attempt > self.retries:
+                break
+            if attempt == self.retries + 1:
+                log.warning('Still retrying a {0} message to {1}; its data waits until it goes through',
+                            message_type, self.sender.url, key=self.sender.url)
+        self.sender.spool(message_type, body, action)
+        return False
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                if self._send(*item) and item[0].lower() == 'data':
+                    # The endpoint can be reached again, so send anything that was spooled
+                    self.sender.replay_spool()
+            except Exception as ex:
+                log.error('Error when sending to {0}: {1}', self.sender.url, ex, key=self.sender.url)
+            finally:
+                self.queue.task_done()
+
+    def stop(self, timeout=None):
+        self.queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def print_counters(self):
+        self.sender.print_counters()
+        log.info('    {0} queued, {1} retries, {2} dropped because the queue was full',
+                 self.queue.qsize(), self.messages_retried, self.messages_dropped)
+
+# ************************************************************************
+# The fan-out sender
+# ************************************************************************
+
+# endpoints is a list of FanOutEndpoint; make_fan_out_sender builds them
+# from the "endpoints" list of a runner configuration file.
+#
+# Typical use:
+#   fan_out = FanOutSender([
+#       FanOutEndpoint(OMFSender(RELAY_URL, RELAY_TOKEN, verify_ssl=False, name='relay')),
+#       FanOutEndpoint(OMFSender(OCS_URL, OCS_TOKEN, compression='gzip', name='ocs'), omf_cloud=True)
+#   ])
+#   fan_out.start()
+#   fan_out.send("Data", message_body)
+class FanOutSender(object):
+
+    def __init__(self, endpoints):
+        self.endpoints = list(endpoints)
+        self.url = ', '.join(endpoint.sender.url for endpoint in self.endpoints)
+        # A LoopProfiler, to record the time spent compressing in (or None)
+        self.profiler = None
+
+    def start(self):
+        for endpoint in self.endpoints:
+            endpoint.start()
+
+    # Queues one message (its JSON text) for every endpoint, or, with
+    # omf_cloud=False, only for the endpoints that are not OSIsoft Cloud
+    # Services (for static types, assets and links).  Returns True if every
+    # endpoint took the message
+    def send(self, message_type, body, action='create', omf_cloud=True):
+        endpoints = [e for e in self.endpoints if omf_cloud or not e.omf_cloud]
+        gzipped_body = None
+        if any(e.sender.compression == 'gzip' for e in endpoints):
+            compress_start = perf_counter()
+            gzipped_body = gzip_compress(body.encode('utf-8'))
+            if self.profiler is not None:
+                self.profiler.record('compress', perf_counter() - compress_start)
+        queued = [endpoint.put(message_type, body, action, gzipped_body) for endpoint in endpoints]
+        return all(queued)
+
+    # Each endpoint's worker sends its own spool once the endpoint can be
+    # reached again, so there is nothing to do here
+    def replay_spool(self, max_messages=100):
+        return 0
+
+    # Blocks until every queued message has been sent (or given up on)
+    def join(self):
+        for endpoint in self.endpoints:
+            endpoint.queue.join()
+
+    def stop(self, timeout=None):
+        for endpoint in self.endpoints:
+            endpoint.stop(timeout)
+
+    def print_counters(self):
+        for endpoint in self.endpoints:
+            endpoint.print_counters()
+
+# Builds a FanOutSender from a list of endpoint settings, as in the runner's
+# configuration file (each with the settings of the "endpoint" section, plus
+# an optional "name", "queue_size", "retries", "retry_seconds", "max_retry_seconds"
+# and "spool_file");
+# metrics, if given, is the SendPathMetrics that every endpoint records in
+def make_fan_out_sender(endpoint_configs, metrics=None):
+    endpoints = []
+    for index, endpoint in enumerate(endpoint_configs):
+        # Each message is encoded once, for every endpoint, so all take JSON
+        if endpoint.get("message_format", "JSON").upper() != "JSON":
+            raise ValueError('Only the JSON message format can be sent to several endpoints')
+        if endpoint.get("compression") not in (None, "gzip"):
+            raise ValueError('Only gzip compression can be used when sending to several endpoints')
+        sender = OMFSender(
+            endpoint["url"],
+            endpoint["producer_token"],
+            verify_ssl=endpoint.get("verify_ssl", True),
+            timeout_seconds=endpoint.get("timeout_seconds", 30),
+            compression=endpoint.get("compression"),
+            spool_path=endpoint.get("spool_file"),
+            print_messages=endpoint.get("print_messages", False),
+            name=endpoint.get("name", "endpoint {0}".format(index + 1)),
+            metrics=metrics
+        )
+        endpoints.append(FanOutEndpoint(
+            sender,
+            omf_cloud=endpoint.get("omf_cloud", False),
+            queue_size=endpoint.get("queue_size", 1000),
+            retries=endpoint.get("retries", 3),
+            retry_seconds=endpoint.get("retry_seconds", 1.0),
+            max_retry_seconds=endpoint.get("max_retry_seconds", 60.0)
+        ))
+    return FanOutSender(endpoints)
@@ -0,0 +1,324 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# OMF ingress emulator: a local stand-in for a PI Connector Relay (or any
+# other OMF endpoint), for trying out and benchmarking the senders without
+# a PI System.  It takes type, container and data messages with the same
+# headers that the scripts send, un-gzips (or inflates, with the preset
+# dictionaries of omf_edge.precompress) and decodes them (JSON, or any
+# other format of omf_edge.message_format), checks data values against
+# the types that were sent (taking what a PI Connector Relay takes, rather
+# than the stricter checks of the scripts' own SchemaRegistry), and counts the events of each stream, so that
+# a benchmark can check that nothing was lost; it can also add latency, and
+# answer with errors (503) and "too large" (413), to exercise the senders.
+#
+# To run it on its own, from this folder:
+#   python3 -m omf_edge.ingress_emulator --port 8118 --latency-ms 50 --error-rate 0.05
+# then point a script's TARGET_URL at http://localhost:8118/ingress/messages;
+# GET http://localhost:8118/stats returns the counters as JSON
+# ************************************************************************
+
+# Import packages
+import argparse
+import collections
+import json
+import random
+import threading
+import time
+
+from omf_edge.compat import BaseHTTPRequestHandler, HTTPServer, ThreadingMixIn, gzip_decompress
+from omf_edge.message_format import MESSAGE_FORMATS, make_message_format
+from omf_edge.precompress import build_dictionary, dictionary_id, inflate
+from omf_edge.schema import OMFValidationError, SchemaRegistry
+
+MESSAGE_TYPES = ('type', 'container', 'data')
+ACTIONS = ('create', 'update', 'delete')
+# The values of the "omfversion" header that are taken
+OMF_VERSIONS = ('1.0', '1.1')
+
+# ************************************************************************
+# The emulated endpoint: its OMF state, faults, and counters
+# ************************************************************************
+
+# Faults are applied in this order: latency (latency_seconds, plus up to
+# latency_jitter_seconds more), then a 413 for any message body over
+# max_message_bytes (as sent, before un-gzipping, like the 192 KB limit of
+# PI and OCS) or, at random, for a fraction
+# too_large_rate of data messages, then a 503 for a fraction error_rate of
+# all messages.  A message that got a fault is not processed, exactly as if
+# the endpoint had refused it, so a sender that retries it does not count twice.
+class OMFIngress(object):
+
+    def __init__(self, producer_token=None, latency_seconds=0.0, latency_jitter_seconds=0.0,
+                 error_rate=0.0, too_large_rate=0.0, max_message_bytes=192 * 1024, validate=True, seed=None):
+        # If set, messages with any other producer token are refused (401)
+        self.producer_token = producer_token
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.error_rate = error_rate
+        self.too_large_rate = too_large_rate
+        self.max_message_bytes = max_message_bytes
+        self.validate = validate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # The decoder of each "messageformat", created when it is first used
+        self._formats = {}
+        self.reset()
+
+    # Forgets all types, containers and counters
+    def reset(self):
+        with self._lock:
+            self.registry = SchemaRegistry(strict=False)
+            self.events_per_stream = collections.Counter()
+            self.messages_per_type = collections.Counter()
+            self.messages_per_format = collections.Counter()
+            self.responses = collections.Counter()
+            self.bytes_received = 0
+            self.bytes_decompressed = 0
+            self.errors = collections.deque(maxlen=20)
+            # The preset dictionary for each set of types and containers
+            # received so far, by dictionary id, for "deflate" compression
+            self.dictionaries = {}
+
+    def _fault(self, message_type, body_bytes):
+        with self._lock:
+            # The random generator is shared between request threads
+            jitter = self._random.uniform(0, self.latency_jitter_seconds) if self.latency_jitter_seconds else 0
+            too_large_roll = self._random.random()
+            error_roll = self._random.random()
+        delay = self.latency_seconds + jitter
+        if delay > 0:
+            time.sleep(delay)
+        if body_bytes > self.max_message_bytes:
+            return 413, 'The message is {0} bytes; at most {1} are accepted'.format(body_bytes, self.max_message_bytes)
+        if message_type == 'data' and too_large_roll < self.too_large_rate:
+            return 413, 'Injected fault: message too large'
+        if error_roll < self.error_rate:
+            return 503, 'Injected fault: service unavailable'
+        return None
+
+    # Handles one message; headers is a dict with lower-case keys.  Returns
+    # (status code, response text)
+    def handle(self, headers, body):
+        status, text = self._handle(headers, body)
+        with self._lock:
+            self.responses[status] += 1
+            if status >= 300:
+                self.errors.append('{0} {1}'.format(status, text))
+        return status, text
+
+    def _handle(self, headers, body):
+        with self._lock:
+            self.bytes_received += len(body)
+        message_type = headers.get('messagetype', '').lower()
+        action = headers.get('action', '').lower()
+        if message_type not in MESSAGE_TYPES:
+            return 400, 'Missing or unknown messagetype header "{0}"'.format(headers.get('messagetype'))
+        if action not in ACTIONS:
+            return 400, 'Missing or unknown action header "{0}"'.format(headers.get('action'))
+        if 'producertoken' not in headers:
+            return 401, 'Missing producertoken header'
+        if self.producer_token is not None and headers['producertoken'] != self.producer_token:
+            return 401, 'Unknown producer token'
+        if 'omfversion' not in headers:
+            return 400, 'Missing omfversion header'
+        if headers['omfversion'] not in OMF_VERSIONS:
+            return 400, 'Unsupported omfversion "{0}"'.format(headers['omfversion'])
+        format_name = headers.get('messageformat', 'JSON').lower()
+        if format_name not in MESSAGE_FORMATS:
+            return 400, 'Unsupported messageformat "{0}"'.format(headers.get('messageformat'))
+        fault = self._fault(message_type, len(body))
+        if fault is not None:
+            return fault
+        compression = headers.get('compression', '').lower()
+        if compression == 'gzip':
+            try:
+                body = gzip_decompress(body)
+            except (IOError, OSError, EOFError) as ex:
+                return 400, 'The body could not be un-gzipped: ' + str(ex)
+        elif compression == 'deflate':
+            try:
+                with self._lock:
+                    dictionaries = dict(self.dictionaries)
+                body = inflate(body, dictionaries)
+            except ValueError as ex:
+                return 400, 'The body could not be inflated: ' + str(ex)
+        elif compression not in ('', 'none'):
+            return 400, 'Unsupported compression "{0}"'.format(compression)
+        with self._lock:
+            self.bytes_decompressed += len(body)
+        message_format = self._formats.get(format_name)
+        if message_format is None:
+            message_format = self._formats[format_name] = make_message_format(format_name)
+        try:
+            message = message_format.decode(body)
+        except ValueError as ex:
+            return 400, 'The body could not be decoded as {0}: {1}'.format(message_format.name, ex)
+        if not isinstance(message, list):
+            return 400, 'The body must be an array'
+        try:
+            with self._lock:
+                self._process(message_type, action, message, format_name)
+        except (OMFValidationError, KeyError, TypeError, ValueError) as ex:
+            return 400, 'Invalid {0} message: {1}'.format(message_type, ex)
+        return 202, ''
+
+    def _process(self, message_type, action, message, format_name):
+        if message_type == 'type':
+            self.registry.add_types(message)
+        elif message_type == 'container':
+            for container in message:
+                if container['typeid'] not in self.registry.types:
+                    raise OMFValidationError('Type "{0}" has not been defined'.format(container['typeid']))
+            self.registry.add_containers(message)
+        elif action != 'delete':
+            if self.validate:
+                self.registry.validate_data_message(message)
+            for entry in message:
+                stream = entry.get('containerid') or entry.get('typeid')
+                self.events_per_stream[stream] += len(entry['values'])
+        self.messages_per_type[message_type] += 1
+        self.messages_per_format[format_name] += 1
+        if message_type != 'data':
+            dictionary = build_dictionary(
+                dict((typeid, compiled.definition) for typeid, compiled in self.registry.types.items()),
+                self.registry.containers)
+            self.dictionaries[dictionary_id(dictionary)] = dictionary
+
+    def stats(self):
+        with self._lock:
+            return {
+                'events_per_stream': dict(self.events_per_stream),
+                'events': sum(self.events_per_stream.values()),
+                'messages_per_type': dict(self.messages_per_type),
+                'messages_per_format': dict(self.messages_per_format),
+                'responses': dict((str(status), count) for status, count in self.responses.items()),
+                'bytes_received': self.bytes_received,
+                'bytes_decompressed': self.bytes_decompressed,
+                'types': sorted(self.registry.types),
+                'containers': sorted(self.registry.containers),
+                'recent_errors': list(self.errors)
+            }
+
+# ************************************************************************
+# The HTTP server
+# ************************************************************************
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def _make_handler(ingress, quiet):
+
+    class IngressRequestHandler(BaseHTTPRequestHandler):
+
+        # Keep-alive, so that senders with a pooled session reuse their connection
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, status, text, content_type='text/plain'):
+            payload = text.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length)
+            headers = dict((key.lower(), value) for key, value in self.headers.items())
+            status, text = ingress.handle(headers, body)
+            self._reply(status, text)
+
+        def do_GET(self):
+            if self.path.rstrip('/').endswith('/stats'):
+                self._reply(200, json.dumps(ingress.stats()), 'application/json')
+            else:
+                self._reply(404, 'Use POST for OMF messages, or GET /stats')
+
+        def do_DELETE(self):
+            if self.path.rstrip('/').endswith('/stats'):
+                ingress.reset()
+                self._reply(200, '')
+            else:
+                self._reply(404, '')
+
+        def log_message(self, format, *args):
+            if not quiet:
+                BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    return IngressRequestHandler
+
+# Typical use, from a benchmark:
+#   emulator = IngressEmulator(OMFIngress(latency_seconds=0.02))
+#   emulator.start()
+#   ... send to emulator.url ...
+#   print(emulator.ingress.stats()['events_per_stream'])
+#   emulator.stop()
+class IngressEmulator(object):
+
+    def __init__(self, ingress=None, host='127.0.0.1', port=0, quiet=True):
+        self.ingress = ingress or OMFIngress()
+        self.server = _ThreadingHTTPServer((host, port), _make_handler(self.ingress, quiet))
+        self.host, self.port = self.server.server_address[:2]
+        self.url = 'http://{0}:{1}/ingress/messages'.format(self.host, self.port)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='omf ingress emulator')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# ************************************************************************
+# Command line
+# ************************************************************************
+
+def main():
+    parser = argparse.ArgumentParser(description='A local OMF ingress endpoint for testing and benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8118)
+    parser.add_argument('--producer-token', default=None, help='refuse messages with any other token')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='added to every response')
+    parser.add_argument('--latency-jitter-ms', type=float, default=0.0, help='random extra latency, up to this')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of messages answered with 503')
+    parser.add_argument('--too-large-rate', type=float, default=0.0, help='fraction of data messages answered with 413')
+    parser.add_argument('--max-message-bytes', type=int, default=192 * 1024)
+    parser.add_argument('--no-validate', action='store_true', help='do not check data values against their types')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+    ingress = OMFIngress(
+        producer_token=args.producer_token,
+        latency_seconds=args.latency_ms / 1000.0,
+        latency_jitter_seconds=args.latency_jitter_ms / 1000.0,
+        error_rate=args.error_rate,
+        too_large_rate=args.too_large_rate,
+        max_message_bytes=args.max_message_bytes,
+        validate=not args.no_validate,
+        seed=args.seed
+    )
+    emulator = IngressEmulator(ingress, args.host, args.port, quiet=not args.verbose)
+    print('--- OMF ingress emulator listening on ' + emulator.url + ' (counters at /stats)')
+    try:
+        emulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(ingress.stats(), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# LED bar graph: shows the most recent readings of one value as a bar graph
+# on an 8x8 LED matrix (such as the Sense HAT's), drawn on its own
+# low-priority thread, so that sampling and sending never wait on the display
+# ************************************************************************
+
+# Import packages
+import collections
+import os
+import threading
+
+from omf_edge.log import get_logger
+
+log = get_logger('omf.led_display')
+
+# ************************************************************************
+# Helper function: lower the priority of the calling thread, where possible
+# ************************************************************************
+
+# On Linux, each thread has its own "nice" value, which os.setpriority can set
+# when given the thread's native id; elsewhere, this does nothing
+def lower_current_thread_priority(niceness=10):
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except (AttributeError, OSError):
+        pass
+
+# ************************************************************************
+# The renderer
+# ************************************************************************
+
+# display is any object with set_pixels(list of 64 (r, g, b)) and clear()
+# methods, such as a sense_hat.SenseHat.  Each column shows one reading, the
+# oldest on the left; readings are scaled between the smallest and largest
+# reading shown, and each row is lit in its own color from row_colors (top
+# row first).  Since the Sense HAT is mounted upside-down in the original
+# sample, larger readings light more rows from the bottom.  is_dark, if given,
+# is a function that returns True when the display should be off (for
+# example, at night).
+#
+# Typical use:
+#   led_display = LedBarGraph(sense, RED_TO_GREEN_COLOR_BAR, DEFAULT_BACKGROUND_COLOR)
+#   led_display.start()
+#   ... for every reading: led_display.add(accelerationz)
+class LedBarGraph(object):
+
+    def __init__(self, display, row_colors, background_color, columns=8, is_dark=None,
+                 initial_value=1, dark_check_seconds=60):
+        self.display = display
+        self.row_colors = [tuple(color) for color in row_colors]
+        self.background_color = tuple(background_color)
+        self.columns = columns
+        self.is_dark = is_dark
+        # How often to check is_dark when no new readings come in
+        self.dark_check_seconds = dark_check_seconds
+        # Appending to a bounded deque drops the oldest reading in O(1), and
+        # is safe to do from the sampling thread while this thread reads it
+        self.history = collections.deque([initial_value] * columns, maxlen=columns)
+        self.frames_drawn = 0
+        self.frames_unchanged = 0
+        self._last_frame = None
+        self._changed = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Called from the sampling loop; only records the reading and wakes the renderer
+    def add(self, value):
+        self.history.append(value)
+        self._changed.set()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='led display')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._changed.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # Returns, for each column, the first row that is lit (0 for the largest
+    # reading shown, and the number of rows minus 1 for the smallest)
+    def _first_lit_rows(self, readings):
+        top = len(self.row_colors) - 1
+        smallest = min(readings)
+        span = float(max(readings) - smallest)
+        if span == 0:
+            # All readings are the same, so each column lights one row
+            return [top] * len(readings)
+        return [top - int(round(top * (reading - smallest) / span)) for reading in readings]
+
+    # Builds the whole frame, as the list of 64 pixels (row by row) that
+    # set_pixels takes
+    def render_frame(self, readings):
+        first_lit_rows = self._first_lit_rows(list(readings))
+        frame = []
+        for row, color in enumerate(self.row_colors):
+            for column in range(self.columns):
+                frame.append(color if row >= first_lit_rows[column] else self.background_color)
+        return frame
+
+    def _draw(self):
+        if self.is_dark is not None and self.is_dark():
+            frame = None
+        else:
+            frame = self.render_frame(self.history)
+        # Writing the framebuffer is the slow part, so it is only done when
+        # the frame has changed
+        if frame == self._last_frame:
+            self.frames_unchanged += 1
+            return
+        if frame is None:
+            self.display.clear()
+        else:
+            self.display.set_pixels(frame)
+        self._last_frame = frame
+        self.frames_drawn += 1
+
+    def _run(self):
+        lower_current_thread_priority()
+        while not self._stop.is_set():
+            self._changed.wait(self.dark_check_seconds)
+            self._changed.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self._draw()
+            except Exception as ex:
+                # The display is optional, so an error here never stops the script
+                log.error('Error when updating the LED display: {0}', ex)
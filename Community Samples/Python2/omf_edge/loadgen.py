@@ -0,0 +1,515 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+
+# ************************************************************************
+# Synthetic load generator: the random values of the tutorial
+# (Tutorials/Python_PI/Python_PI.py) for as many assets and containers as
+# needed, to find the most events per second that an endpoint (a PI
+# Connector Relay, or the ingress emulator) and the sender can keep up with.
+#
+# It defines the tutorial's types, then K assets under one parent asset,
+# each with M containers (of the tutorial's three dynamic types, in the
+# tutorial's pattern: two of the first type, then one each of the second and
+# third), and sends the type, container, asset and link messages.  Then the
+# containers are split across worker processes, each of which generates
+# every container's events at the given rate (or as fast as it can send
+# them) and sends them in batched messages through its own OMFSender.
+# Every report interval it prints the events per second asked for, sent and
+# accepted, and the request latency; with --ramp-factor, the rate goes up
+# step by step until the endpoint stops keeping up, and the highest rate it
+# kept up with is printed.
+#
+# For example, from this folder:
+#   python3 -m omf_edge.loadgen --url http://localhost:8118/ingress/messages --assets 100 \
+#       --containers-per-asset 10 --rate 1 --workers 4
+#   python3 -m omf_edge.loadgen --assets 1000 --rate 0.5 --ramp-factor 1.5 --step-seconds 20
+# ************************************************************************
+
+# Import packages
+import argparse
+import json
+import math
+import multiprocessing
+import random
+
+from omf_edge.clock import now
+from omf_edge.compat import monotonic, queue
+from omf_edge.profiler import percentile
+from omf_edge.records import iso_timestamp
+from omf_edge.schema import SchemaRegistry
+from omf_edge.sender import OMFSender
+
+# The most definitions (containers, assets or links) in one message, to stay
+# well under the 192 KB limit of a message
+DEFINITIONS_PER_MESSAGE = 500
+
+# ************************************************************************
+# The tutorial's types, and the definitions of a generated load
+# ************************************************************************
+
+def _property(property_type, **extra):
+    definition = {"type": property_type}
+    definition.update(extra)
+    return definition
+
+STATIC_TYPES = [
+    {"id": "FirstStaticType", "name": "First static type", "classification": "static", "type": "object",
+     "properties": {
+         "index": _property("string", isindex=True),
+         "name": _property("string", isname=True),
+         "StringProperty": _property("string")}},
+    {"id": "SecondStaticType", "name": "Second static type", "classification": "static", "type": "object",
+     "properties": {
+         "index": _property("string", isindex=True),
+         "name": _property("string", isname=True),
+         "StringProperty": _property("string")}}
+]
+
+DYNAMIC_TYPES = [
+    {"id": "FirstDynamicType", "name": "First dynamic type", "classification": "dynamic", "type": "object",
+     "properties": {
+         "timestamp": _property("string", format="date-time", isindex=True),
+         "IntegerProperty": _property("integer")}},
+    {"id": "SecondDynamicType", "name": "Second dynamic type", "classification": "dynamic", "type": "object",
+     "properties": {
+         "timestamp": _property("string", format="date-time", isindex=True),
+         "NumberProperty1": _property("number", format="float64"),
+         "NumberProperty2": _property("number", format="float64"),
+         "StringEnum": _property("string", enum=["False", "True"])}},
+    {"id": "ThirdDynamicType", "name": "Third dynamic type", "classification": "dynamic", "type": "object",
+     "properties": {
+         "timestamp": _property("string", format="date-time", isindex=True),
+         "IntegerEnum": _property("integer", format="int16", enum=[0, 1])}}
+]
+
+# The type of each container of an asset, in turn (as Container1 to Container4 of the tutorial)
+CONTAINER_TYPE_PATTERN = ("FirstDynamicType", "FirstDynamicType", "SecondDynamicType", "ThirdDynamicType")
+
+def _chunks(items, size):
+    return [items[first:first + size] for first in range(0, len(items), size)]
+
+# Returns the containers of a load: [{"id": ..., "typeid": ...}], asset by asset
+def make_containers(assets, containers_per_asset, prefix='LoadGen'):
+    return [
+        {"id": '{0}_asset{1}_container{2}'.format(prefix, asset, container),
+         "typeid": CONTAINER_TYPE_PATTERN[container % len(CONTAINER_TYPE_PATTERN)]}
+        for asset in range(assets) for container in range(containers_per_asset)
+    ]
+
+# Returns the messages that define a load, in the order they must be sent:
+# [(message type, message)]; without assets, only the types and containers
+# (for OSIsoft Cloud Services, which takes no static types, assets or links)
+def make_definitions(assets, containers_per_asset, prefix='LoadGen', with_assets=True):
+    containers = make_containers(assets, containers_per_asset, prefix)
+    messages = [("Type", (STATIC_TYPES if with_assets else []) + DYNAMIC_TYPES)]
+    messages += [("Container", chunk) for chunk in _chunks(containers, DEFINITIONS_PER_MESSAGE)]
+    if not with_assets:
+        return messages
+    asset_values = [{"index": prefix, "name": prefix, "StringProperty": "Load generator"}]
+    children = [{"index": '{0}_asset{1}'.format(prefix, asset), "name": '{0} asset {1}'.format(prefix, asset),
+                 "StringProperty": "Generated asset"} for asset in range(assets)]
+    messages.append(("Data", [{"typeid": "FirstStaticType", "values": asset_values}]))
+    messages += [("Data", [{"typeid": "SecondStaticType", "values": chunk}])
+                 for chunk in _chunks(children, DEFINITIONS_PER_MESSAGE)]
+    links = [{"source": {"typeid": "FirstStaticType", "index": "_ROOT"},
+              "target": {"typeid": "FirstStaticType", "index": prefix}}]
+    links += [{"source": {"typeid": "FirstStaticType", "index": prefix},
+               "target": {"typeid": "SecondStaticType", "index": child["index"]}} for child in children]
+    links += [{"source": {"typeid": "SecondStaticType", "index": container["id"].rsplit('_', 1)[0]},
+               "target": {"containerid": container["id"]}} for container in containers]
+    messages += [("Data", [{"typeid": "__Link", "values": chunk}])
+                 for chunk in _chunks(links, DEFINITIONS_PER_MESSAGE)]
+    return messages
+
+# ************************************************************************
+# Value distributions
+# ************************************************************************
+
+# Each distribution returns a new value every time it is called; each
+# container has its own, so random walks and sine waves are per container.
+# A distribution is given as "name:parameters", for example:
+#   uniform:0,100       - like the tutorial's 100*random.random() (the default)
+#   gauss:50,10         - normal, with a mean of 50 and a standard deviation of 10
+#   walk:50,1           - a random walk from 50, in normal steps of standard deviation 1
+#   sine:50,40,60       - 50 plus a sine wave of amplitude 40 and a period of 60
+#                         seconds, plus a little noise
+class Distribution(object):
+
+    def __init__(self, spec):
+        name, _, parameters = spec.partition(':')
+        self.name = name
+        self.parameters = [float(p) for p in parameters.split(',')] if parameters else []
+        defaults = {'uniform': [0, 100], 'gauss': [50, 10], 'walk': [50, 1], 'sine': [50, 40, 60]}
+        if name not in defaults:
+            raise ValueError('Unknown distribution "{0}"; use one of {1}'.format(name, ', '.join(sorted(defaults))))
+        self.parameters += defaults[name][len(self.parameters):]
+        self.level = self.parameters[0]
+        self.phase = random.uniform(0, 2 * math.pi)
+
+    def __call__(self, seconds):
+        first, second = self.parameters[0], self.parameters[1]
+        if self.name == 'uniform':
+            return first + (second - first) * random.random()
+        if self.name == 'gauss':
+            return random.gauss(first, second)
+        if self.name == 'walk':
+            self.level += random.gauss(0, second)
+            return self.level
+        period = self.parameters[2]
+        return first + second * math.sin(self.phase + 2 * math.pi * seconds / period) + random.gauss(0, second / 100.0)
+
+# Makes the events of one container, as the tutorial's
+# create_data_values_for_*_dynamic_type functions do; enums either toggle
+# at every event (as in the tutorial) or are picked at random
+class ContainerProducer(object):
+
+    def __init__(self, containerid, typeid, distribution, toggle_enums=True):
+        self.containerid = containerid
+        self.typeid = typeid
+        self.toggle_enums = toggle_enums
+        self.values = [Distribution(distribution) for _ in range(2)]
+        self.enum_value = 0
+        # Events due but not yet made, as a fraction of an event
+        self.carry = 0.0
+
+    def _enum(self):
+        if self.toggle_enums:
+            self.enum_value = 1 - self.enum_value
+        else:
+            self.enum_value = random.randint(0, 1)
+        return self.enum_value
+
+    def event(self, seconds):
+        timestamp = iso_timestamp(seconds)
+        if self.typeid == "FirstDynamicType":
+            return {"timestamp": timestamp, "IntegerProperty": int(self.values[0](seconds))}
+        if self.typeid == "SecondDynamicType":
+            return {"timestamp": timestamp, "NumberProperty1": self.values[0](seconds),
+                    "NumberProperty2": self.values[1](seconds), "StringEnum": ("False", "True")[self._enum()]}
+        return {"timestamp": timestamp, "IntegerEnum": self._enum()}
+
+    # The events from start to end (seconds since the epoch), count of them,
+    # evenly spaced
+    def events(self, start, end, count):
+        step = (end - start) / count
+        return [self.event(start + step * (index + 1)) for index in range(count)]
+
+# ************************************************************************
+# A worker process
+# ************************************************************************
+
+# Generates and sends the events of its containers until stop is set.  rate
+# is a shared value: events per second per container, or 0 for as fast as
+# they can be sent (max_events_per_message events per message).  Every
+# report_seconds it puts (its index, the number of the report, and its
+# counters since the last one) on the results queue
+def _run_worker(index, settings, containers, rate, stop, results):
+    if settings['seed'] is not None:
+        random.seed(settings['seed'] + index)
+    sender = OMFSender(settings['url'], settings['producer_token'], verify_ssl=settings['verify_ssl'],
+                       compression=settings['compression'])
+    registry = SchemaRegistry()
+    registry.add_types(DYNAMIC_TYPES)
+    registry.add_containers(containers)
+    producers = [ContainerProducer(c["id"], c["typeid"], settings['distribution'], settings['toggle_enums'])
+                 for c in containers]
+    max_events = settings['max_events_per_message']
+    send_interval = settings['send_interval_seconds']
+    counters = _new_counters()
+    generated_until = now()
+    report_number = 0
+    last_report = last_round = monotonic()
+    next_report = last_report + settings['report_seconds']
+    next_send = last_report
+    while not stop.is_set():
+        events_per_second = rate.value
+        # The events asked for since the last round (or report), whether or not they are generated in time
+        round_start = monotonic()
+        counters['target'] += events_per_second * len(producers) * (round_start - last_round)
+        last_round = round_start
+        current = now()
+        if events_per_second > 0:
+            start, end = generated_until, max(current, generated_until + 1e-6)
+        else:
+            # As fast as possible: one message's worth of events per round
+            per_container = max(1, max_events // len(producers))
+            start, end = generated_until, max(current, generated_until + per_container * 1e-6)
+        generated_until = end
+        message = []
+        message_events = 0
+        for producer in producers:
+            if events_per_second > 0:
+                due = producer.carry + events_per_second * (end - start)
+                count = int(due)
+                producer.carry = due - count
+            else:
+                count = per_container
+            events = producer.events(start, end, count) if count else []
+            first = 0
+            while first < len(events):
+                batch = events[first:first + max_events - message_events]
+                first += len(batch)
+                message.append({"containerid": producer.containerid, "values": batch})
+                message_events += len(batch)
+                counters['generated'] += len(batch)
+                if message_events >= max_events:
+                    _send(sender, registry, message, message_events, counters)
+                    message = []
+                    message_events = 0
+        if message:
+            _send(sender, registry, message, message_events, counters)
+        report_time = monotonic()
+        if report_time >= next_report:
+            counters['target'] += events_per_second * len(producers) * (report_time - last_round)
+            last_round = report_time
+            counters['seconds'] = report_time - last_report
+            last_report = report_time
+            results.put((index, report_number, counters))
+            report_number += 1
+            counters = _new_counters()
+            next_report += settings['report_seconds']
+        if events_per_second > 0:
+            next_send += send_interval
+            delay = next_send - monotonic()
+            if delay > 0:
+                stop.wait(delay)
+            else:
+                # Behind: the sender is not keeping up with the rate
+                counters['behind_seconds'] = max(counters['behind_seconds'], -delay)
+                next_send = monotonic()
+    sender.close()
+
+def _new_counters():
+    return {'seconds': 0.0, 'target': 0.0, 'generated': 0, 'sent': 0, 'accepted': 0, 'messages': 0, 'failed': 0,
+            'bytes': 0, 'latencies': [], 'behind_seconds': 0.0}
+
+def _send(sender, registry, message, events, counters):
+    accepted = sender.send("Data", registry.encode_data_message(message), spool=False)
+    counters['messages'] += 1
+    counters['sent'] += events
+    counters['bytes'] += sender.last_sent_bytes
+    if sender.last_latency_seconds is not None:
+        counters['latencies'].append(sender.last_latency_seconds)
+    if accepted:
+        counters['accepted'] += events
+    else:
+        counters['failed'] += 1
+
+# ************************************************************************
+# The load generator
+# ************************************************************************
+
+# Sends the definitions, starts the workers, and prints a report every
+# report_seconds.  settings holds the sender settings and the shape of the
+# load (see main for each one).  With ramp_factor, the rate is multiplied by
+# it every step_seconds for as long as the endpoint keeps up; otherwise the
+# load runs at the same rate for duration_seconds (or until CTRL+C)
+class LoadGenerator(object):
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.containers = make_containers(settings['assets'], settings['containers_per_asset'], settings['prefix'])
+        self.workers = []
+        self.rate = multiprocessing.Value('d', settings['rate'], lock=False)
+        self.stop = multiprocessing.Event()
+        self.results = multiprocessing.Queue()
+        # Reports not yet printed: the workers' counters, by report number
+        self.reports = {}
+        self.report_number = 0
+        # The highest total events per second that were kept up with
+        self.max_sustained = None
+
+    def send_definitions(self):
+        settings = self.settings
+        sender = OMFSender(settings['url'], settings['producer_token'], verify_ssl=settings['verify_ssl'],
+                           compression=settings['compression'])
+        try:
+            for message_type, message in make_definitions(settings['assets'], settings['containers_per_asset'],
+                                                          settings['prefix'], settings['with_assets']):
+                if not sender.send(message_type, json.dumps(message), spool=False):
+                    raise RuntimeError('The endpoint did not accept a {0} message ({1})'.format(
+                        message_type, sender.last_status_code))
+        finally:
+            sender.close()
+        print('--- Defined {0} assets and {1} containers'.format(settings['assets'], len(self.containers)))
+
+    def start_workers(self):
+        count = max(1, min(self.settings['workers'], len(self.containers)))
+        for index in range(count):
+            worker = multiprocessing.Process(
+                target=_run_worker, name='omf load worker {0}'.format(index),
+                args=(index, self.settings, self.containers[index::count], self.rate, self.stop, self.results))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def stop_workers(self):
+        self.stop.set()
+        for worker in self.workers:
+            worker.join(self.settings['report_seconds'] + 30)
+
+    # Waits until every worker has sent its next report, and returns their
+    # counters added up (with the mean of their seconds), or None if not
+    # every worker reported within timeout_seconds
+    def _collect(self, timeout_seconds):
+        number = self.report_number
+        while len(self.reports.get(number, ())) < len(self.workers):
+            try:
+                index, report_number, counters = self.results.get(timeout=timeout_seconds)
+            except queue.Empty:
+                return None
+            self.reports.setdefault(report_number, []).append(counters)
+        self.report_number += 1
+        total = _new_counters()
+        for counters in self.reports.pop(number):
+            for name, value in counters.items():
+                if name == 'latencies':
+                    total[name].extend(value)
+                elif name == 'behind_seconds':
+                    total[name] = max(total[name], value)
+                else:
+                    total[name] += value
+        total['seconds'] /= len(self.workers)
+        return total
+
+    # Prints one report line; returns whether the endpoint kept up: every
+    # event asked for was accepted (within 5%), and no worker fell behind by
+    # a whole send interval
+    def _report(self, elapsed, counters):
+        seconds = counters['seconds'] or 1.0
+        target = counters['target'] / seconds
+        accepted_rate = counters['accepted'] / seconds
+        latencies = sorted(counters['latencies'])
+        kept_up = (counters['failed'] == 0 and (self.rate.value == 0 or accepted_rate >= 0.95 * target) and
+                   counters['behind_seconds'] < self.settings['send_interval_seconds'])
+        print('{0:>7.0f} {1:>12} {2:>12,.0f} {3:>12,.0f} {4:>8} {5:>8} {6:>10.1f} {7:>10.1f} {8:>10.1f}  {9}'.format(
+            elapsed, '{0:,.0f}'.format(target) if self.rate.value else 'max', counters['sent'] / seconds,
+            accepted_rate, counters['messages'], counters['failed'],
+            counters['bytes'] / float(max(1, counters['sent'])),
+            (percentile(latencies, 0.5) or 0) * 1000, (percentile(latencies, 0.99) or 0) * 1000,
+            'ok' if kept_up else 'BEHIND'))
+        return kept_up
+
+    def run(self):
+        settings = self.settings
+        self.send_definitions()
+        self.start_workers()
+        print('--- {0} worker processes, {1} containers; reports every {2} s\n'.format(
+            len(self.workers), len(self.containers), settings['report_seconds']))
+        print('{0:>7} {1:>12} {2:>12} {3:>12} {4:>8} {5:>8} {6:>10} {7:>10} {8:>10}'.format(
+            'seconds', 'target ev/s', 'sent ev/s', 'accepted', 'messages', 'failed', 'bytes/ev', 'p50 ms', 'p99 ms'))
+        start = monotonic()
+        step_start = start
+        step_kept_up = True
+        try:
+            while True:
+                counters = self._collect(settings['report_seconds'] + settings['send_interval_seconds'] + 30)
+                elapsed = monotonic() - start
+                if counters is None:
+                    if not any(worker.is_alive() for worker in self.workers):
+                        print('--- Every worker process has stopped')
+                        break
+                    print('--- Not every worker reported; the workers may be stuck sending')
+                    step_kept_up = False
+                    continue
+                kept_up = self._report(elapsed, counters)
+                # The first report after the rate changes is a warm-up
+                if monotonic() - step_start > settings['report_seconds'] * 1.5:
+                    step_kept_up = step_kept_up and kept_up
+                if settings['ramp_factor'] and monotonic() - step_start >= settings['step_seconds']:
+                    if not step_kept_up:
+                        break
+                    self.max_sustained = self.rate.value * len(self.containers)
+                    self.rate.value *= settings['ramp_factor']
+                    step_start = monotonic()
+                    step_kept_up = True
+                    print('--- Rate raised to {0:,.0f} events per second'.format(self.rate.value * len(self.containers)))
+                if settings['duration_seconds'] and elapsed >= settings['duration_seconds']:
+                    break
+        except KeyboardInterrupt:
+            pass
+        self.stop_workers()
+        if settings['ramp_factor']:
+            if self.max_sustained is None:
+                print('\n--- The endpoint did not keep up with the first rate; try a lower --rate')
+            else:
+                print('\n--- Highest rate kept up with for a whole step: {0:,.0f} events per second'.format(
+                    self.max_sustained))
+
+# ************************************************************************
+# Command line
+# ************************************************************************
+
+def _rate(text):
+    return 0.0 if text == 'max' else float(text)
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic OMF load from the tutorial\'s random values')
+    parser.add_argument('--url', default='http://localhost:8118/ingress/messages')
+    parser.add_argument('--producer-token', default='OMFv1')
+    parser.add_argument('--no-verify-ssl', action='store_true')
+    parser.add_argument('--compression', default=None, choices=['gzip'])
+    parser.add_argument('--assets', type=int, default=10, help='K: assets under the parent asset')
+    parser.add_argument('--containers-per-asset', type=int, default=4, help='M: containers of each asset')
+    parser.add_argument('--prefix', default='LoadGen', help='starts every asset and container id')
+    parser.add_argument('--no-assets', action='store_true', help='send no static types, assets or links (for OCS)')
+    parser.add_argument('--rate', type=_rate, default=1.0, help='events per second per container, or "max"')
+    parser.add_argument('--distribution', default='uniform:0,100',
+                        help='of the number values: uniform:low,high, gauss:mean,sd, walk:start,sd, or sine:mean,amplitude,period')
+    parser.add_argument('--random-enums', action='store_true', help='pick enum values at random instead of toggling')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--send-interval', type=float, default=1.0, help='seconds between the messages of a worker')
+    parser.add_argument('--max-events-per-message', type=int, default=1000)
+    parser.add_argument('--report-seconds', type=float, default=5.0)
+    parser.add_argument('--duration', type=float, default=0, help='seconds to run (0: until CTRL+C)')
+    parser.add_argument('--ramp-factor', type=float, default=0, help='multiply the rate by this every step')
+    parser.add_argument('--step-seconds', type=float, default=30.0)
+    parser.add_argument('--print-definitions', action='store_true', help='print the definition messages and exit')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    if args.print_definitions:
+        for message_type, message in make_definitions(args.assets, args.containers_per_asset, args.prefix,
+                                                      not args.no_assets):
+            print(json.dumps({"messagetype": message_type, "message": message}))
+        return
+    if args.ramp_factor and (args.ramp_factor <= 1 or args.rate == 0):
+        parser.error('--ramp-factor must be above 1, and needs a --rate other than "max"')
+    # Checks the distribution before anything is sent
+    Distribution(args.distribution)
+    generator = LoadGenerator({
+        'url': args.url,
+        'producer_token': args.producer_token,
+        'verify_ssl': not args.no_verify_ssl,
+        'compression': args.compression,
+        'assets': args.assets,
+        'containers_per_asset': args.containers_per_asset,
+        'prefix': args.prefix,
+        'with_assets': not args.no_assets,
+        'rate': args.rate,
+        'distribution': args.distribution,
+        'toggle_enums': not args.random_enums,
+        'workers': args.workers,
+        'send_interval_seconds': args.send_interval,
+        'max_events_per_message': args.max_events_per_message,
+        'report_seconds': args.report_seconds,
+        'duration_seconds': args.duration,
+        'ramp_factor': args.ramp_factor,
+        'step_seconds': args.step_seconds,
+        'seed': args.seed
+    })
+    generator.run()
+
+if __name__ == '__main__':
+    main()
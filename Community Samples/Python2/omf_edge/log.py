@@ -0,0 +1,308 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Leveled, asynchronous logging for the send path, on the standard logging
+# module: printing every outgoing message and every response to a serial
+# console or journald takes longer than sending it, so instead:
+#  - a message below the current level costs a single comparison; its
+#    arguments are never formatted (and, wrapped in lazy(), never computed)
+#  - a message that is logged is formatted at once, on the caller's thread
+#    (so that it shows its arguments as they were when it was logged), and
+#    queued by a QueueHandler; a QueueListener writes it on a background
+#    thread, so sending never waits on the console
+#  - warnings and errors are rate-limited per kind, so an endpoint that is
+#    down does not flood the log with one line per message
+# Every logger is a child of the "omf" logger, which has the queue handler
+# (and does not pass its records on to the root logger)
+# ************************************************************************
+
+# Import packages
+import atexit
+import datetime
+import json
+import logging
+import sys
+import threading
+import time
+
+from omf_edge.compat import QueueHandler, QueueListener, monotonic, queue, string_types
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+LEVELS = dict((name, level) for level, name in LEVEL_NAMES.items())
+
+# Accepts a level number or name (such as "DEBUG")
+def parse_level(level):
+    if isinstance(level, string_types):
+        return LEVELS[level.upper()]
+    return level
+
+# Wraps a function call that is only made if the message is actually
+# written, for example:
+#   log.debug('Outgoing message: {0}', lazy(json.dumps, message_json))
+class lazy(object):
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def __str__(self):
+        return str(self.function(*self.args))
+
+    def __format__(self, format_spec):
+        return format(self.function(*self.args), format_spec)
+
+# The message of a record: a str.format template and its arguments, formatted
+# when the queue handler prepares the record
+class _FormatMessage(object):
+
+    def __init__(self, template, args):
+        self.template = template
+        self.args = args
+
+    def __str__(self):
+        if not self.args:
+            return self.template
+        try:
+            return self.template.format(*self.args)
+        except Exception as ex:
+            return '{0} (could not be formatted: {1})'.format(self.template, ex)
+
+# ************************************************************************
+# Rate limiting of warnings and errors
+# ************************************************************************
+
+# Lets through at most burst messages of each kind (key) per interval_seconds;
+# the next message that is let through reports how many were suppressed
+class RateLimiter(object):
+
+    def __init__(self, burst=5, interval_seconds=60.0):
+        self.burst = burst
+        self.interval_seconds = interval_seconds
+        # Per key: [start of the current interval, messages let through, messages suppressed]
+        self._state = {}
+        self._lock = threading.Lock()
+
+    # Returns None if the message should be suppressed, or else the number
+    # of messages of the same kind suppressed since the last one let through
+    def allow(self, key):
+        now = monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None or now - state[0] >= self.interval_seconds:
+                suppressed = state[2] if state is not None else 0
+                self._state[key] = [now, 1, 0]
+                return suppressed
+            if state[1] < self.burst:
+                state[1] += 1
+                suppressed, state[2] = state[2], 0
+                return suppressed
+            state[2] += 1
+            return None
+
+# A logging filter that rate-limits the warnings and errors of each logger
+# per key (the record's omf_key: the key argument, or else the template)
+class RateLimitFilter(logging.Filter):
+
+    def __init__(self, burst=5, interval_seconds=60.0):
+        logging.Filter.__init__(self)
+        self._limiters = {}
+        self._lock = threading.Lock()
+        self.burst = burst
+        self.interval_seconds = interval_seconds
+
+    def filter(self, record):
+        if record.levelno < WARNING:
+            return True
+        with self._lock:
+            limiter = self._limiters.get(record.name)
+            if limiter is None:
+                limiter = self._limiters[record.name] = RateLimiter(self.burst, self.interval_seconds)
+        suppressed = limiter.allow(getattr(record, 'omf_key', None) or record.msg)
+        if suppressed is None:
+            return False
+        if suppressed:
+            record.omf_fields = dict(getattr(record, 'omf_fields', {}), suppressed=suppressed)
+        return True
+
+# ************************************************************************
+# The writer: the queue handler, and the listener that writes its records
+# ************************************************************************
+
+# Each line is "<time> <LEVEL> <logger>: <message> key=value ...", or, with
+# json_lines=True, one JSON object per line (for journald or a log shipper)
+class LineFormatter(logging.Formatter):
+
+    def __init__(self, json_lines=False):
+        logging.Formatter.__init__(self)
+        self.json_lines = json_lines
+
+    def format(self, record):
+        message = record.getMessage()
+        fields = getattr(record, 'omf_fields', None) or {}
+        level_name = LEVEL_NAMES.get(record.levelno, record.levelname)
+        if self.json_lines:
+            entry = {'time': datetime.datetime.fromtimestamp(record.created).isoformat(), 'level': level_name,
+                     'logger': record.name, 'message': message}
+            entry.update((key, str(value)) for key, value in fields.items())
+            return json.dumps(entry)
+        line = '{0} {1} {2}: {3}'.format(
+            datetime.datetime.fromtimestamp(record.created), level_name, record.name, message)
+        if fields:
+            line += ' ' + ' '.join('{0}={1}'.format(key, value) for key, value in sorted(fields.items()))
+        return line
+
+# If the console falls so far behind that queue_size records are waiting,
+# new records are dropped (and counted) rather than holding up the caller
+class _DroppingQueueHandler(QueueHandler):
+
+    def __init__(self, record_queue):
+        QueueHandler.__init__(self, record_queue)
+        self.records_dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.records_dropped += 1
+
+# Writes to the console, flushing once the queue is empty rather than after every line
+class _ConsoleHandler(logging.StreamHandler):
+
+    def __init__(self, stream, record_queue):
+        logging.StreamHandler.__init__(self, stream)
+        self._record_queue = record_queue
+
+    def flush(self):
+        if self._record_queue.empty():
+            logging.StreamHandler.flush(self)
+
+# The queue handler of the "omf" logger, and the listener thread that
+# formats its records into lines and writes them
+class LogWriter(object):
+
+    def __init__(self, stream=None, queue_size=10000, json_lines=False):
+        self._queue = queue.Queue(queue_size)
+        self.formatter = LineFormatter(json_lines)
+        self.console = _ConsoleHandler(stream or sys.stdout, self._queue)
+        self.console.setFormatter(self.formatter)
+        self.handler = _DroppingQueueHandler(self._queue)
+        self.handler.addFilter(RateLimitFilter())
+        self._listener = QueueListener(self._queue, self.console)
+        self._listener.start()
+        # Write whatever is still queued when the script exits
+        atexit.register(self.flush, 2.0)
+
+    @property
+    def json_lines(self):
+        return self.formatter.json_lines
+
+    @json_lines.setter
+    def json_lines(self, value):
+        self.formatter.json_lines = value
+
+    @property
+    def records_dropped(self):
+        return self.handler.records_dropped
+
+    # Waits until every queued record has been written (or the timeout passes)
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+# ************************************************************************
+# The loggers
+# ************************************************************************
+
+_root_logger = logging.getLogger('omf')
+_root_logger.setLevel(INFO)
+_root_logger.propagate = False
+_default_writer = []
+_writer_lock = threading.Lock()
+_loggers = {}
+
+def set_level(level):
+    _root_logger.setLevel(parse_level(level))
+
+def default_writer():
+    with _writer_lock:
+        if not _default_writer:
+            writer = LogWriter()
+            _root_logger.addHandler(writer.handler)
+            _default_writer.append(writer)
+    return _default_writer[0]
+
+# Wraps a standard logger of the "omf" hierarchy, so that messages are
+# str.format templates (as everywhere else in these scripts), and keyword
+# arguments are fields, added to the line as key=value pairs
+class Logger(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.logger = logging.getLogger(name)
+
+    @property
+    def level(self):
+        return self.logger.getEffectiveLevel()
+
+    def set_level(self, level):
+        self.logger.setLevel(parse_level(level))
+
+    def is_enabled_for(self, level):
+        return self.logger.isEnabledFor(level)
+
+    # message is a str.format template; args are only formatted if the
+    # message is written, and fields are added as key=value pairs.  Warnings
+    # and errors are rate-limited per key, which defaults to the message template
+    def log(self, level, message, args=(), fields=None, key=None):
+        if not self.logger.isEnabledFor(level):
+            return
+        if not _default_writer:
+            default_writer()
+        self.logger.log(level, _FormatMessage(message, args),
+                        extra={'omf_fields': fields or {}, 'omf_key': key or message})
+
+    def debug(self, message, *args, **fields):
+        if self.logger.isEnabledFor(DEBUG):
+            self.log(DEBUG, message, args, fields)
+
+    def info(self, message, *args, **fields):
+        if self.logger.isEnabledFor(INFO):
+            self.log(INFO, message, args, fields)
+
+    def warning(self, message, *args, **fields):
+        self.log(WARNING, message, args, fields, fields.pop('key', None))
+
+    def error(self, message, *args, **fields):
+        self.log(ERROR, message, args, fields, fields.pop('key', None))
+
+# Returns the logger with the given name ("omf" or "omf.<something>"),
+# creating it the first time; loggers without a level of their own follow
+# set_level
+def get_logger(name='omf', level=None):
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers[name] = Logger(name)
+    if level is not None:
+        logger.set_level(level)
+    return logger
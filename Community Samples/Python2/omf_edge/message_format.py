@@ -0,0 +1,156 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Message formats: how an OMF message is turned into the body of a request,
+# and back, named by the "messageformat" header.  JSON is what every OMF
+# endpoint takes, and is the default.  For numeric streams sent to a local
+# aggregation tier that can read it, "msgpack" is a compact alternative:
+# MessagePack values instead of decimal text, and, for the events of a data
+# message, each property name written once per message rather than once
+# per event
+# ************************************************************************
+
+# Import packages
+import json
+
+# ************************************************************************
+# JSON
+# ************************************************************************
+
+# Every format has a name (the "messageformat" header), encode, which
+# returns the body of a message (text or bytes), and decode, which turns a
+# body back into the message.  add_types and add_containers are called with
+# each type and container message before it is sent, so that a format can
+# prepare for the data messages that follow
+class JSONFormat(object):
+
+    name = 'JSON'
+
+    def add_types(self, types_message):
+        pass
+
+    def add_containers(self, containers_message):
+        pass
+
+    def encode(self, message_type, message_json):
+        return json.dumps(message_json)
+
+    def decode(self, body):
+        return json.loads(body.decode('utf-8') if isinstance(body, bytes) else body)
+
+# ************************************************************************
+# MessagePack, with interned property names
+# ************************************************************************
+
+# Type and container messages are packed as they are.  Each entry of a data
+# message becomes a map with:
+#   "c" - the containerid (or "t", the typeid, for assets and links)
+#   "k" - the property names, once
+#   "r" - one array per event, with its values in the order of "k"; a
+#         property that an event leaves out is nil
+# For each container whose type was sent through add_types and
+# add_containers, the property names are taken from the type, and are
+# packed only once, when the container is added; they are then copied into
+# every message as bytes.  Needs the msgpack package (pip install msgpack),
+# which is only imported when this format is used.
+class MessagePackFormat(object):
+
+    name = 'msgpack'
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError('The "msgpack" message format needs the msgpack package: pip install msgpack')
+        self.msgpack = msgpack
+        self.packer = msgpack.Packer(use_bin_type=True)
+        self.property_names = {}
+        # Per container: its property names, as a tuple and as a set, and
+        # their packed "k" key and array
+        self.container_keys = {}
+
+    def add_types(self, types_message):
+        for type_definition in types_message:
+            self.property_names[type_definition['id']] = tuple(type_definition['properties'])
+
+    def add_containers(self, containers_message):
+        pack = self.packer.pack
+        for container in containers_message:
+            names = self.property_names.get(container['typeid'])
+            if names is not None:
+                self.container_keys[container['id']] = (names, frozenset(names), pack('k') + pack(list(names)))
+
+    def _pack_entry(self, entry):
+        pack = self.packer.pack
+        if 'containerid' in entry:
+            head = pack('c') + pack(entry['containerid'])
+            keys = self.container_keys.get(entry['containerid'])
+        else:
+            head = pack('t') + pack(entry['typeid'])
+            keys = None
+        events = entry['values']
+        if keys is None or any(event.keys() != keys[1] for event in events):
+            # Not a known container, or events without all of its properties
+            names = []
+            for event in events:
+                for name in event:
+                    if name not in names:
+                        names.append(name)
+            keys = (names, None, pack('k') + pack(names))
+        names = keys[0]
+        rows = [[event.get(name) for name in names] for event in events]
+        return self.packer.pack_map_header(3) + head + keys[2] + pack('r') + pack(rows)
+
+    def encode(self, message_type, message_json):
+        if message_type.lower() != 'data':
+            return self.packer.pack(message_json)
+        parts = [self.packer.pack_array_header(len(message_json))]
+        parts.extend(self._pack_entry(entry) for entry in message_json)
+        return b''.join(parts)
+
+    def decode(self, body):
+        message = self.msgpack.unpackb(body, raw=False)
+        if not isinstance(message, list):
+            return message
+        decoded = []
+        for entry in message:
+            if isinstance(entry, dict) and 'k' in entry and 'r' in entry:
+                names = entry['k']
+                stream = {'containerid': entry['c']} if 'c' in entry else {'typeid': entry['t']}
+                stream['values'] = [
+                    dict((name, value) for name, value in zip(names, row) if value is not None)
+                    for row in entry['r']
+                ]
+                decoded.append(stream)
+            else:
+                decoded.append(entry)
+        return decoded
+
+# ************************************************************************
+# Choosing a format by name
+# ************************************************************************
+
+MESSAGE_FORMATS = {
+    'json': JSONFormat,
+    'msgpack': MessagePackFormat
+}
+
+# Returns a new format object for a "messageformat" name (None means JSON)
+def make_message_format(name=None):
+    format_class = MESSAGE_FORMATS.get((name or 'JSON').lower())
+    if format_class is None:
+        raise ValueError('Unsupported message format "{0}"; use one of {1}'.format(
+            name, ', '.join(sorted(MESSAGE_FORMATS))))
+    return format_class()
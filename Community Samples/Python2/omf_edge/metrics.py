@@ -0,0 +1,275 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Send path metrics: counters, gauges and histograms for the stages of the
+# send path (sensor reads, encoding, compression, queues, requests, status
+# codes and retries), served in the Prometheus text format on a local HTTP
+# endpoint, so that a dashboard can show which gateway is falling behind.
+# Recording a value only adds to a number in memory; everything else (the
+# text format, and any value that is read from a callback, such as a queue
+# depth) is done only when a scraper asks for /metrics
+# ************************************************************************
+
+# Import packages
+import bisect
+import threading
+
+from omf_edge.compat import BaseHTTPRequestHandler, HTTPServer
+
+# ************************************************************************
+# Helper functions: the Prometheus text format
+# ************************************************************************
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels_text(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# ************************************************************************
+# The instruments
+# ************************************************************************
+
+# Each instrument keeps one value per combination of label values (given as
+# a tuple, in the order of label_names).  The same instrument is updated from
+# several threads (the sampling loop, the retry engine, and each fan-out
+# endpoint's worker), and a read-modify-write such as "+= 1" is not atomic,
+# so every update, and the copy a scrape takes, holds the instrument's lock
+# (an uncontended lock costs well under a microsecond)
+class _Instrument(object):
+
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return ['# HELP {0} {1}'.format(self.name, self.help_text), '# TYPE {0} {1}'.format(self.name, self.kind)]
+
+class Counter(_Instrument):
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        _Instrument.__init__(self, name, help_text, label_names)
+        self.values = {}
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = self.values.copy()
+        return [(self.name + _labels_text(self.label_names, key), value) for key, value in sorted(values.items())]
+
+class Gauge(Counter):
+
+    kind = 'gauge'
+
+    def set(self, value, label_values=()):
+        with self._lock:
+            self.values[label_values] = value
+
+# A counter or gauge whose values are read from a function at scrape time;
+# the function returns a number, or (for labelled values) a dict from a
+# tuple of label values to a number.  This is how values that the code
+# already keeps (queue lengths, the counters of the capture buffers and the
+# retry engine) are exposed, without touching the code that updates them
+class CallbackMetric(_Instrument):
+
+    def __init__(self, name, help_text, function, kind='gauge', label_names=()):
+        _Instrument.__init__(self, name, help_text, label_names)
+        self.function = function
+        self.kind = kind
+
+    def samples(self):
+        value = self.function()
+        if isinstance(value, dict):
+            return [(self.name + _labels_text(self.label_names, key), v) for key, v in sorted(value.items())]
+        return [(self.name, value)]
+
+# Counts observations into fixed buckets (upper bounds, in increasing order)
+class Histogram(_Instrument):
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets, label_names=()):
+        _Instrument.__init__(self, name, help_text, label_names)
+        self.buckets = list(buckets)
+        # Per label values: [counts per bucket (the last for +Inf), sum, count]
+        self.values = {}
+
+    def observe(self, value, label_values=()):
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bucket] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = dict((key, (list(counts), total, count)) for key, (counts, total, count) in self.values.items())
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + [float('inf')], counts):
+                cumulative += bucket_count
+                lines.append((self.name + '_bucket' + _labels_text(self.label_names, key, [('le', _number(bound))]),
+                              cumulative))
+            lines.append((self.name + '_sum' + _labels_text(self.label_names, key), total))
+            lines.append((self.name + '_count' + _labels_text(self.label_names, key), count))
+        return lines
+
+# ************************************************************************
+# The registry, and the metrics of the send path
+# ************************************************************************
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self.instruments = []
+        self._names = set()
+
+    def add(self, instrument):
+        if instrument.name in self._names:
+            raise ValueError('Metric "{0}" was already added'.format(instrument.name))
+        self._names.add(instrument.name)
+        self.instruments.append(instrument)
+        return instrument
+
+    def counter(self, name, help_text, label_names=()):
+        return self.add(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self.add(Gauge(name, help_text, label_names))
+
+    def histogram(self, name, help_text, buckets, label_names=()):
+        return self.add(Histogram(name, help_text, buckets, label_names))
+
+    def callback(self, name, help_text, function, kind='gauge', label_names=()):
+        return self.add(CallbackMetric(name, help_text, function, kind, label_names))
+
+    # Returns every metric in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        for instrument in self.instruments:
+            try:
+                samples = instrument.samples()
+            except Exception as ex:
+                lines.append('# {0} could not be read: {1}'.format(instrument.name, _escape(ex)))
+                continue
+            lines.extend(instrument.header())
+            lines.extend('{0} {1}'.format(name, _number(value)) for name, value in samples)
+        return '\n'.join(lines) + '\n'
+
+# Bucket bounds, in seconds, for the fast stages (sensor reads, encoding)
+# and for requests
+STAGE_SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+REQUEST_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+MESSAGE_BYTES_BUCKETS = (1024, 4096, 16384, 65536, 131072, 196608, 262144)
+COMPRESSION_RATIO_BUCKETS = (1.0, 1.5, 2.0, 3.0, 5.0, 8.0, 12.0, 20.0)
+
+# The instruments of the send path, shared by the runner, the senders and
+# the retry engine; any of them may be given one of these as "metrics"
+class SendPathMetrics(object):
+
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+        add = self.registry
+        self.sensor_read_seconds = add.histogram(
+            'omf_sensor_read_seconds', 'Time to read the sensors of one container', STAGE_SECONDS_BUCKETS, ['container'])
+        self.events_read = add.counter(
+            'omf_events_read_total', 'Events read from the sensors', ['container'])
+        self.encode_seconds = add.histogram(
+            'omf_encode_seconds', 'Time to check and encode one message', STAGE_SECONDS_BUCKETS, ['messagetype'])
+        self.message_bytes = add.histogram(
+            'omf_message_bytes', 'Size of each message before compression', MESSAGE_BYTES_BUCKETS, ['messagetype'])
+        self.compression_ratio = add.histogram(
+            'omf_compression_ratio', 'Size before compression divided by size after', COMPRESSION_RATIO_BUCKETS, ['endpoint'])
+        self.request_seconds = add.histogram(
+            'omf_request_seconds', 'Latency of each OMF request', REQUEST_SECONDS_BUCKETS, ['endpoint', 'messagetype'])
+        self.responses = add.counter(
+            'omf_responses_total', 'Responses by status code (0 if the endpoint could not be reached)', ['endpoint', 'status'])
+        self.retries = add.counter(
+            'omf_retries_total', 'Messages sent again after a failure', ['endpoint'])
+
+    # Adds a gauge read at scrape time, such as a queue depth
+    def add_gauge(self, name, help_text, function, label_names=()):
+        return self.registry.callback(name, help_text, function, 'gauge', label_names)
+
+    def add_counter(self, name, help_text, function, label_names=()):
+        return self.registry.callback(name, help_text, function, 'counter', label_names)
+
+# ************************************************************************
+# The HTTP endpoint
+# ************************************************************************
+
+# Serves GET /metrics on its own thread; nothing is computed until a scraper
+# asks for it.  By default it only listens on this device (127.0.0.1); use
+# host='0.0.0.0' to let a Prometheus server on the network scrape it.
+#
+# Typical use:
+#   send_path_metrics = SendPathMetrics()
+#   metrics_server = MetricsServer(send_path_metrics.registry, port=9108)
+#   metrics_server.start()
+class MetricsServer(object):
+
+    def __init__(self, registry, port=9108, host='127.0.0.1'):
+        self.registry = registry
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+            def do_GET(handler):
+                if handler.path.split('?')[0].rstrip('/') not in ('', '/metrics'):
+                    handler.send_response(404)
+                    handler.end_headers()
+                    return
+                payload = registry.render().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+                handler.send_header('Content-Length', str(len(payload)))
+                handler.end_headers()
+                handler.wfile.write(payload)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = HTTPServer((host, port), MetricsRequestHandler)
+        self.port = self.server.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics endpoint')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,379 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Phidget gateway: rather than opening one hard-coded channel, the Phidget
+# Manager reports every channel of every Phidget attached to this computer
+# (including the devices on VINT hubs); each supported channel gets its own
+# OMF container (and its own AF element, linked under the gateway's element),
+# is opened with a data event handler, and is sent from in shared, batched
+# OMF messages.  Channels can be attached and detached at any time.
+# ************************************************************************
+
+# Import packages
+import collections
+
+# To install the Phidget22 library, see
+# https://www.phidgets.com/docs/Language_-_Python#Getting_Started_with_Python
+from Phidget22.ChannelClass import ChannelClass
+from Phidget22.DeviceClass import DeviceClass
+from Phidget22.Manager import Manager
+from Phidget22.PhidgetException import PhidgetException
+from Phidget22.Devices.Accelerometer import Accelerometer
+from Phidget22.Devices.Gyroscope import Gyroscope
+from Phidget22.Devices.Magnetometer import Magnetometer
+from Phidget22.Devices.TemperatureSensor import TemperatureSensor
+from Phidget22.Devices.HumiditySensor import HumiditySensor
+from Phidget22.Devices.LightSensor import LightSensor
+from Phidget22.Devices.VoltageInput import VoltageInput
+from Phidget22.Devices.VoltageRatioInput import VoltageRatioInput
+
+from omf_edge.capture import CallbackCapture, take_multiplexed_messages
+from omf_edge.compat import monotonic
+from omf_edge.log import get_logger
+
+log = get_logger('omf.phidget_gateway')
+
+# ************************************************************************
+# The kinds of channels that the gateway knows how to read
+# ************************************************************************
+
+# Describes how to open and read one class of Phidget channel: the Phidget22
+# class to open it with, the OMF properties of each value, the name of the
+# method that sets its data event handler (and of the one that sets its change
+# trigger, if it has one), and whether its data events carry a device timestamp
+class ChannelKind(object):
+
+    def __init__(self, name, phidget_class, properties, handler_setter,
+                 trigger_setter=None, timestamped=False, convert=None):
+        self.name = name
+        self.phidget_class = phidget_class
+        # A list of (property name, description) pairs
+        self.properties = properties
+        self.property_names = [property_name for property_name, description in properties]
+        self.handler_setter = handler_setter
+        self.trigger_setter = trigger_setter
+        self.timestamped = timestamped
+        # Converts the single value of an untimestamped data event, if needed
+        self.convert = convert
+
+    # The OMF dynamic type for this kind of channel
+    def type_definition(self, typeid):
+        properties = {
+            "Time": {"format": "date-time", "type": "string", "isindex": True}
+        }
+        for property_name, description in self.properties:
+            properties[property_name] = {"type": "number", "description": description}
+        return {
+            "id": typeid,
+            "type": "object",
+            "classification": "dynamic",
+            "properties": properties
+        }
+
+    # Returns a data event handler that pushes each value into the given capture
+    def make_handler(self, capture):
+        if self.timestamped:
+            def handler(phidget, values, timestamp):
+                capture.push(values, timestamp)
+        elif self.convert is not None:
+            convert = self.convert
+            def handler(phidget, value):
+                capture.push((convert(value),))
+        else:
+            def handler(phidget, value):
+                capture.push((value,))
+        return handler
+
+# Temperatures are sent in Fahrenheit, like in the other Phidgets scripts;
+# to add another kind of channel, add it here
+CHANNEL_KINDS = {
+    ChannelClass.PHIDCHCLASS_ACCELEROMETER: ChannelKind(
+        'accelerometer', Accelerometer,
+        [("X Acceleration", "in Gs"), ("Y Acceleration", "in Gs"), ("Z Acceleration", "in Gs")],
+        'setOnAccelerationChangeHandler', 'setAccelerationChangeTrigger', timestamped=True),
+    ChannelClass.PHIDCHCLASS_GYROSCOPE: ChannelKind(
+        'gyroscope', Gyroscope,
+        [("X Angular Rate", "in degrees per second"), ("Y Angular Rate", "in degrees per second"),
+         ("Z Angular Rate", "in degrees per second")],
+        'setOnAngularRateUpdateHandler', timestamped=True),
+    ChannelClass.PHIDCHCLASS_MAGNETOMETER: ChannelKind(
+        'magnetometer', Magnetometer,
+        [("X Magnetic Field", "in Gauss"), ("Y Magnetic Field", "in Gauss"), ("Z Magnetic Field", "in Gauss")],
+        'setOnMagneticFieldChangeHandler', 'setMagneticFieldChangeTrigger', timestamped=True),
+    ChannelClass.PHIDCHCLASS_TEMPERATURESENSOR: ChannelKind(
+        'temperature', TemperatureSensor,
+        [("Temperature", "in Fahrenheit")],
+        'setOnTemperatureChangeHandler', 'setTemperatureChangeTrigger',
+        convert=lambda celsius: celsius * 9/5 + 32),
+    ChannelClass.PHIDCHCLASS_HUMIDITYSENSOR: ChannelKind(
+        'humidity', HumiditySensor,
+        [("Humidity", "in percent")],
+        'setOnHumidityChangeHandler', 'setHumidityChangeTrigger'),
+    ChannelClass.PHIDCHCLASS_LIGHTSENSOR: ChannelKind(
+        'light', LightSensor,
+        [("Illuminance", "in lux")],
+        'setOnIlluminanceChangeHandler', 'setIlluminanceChangeTrigger'),
+    ChannelClass.PHIDCHCLASS_VOLTAGEINPUT: ChannelKind(
+        'voltage', VoltageInput,
+        [("Voltage", "in volts")],
+        'setOnVoltageChangeHandler', 'setVoltageChangeTrigger'),
+    ChannelClass.PHIDCHCLASS_VOLTAGERATIOINPUT: ChannelKind(
+        'voltage ratio', VoltageRatioInput,
+        [("Voltage Ratio", "in volts per volt")],
+        'setOnVoltageRatioChangeHandler', 'setVoltageRatioChangeTrigger')
+}
+
+# ************************************************************************
+# One channel of the gateway
+# ************************************************************************
+
+# A channel is identified by its device's serial number, its hub port (for
+# devices on a VINT hub) and its channel number; the same channel keeps the
+# same container (and AF element) across detaches and restarts of the script
+class GatewayChannel(object):
+
+    def __init__(self, kind, serial_number, hub_port, is_hub_port_device, channel_number,
+                 device_name, name_prefix, buffer_size):
+        self.kind = kind
+        self.serial_number = serial_number
+        self.hub_port = hub_port
+        self.is_hub_port_device = is_hub_port_device
+        self.channel_number = channel_number
+        self.device_name = device_name
+        if hub_port >= 0:
+            self.label = '{0} {1} port {2} channel {3}'.format(kind.name, serial_number, hub_port, channel_number)
+        else:
+            self.label = '{0} {1} channel {2}'.format(kind.name, serial_number, channel_number)
+        self.element_name = name_prefix + ' ' + self.label
+        self.containerid = self.element_name + '_data_values_container'
+        self.capture = CallbackCapture(kind.property_names, buffer_size)
+        self.phidget = None
+        self.attached = False
+        self.attach_count = 0
+
+    def open(self, data_interval_ms):
+        phidget = self.kind.phidget_class()
+        phidget.setDeviceSerialNumber(self.serial_number)
+        if self.hub_port >= 0:
+            phidget.setHubPort(self.hub_port)
+            phidget.setIsHubPortDevice(self.is_hub_port_device)
+        phidget.setChannel(self.channel_number)
+        getattr(phidget, self.kind.handler_setter)(self.kind.make_handler(self.capture))
+
+        # The data interval and change trigger are lost when a device is
+        # detached, so they are set again every time the channel attaches
+        def attached(phidget_channel):
+            try:
+                if data_interval_ms:
+                    phidget_channel.setDataInterval(data_interval_ms)
+                else:
+                    phidget_channel.setDataInterval(phidget_channel.getMinDataInterval())
+                if self.kind.trigger_setter is not None:
+                    getattr(phidget_channel, self.kind.trigger_setter)(0)
+            except PhidgetException as e:
+                log.error("Phidget Exception {0} when configuring {1}: {2}", e.code, self.label, e.details, key=e.code)
+            self.attached = True
+            self.attach_count += 1
+
+        def detached(phidget_channel):
+            self.attached = False
+
+        phidget.setOnAttachHandler(attached)
+        phidget.setOnDetachHandler(detached)
+        # Opening does not wait for the channel to attach; the Phidget library
+        # keeps looking for it, also after it has been detached
+        phidget.open()
+        self.phidget = phidget
+
+# ************************************************************************
+# The gateway
+# ************************************************************************
+
+# send_omf_message is a function such as DeviceRunner.send_omf_message, which
+# returns True if the endpoint accepted the message.  When
+# assets_typeid is given (it is left out for OSIsoft cloud services, which do not
+# use static types or links), each channel also gets its own AF element of that
+# type, linked under the parent element, and its container is linked to it.
+#
+# The Phidget Manager reports attached channels on the Phidget library's own
+# thread, which must not be held up by web requests; so new channels are only
+# queued there, and are registered and opened by register_new_channels, which
+# the runner calls from its main loop.  A channel is only opened once its type,
+# container, element and links were all accepted (so that no samples are
+# captured for a container that does not exist); until then, its registration
+# is sent again every registration_retry_seconds.  The runner sends the samples
+# of every open channel's capture buffer (see captures()):
+#   runner = DeviceRunner(build_config({...}))
+#   runner.add_gateway(PhidgetGateway(runner.send_omf_message, DEVICE_NAME, ...))
+#   if runner.start():
+#       runner.run()
+class PhidgetGateway(object):
+
+    def __init__(self, send_omf_message, name_prefix, data_interval_ms=0, buffer_size=60000,
+                 assets_typeid=None, parent_element_name=None, location='', kinds=CHANNEL_KINDS,
+                 registration_retry_seconds=10):
+        self.send_omf_message = send_omf_message
+        self.name_prefix = name_prefix
+        self.data_interval_ms = data_interval_ms
+        self.buffer_size = buffer_size
+        self.assets_typeid = assets_typeid
+        self.parent_element_name = parent_element_name or name_prefix
+        self.location = location
+        self.kinds = kinds
+        self.registration_retry_seconds = registration_retry_seconds
+        # (channel class, serial number, hub port, channel number) -> GatewayChannel
+        self.channels = collections.OrderedDict()
+        self._registered_typeids = set()
+        # Filled on the Phidget thread, and emptied on the main thread
+        self._new_channels = collections.deque()
+        # Channels whose registration was not accepted yet: key -> GatewayChannel
+        self._unregistered = collections.OrderedDict()
+        self._next_registration_retry = 0
+        self._unsupported = set()
+        self.manager = None
+
+    def start(self):
+        self.manager = Manager()
+        self.manager.setOnAttachHandler(self._on_manager_attach)
+        self.manager.setOnDetachHandler(self._on_manager_detach)
+        self.manager.open()
+
+    def _typeid(self, kind):
+        return '{0}_{1}_data_values_type'.format(self.name_prefix, kind.name.replace(' ', '_'))
+
+    # Runs on the Phidget thread: note the channel, to be registered later
+    def _on_manager_attach(self, manager, channel):
+        try:
+            channel_class = channel.getChannelClass()
+            # Only devices on a VINT hub (and the hub's own ports) have a hub port
+            on_hub = channel.getIsHubPortDevice() or channel.getDeviceClass() == DeviceClass.PHIDCLASS_VINT
+            hub_port = channel.getHubPort() if on_hub else -1
+            description = (
+                channel_class,
+                channel.getDeviceSerialNumber(),
+                hub_port,
+                channel.getIsHubPortDevice(),
+                channel.getChannel(),
+                channel.getDeviceName()
+            )
+        except PhidgetException as e:
+            log.error("Phidget Exception {0}: {1}", e.code, e.details, key=e.code)
+            return
+        self._new_channels.append(description)
+
+    def _on_manager_detach(self, manager, channel):
+        try:
+            log.info("Phidget detached: {0} (serial number {1}, channel {2})",
+                     channel.getDeviceName(), channel.getDeviceSerialNumber(), channel.getChannel())
+        except PhidgetException as e:
+            log.error("Phidget Exception {0}: {1}", e.code, e.details, key=e.code)
+
+    # Registers (type, container, element and links) and opens every channel
+    # that was attached since the last call, and retries the registration of
+    # the channels that were not accepted before; channels that were already
+    # open need nothing, since the Phidget library attaches them again by itself
+    def register_new_channels(self):
+        if self._unregistered and monotonic() >= self._next_registration_retry:
+            for key, channel in list(self._unregistered.items()):
+                del self._unregistered[key]
+                self._register_and_open(key, channel)
+        while self._new_channels:
+            channel_class, serial_number, hub_port, is_hub_port_device, channel_number, device_name = \
+                self._new_channels.popleft()
+            key = (channel_class, serial_number, hub_port, channel_number)
+            if key in self.channels or key in self._unregistered:
+                continue
+            kind = self.kinds.get(channel_class)
+            if kind is None:
+                if (channel_class, device_name) not in self._unsupported:
+                    self._unsupported.add((channel_class, device_name))
+                    log.info('--- Skipping the unsupported channel class {0} of "{1}"', channel_class, device_name)
+                continue
+            channel = GatewayChannel(kind, serial_number, hub_port, is_hub_port_device, channel_number,
+                                     device_name, self.name_prefix, self.buffer_size)
+            self._register_and_open(key, channel)
+
+    def _register_and_open(self, key, channel):
+        if not self._register(channel):
+            log.warning('--- Could not register "{0}"; retrying in {1} second(s)',
+                        channel.label, self.registration_retry_seconds, key=channel.label)
+            self._unregistered[key] = channel
+            self._next_registration_retry = monotonic() + self.registration_retry_seconds
+            return
+        try:
+            channel.open(self.data_interval_ms)
+        except PhidgetException as e:
+            log.error("Phidget Exception {0} when opening {1}: {2}", e.code, channel.label, e.details, key=e.code)
+            return
+        self.channels[key] = channel
+        log.info('--- Now reading "{0}" into container "{1}"', channel.label, channel.containerid)
+
+    # Sends the channel's type (once per kind), container, element and links;
+    # returns True if the endpoint accepted all of them
+    def _register(self, channel):
+        typeid = self._typeid(channel.kind)
+        if typeid not in self._registered_typeids:
+            if not self.send_omf_message("create", "Type", [channel.kind.type_definition(typeid)]):
+                return False
+            self._registered_typeids.add(typeid)
+        if not self.send_omf_message("create", "Container", [{"id": channel.containerid, "typeid": typeid}]):
+            return False
+        if self.assets_typeid is None:
+            return True
+        return self.send_omf_message("create", "Data", [
+            {
+                "typeid": self.assets_typeid,
+                "values": [
+                    {
+                        "Name": channel.element_name,
+                        "Device Type": channel.device_name,
+                        "Location": self.location,
+                        "Data Ingress Method": "OMF"
+                    }
+                ]
+            },
+            {
+                "typeid": "__Link",
+                "values": [
+                    # Position the channel's element under the gateway's element
+                    {
+                        "Source": {"typeid": self.assets_typeid, "index": self.parent_element_name},
+                        "Target": {"typeid": self.assets_typeid, "index": channel.element_name}
+                    },
+                    # Attach the channel's PI Points to its element
+                    {
+                        "Source": {"typeid": self.assets_typeid, "index": channel.element_name},
+                        "Target": {"containerid": channel.containerid}
+                    }
+                ]
+            }
+        ])
+
+    # A (containerid, capture buffer) pair for every open channel
+    def captures(self):
+        return [(channel.containerid, channel.capture) for channel in list(self.channels.values())]
+
+    # Takes the values of every channel, as shared OMF data message bodies
+    def take_messages(self, max_events_per_message):
+        return take_multiplexed_messages(self.captures(), max_events_per_message)
+
+    def print_counters(self):
+        lines = ['--- Gateway channels (attached, samples/s, captured, dropped, waiting):']
+        for channel in list(self.channels.values()):
+            counters = channel.capture.counters()
+            lines.append('    {0}: {1}, {2:.1f}/s, {3}, {4}, {5}'.format(
+                channel.label, 'attached' if channel.attached else 'DETACHED',
+                counters['rate'], counters['captured'], counters['dropped'], counters['waiting']))
+        log.info('\n'.join(lines))
@@ -0,0 +1,187 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+
+# ************************************************************************
+# Pre-compression for batched data messages: once events are batched, each
+# event of a "values" array repeats every property name and a full ISO
+# timestamp, which gzip can only find again if the same text comes around
+# often and close together.  MessagePreCompressor gets a data message ready
+# for compression:
+#  - the entries of a message that go to the same container are merged into
+#    one entry, and the entries of containers of the same type are moved next
+#    to each other, so the same properties repeat close together
+#  - the properties of every event are already written in one consistent
+#    order, that of their type, by the compiled encoder (omf_edge.schema)
+# It also builds a preset dictionary from the types and containers that were
+# sent: sample text of an event of each container, as the compiled encoder
+# writes it, so that even the first event of a small message compresses well.
+# A message compressed with the dictionary ("deflate" compression) can only be
+# read by a receiver that builds the same dictionary from the same types and
+# containers, such as the ingress emulator; PI and OCS only take gzip
+# ************************************************************************
+
+# Import packages
+import json
+import struct
+import zlib
+
+# zlib only uses the last 32 KB of a preset dictionary
+MAX_DICTIONARY_BYTES = 32768
+
+# What the dictionary uses for the values of each kind of property
+SAMPLE_TIMESTAMP = '2020-01-01T00:00:00.000000Z'
+SAMPLE_VALUES = {'number': 0.5, 'integer': 0, 'boolean': False, 'string': ''}
+
+# ************************************************************************
+# Helper functions: the preset dictionary
+# ************************************************************************
+
+def _sample_value(definition):
+    if 'enum' in definition:
+        return definition['enum'][0]
+    if definition.get('format') == 'date-time':
+        return SAMPLE_TIMESTAMP
+    property_type = definition.get('type')
+    if isinstance(property_type, list):
+        property_type = [t for t in property_type if t != 'null'][0]
+    return SAMPLE_VALUES.get(property_type, '')
+
+# The text of one event of a type, with its properties in the type's order
+def _sample_event(type_definition):
+    return '{' + ','.join(
+        json.dumps(name) + ':' + json.dumps(_sample_value(definition))
+        for name, definition in type_definition['properties'].items()) + '}'
+
+# Builds the preset dictionary for a set of types (their definitions, by id)
+# and containers (the typeid of each container, by id): one sample entry for
+# each static type (assets) and for each container, with a sample link
+# before them.  Both ends must pass the same types and containers (the ones
+# the receiver has accepted) to get the same dictionary; they are taken in
+# order of their ids, so the order in which they were accepted does not
+# matter.  The entries used most (the containers) are last, since zlib
+# finds the end of the dictionary with the shortest distances
+def build_dictionary(type_definitions, containers):
+    parts = ['{"typeid":"__Link","values":[{"source":{"typeid":"","index":"_ROOT"},'
+             '"target":{"typeid":"","index":""}},{"source":{"typeid":"","index":""},'
+             '"target":{"containerid":""}}]}']
+    for typeid, type_definition in sorted(type_definitions.items()):
+        if type_definition.get('classification') == 'static':
+            parts.append('{"typeid":' + json.dumps(typeid) + ',"values":[' + _sample_event(type_definition) + ']}')
+    for containerid, typeid in sorted(containers.items()):
+        type_definition = type_definitions.get(typeid)
+        if type_definition is not None:
+            parts.append('{"containerid":' + json.dumps(containerid) + ',"values":[' +
+                         _sample_event(type_definition) + ']}')
+    return ('[' + ','.join(parts) + ']').encode('utf-8')[-MAX_DICTIONARY_BYTES:]
+
+# The id zlib writes in the header of a stream compressed with a preset
+# dictionary
+def dictionary_id(dictionary):
+    return zlib.adler32(dictionary) & 0xffffffff
+
+# Returns the dictionary id in the header of a zlib stream, or None if it was
+# compressed without a preset dictionary
+def stream_dictionary_id(payload):
+    if len(payload) < 6 or not bytearray(payload[1:2])[0] & 0x20:
+        return None
+    return struct.unpack('>I', payload[2:6])[0]
+
+# Compresses a message body in the zlib format, with a preset dictionary if
+# one is given (level 9, as gzip.compress)
+def deflate(body, dictionary=None, level=9):
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 8, zlib.Z_DEFAULT_STRATEGY, dictionary)
+    else:
+        compressor = zlib.compressobj(level)
+    return compressor.compress(body) + compressor.flush()
+
+# Decompresses a body compressed by deflate; dictionaries holds the known
+# preset dictionaries, by dictionary id.  Raises ValueError (zlib.error is
+# one) if the body needs a dictionary that is not known
+def inflate(payload, dictionaries=None):
+    wanted = stream_dictionary_id(payload)
+    if wanted is None:
+        return zlib.decompress(payload)
+    dictionary = (dictionaries or {}).get(wanted)
+    if dictionary is None:
+        raise ValueError('Unknown preset dictionary {0:08x}'.format(wanted))
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS, dictionary)
+    return decompressor.decompress(payload) + decompressor.flush()
+
+# ************************************************************************
+# The pre-compression stage
+# ************************************************************************
+
+# Is told about every type and container message before it is sent (like a
+# message format), and gets each data message ready before it is encoded.
+# For the preset dictionary, it is told only about the type and container
+# messages that the endpoint has accepted (the runner keeps a separate one).
+#
+# Typical use:
+#   precompressor = MessagePreCompressor()
+#   precompressor.add_types(types_message)
+#   precompressor.add_containers(containers_message)
+#   body = registry.encode_data_message(precompressor.group(data_message))
+#   # after the endpoint accepted types_message and containers_message:
+#   sender.dictionary = precompressor.dictionary()
+class MessagePreCompressor(object):
+
+    def __init__(self):
+        self.type_definitions = {}
+        self.containers = {}
+        self._dictionary = None
+
+    def add_types(self, types_message):
+        for type_definition in types_message:
+            self.type_definitions[type_definition['id']] = type_definition
+        self._dictionary = None
+
+    def add_containers(self, containers_message):
+        for container in containers_message:
+            self.containers[container['id']] = container['typeid']
+        self._dictionary = None
+
+    def dictionary(self):
+        if self._dictionary is None:
+            self._dictionary = build_dictionary(self.type_definitions, self.containers)
+        return self._dictionary
+
+    # Returns the message with one entry per container, and the containers
+    # of each type next to each other (in the order their types first
+    # appear); the events of each container keep their order.  Entries that
+    # are not for a container (assets and links) are left where they are,
+    # since a link must come after the assets it refers to
+    def group(self, data_message):
+        merged = {}
+        slots = []
+        for entry in data_message:
+            containerid = entry.get('containerid')
+            if containerid is None:
+                slots.append(entry)
+            elif containerid in merged:
+                merged[containerid]['values'].extend(entry['values'])
+            else:
+                merged[containerid] = {'containerid': containerid, 'values': list(entry['values'])}
+                slots.append(None)
+        grouped = list(merged.values())
+        containers = self.containers
+        type_order = {}
+        for entry in grouped:
+            type_order.setdefault(containers.get(entry['containerid']), len(type_order))
+        grouped.sort(key=lambda entry: type_order[containers.get(entry['containerid'])])
+        grouped = iter(grouped)
+        return [next(grouped) if entry is None else entry for entry in slots]
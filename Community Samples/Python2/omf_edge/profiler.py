@@ -0,0 +1,242 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Loop profiler: when a gateway falls behind, shows where the time of its
+# main loop goes.  LoopProfiler times each phase of every cycle (reading the
+# sensors, building messages, encoding, compressing, sending, and sleeping),
+# keeps the latest durations of each phase for rolling percentiles, and
+# prints a breakdown every so often.  StackSampler goes one level deeper:
+# it samples the stack of the main loop's thread at a fixed interval, and
+# reports the functions where the samples landed (and can write them out
+# for a flame graph).  Both are off unless the runner is asked for them
+# ************************************************************************
+
+# Import packages
+import collections
+import os
+import sys
+import threading
+
+from omf_edge.compat import monotonic, perf_counter
+from omf_edge.log import get_logger
+
+log = get_logger('omf.profiler')
+
+# ************************************************************************
+# Phase timings
+# ************************************************************************
+
+# The phases, in the order in which a report lists them; phases recorded
+# under any other name are listed after these
+PHASES = ('sample', 'build', 'encode', 'compress', 'send', 'sleep')
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+# Times one phase:
+#   with profiler.phase('sample'):
+#       runner.sample()
+class _Phase(object):
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, perf_counter() - self.start)
+        return False
+
+# Keeps the last window durations of each phase (for percentiles), and the
+# total time and count of each phase since the last report (for the share of
+# the loop's time each one took).  Phases may be recorded from any thread
+# (the sender's worker threads, or the retry engine), so the time of all the
+# phases together can add up to more than the time that went by.
+#
+# Typical use:
+#   profiler = LoopProfiler()
+#   with profiler.phase('encode'):
+#       message_body = json.dumps(message_json)
+#   profiler.maybe_print_report()
+class LoopProfiler(object):
+
+    def __init__(self, window=1000, report_interval_seconds=60.0):
+        self.window = window
+        self.report_interval_seconds = report_interval_seconds
+        self.durations = {}
+        self.totals = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._report_start = monotonic()
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def record(self, name, seconds):
+        with self._lock:
+            durations = self.durations.get(name)
+            if durations is None:
+                durations = self.durations[name] = collections.deque(maxlen=self.window)
+            durations.append(seconds)
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def _phase_names(self):
+        return [name for name in PHASES if name in self.durations] + sorted(
+            name for name in self.durations if name not in PHASES)
+
+    # Returns, for each phase: how many times it ran and its total seconds
+    # since the last report, its share of the time that went by, and the
+    # p50/p90/p99/max of its last window durations, in seconds
+    def breakdown(self):
+        with self._lock:
+            elapsed = monotonic() - self._report_start
+            snapshot = [(name, sorted(self.durations[name]), self.totals.get(name, 0.0), self.counts.get(name, 0))
+                        for name in self._phase_names()]
+        phases = []
+        for name, durations, total, count in snapshot:
+            phases.append({
+                'phase': name,
+                'count': count,
+                'total_seconds': total,
+                'share': total / elapsed if elapsed > 0 else 0.0,
+                'p50_seconds': percentile(durations, 0.50),
+                'p90_seconds': percentile(durations, 0.90),
+                'p99_seconds': percentile(durations, 0.99),
+                'max_seconds': durations[-1] if durations else None
+            })
+        return {'elapsed_seconds': elapsed, 'phases': phases}
+
+    # Starts a new reporting period (the rolling windows are kept)
+    def reset_totals(self):
+        with self._lock:
+            self.totals = {}
+            self.counts = {}
+            self._report_start = monotonic()
+
+    def print_report(self):
+        breakdown = self.breakdown()
+        lines = [
+            '--- Loop profile for the last {0:.0f} s (percentiles of the last {1} of each phase):'.format(
+                breakdown['elapsed_seconds'], self.window),
+            '    {0:<10} {1:>7} {2:>10} {3:>7} {4:>10} {5:>10} {6:>10} {7:>10}'.format(
+                'phase', 'count', 'total s', 'share', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')
+        ]
+        for phase in breakdown['phases']:
+            lines.append('    {0:<10} {1:>7} {2:>10.3f} {3:>6.1f}% {4:>10.3f} {5:>10.3f} {6:>10.3f} {7:>10.3f}'.format(
+                phase['phase'], phase['count'], phase['total_seconds'], phase['share'] * 100,
+                phase['p50_seconds'] * 1000, phase['p90_seconds'] * 1000, phase['p99_seconds'] * 1000,
+                phase['max_seconds'] * 1000))
+        log.info('\n'.join(lines))
+
+    # Prints a report, and starts a new period, once report_interval_seconds have gone by
+    def maybe_print_report(self):
+        if monotonic() - self._report_start >= self.report_interval_seconds:
+            self.print_report()
+            self.reset_totals()
+            return True
+        return False
+
+# ************************************************************************
+# Statistical stack sampling (CPython only)
+# ************************************************************************
+
+# Every interval_seconds, a background thread looks at the current stack of
+# one thread (by default, the one that started the sampler) and counts it.
+# The loop itself runs unchanged, so the overhead is the sampler thread's
+# own work (a few microseconds per sample, which also briefly holds the GIL).
+# A function's "self" samples are the samples where it was running; its
+# "total" samples also count the samples where it was waiting on a function
+# it called.
+#
+# Typical use:
+#   sampler = StackSampler(interval_seconds=0.005)
+#   sampler.start()
+#   ...
+#   sampler.print_report()
+#   sampler.write_collapsed('loop.stacks')    # for flamegraph.pl or speedscope
+class StackSampler(object):
+
+    def __init__(self, interval_seconds=0.005, thread_id=None, max_depth=64):
+        if not hasattr(sys, '_current_frames'):
+            raise RuntimeError('Stack sampling needs CPython (sys._current_frames)')
+        self.interval_seconds = interval_seconds
+        self.thread_id = thread_id
+        self.max_depth = max_depth
+        # Sample counts per stack, each a tuple of "file:function" from the outermost call in
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.current_thread().ident
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stack sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append('{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    # Returns [(function, self samples, total samples)], by self samples
+    def top_functions(self, count=15):
+        self_samples = collections.Counter()
+        total_samples = collections.Counter()
+        for stack, samples in list(self.stacks.items()):
+            self_samples[stack[-1]] += samples
+            for function in set(stack):
+                total_samples[function] += samples
+        return [(function, samples, total_samples[function])
+                for function, samples in self_samples.most_common(count)]
+
+    def print_report(self, count=15):
+        lines = ['--- Stack samples: {0}, every {1:.1f} ms'.format(self.samples, self.interval_seconds * 1000)]
+        if self.samples:
+            lines.append('    {0:>7} {1:>7}  {2}'.format('self', 'total', 'function'))
+            for function, self_samples, total_samples in self.top_functions(count):
+                lines.append('    {0:>6.1f}% {1:>6.1f}%  {2}'.format(
+                    100.0 * self_samples / self.samples, 100.0 * total_samples / self.samples, function))
+        log.info('\n'.join(lines))
+
+    # Writes the samples in the "collapsed stacks" format (one line per
+    # stack: the functions separated by ";", then the count)
+    def write_collapsed(self, path):
+        with open(path, 'w') as collapsed_file:
+            for stack, samples in sorted(self.stacks.items()):
+                collapsed_file.write(';'.join(stack) + ' ' + str(samples) + '\n')
@@ -0,0 +1,277 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Compact reading records: rather than keeping a list -> dict -> list -> dict
+# OMF message tree (with long string keys such as "X Acceleration") for every
+# buffered reading, readings are stored as small __slots__ objects, or packed
+# into a flat array of doubles, and are only turned into OMF JSON at send time
+# ************************************************************************
+
+# Import packages
+import array
+import datetime
+import keyword
+import numbers
+import re
+
+# ************************************************************************
+# Helper functions: convert between epoch seconds and OMF timestamps
+# ************************************************************************
+
+# Timestamps are kept as float seconds since the Unix epoch (UTC), for
+# example from time.time(), rather than as ~30-character ISO strings.
+# They are converted by adding them to a naive UTC epoch, since
+# datetime.utcfromtimestamp is deprecated on Python 3, and Python 2 has no
+# datetime.timezone for datetime.fromtimestamp(seconds, timezone.utc)
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def iso_timestamp(seconds):
+    return (_EPOCH + datetime.timedelta(seconds=seconds)).isoformat() + 'Z'
+
+def parse_iso_timestamp(timestamp):
+    timestamp = timestamp.rstrip('Z')
+    timestamp_format = '%Y-%m-%dT%H:%M:%S.%f' if '.' in timestamp else '%Y-%m-%dT%H:%M:%S'
+    return (datetime.datetime.strptime(timestamp, timestamp_format) - _EPOCH).total_seconds()
+
+# Turns OMF property names into unique Python attribute names,
+# for example "Z-magnetic field" becomes "Z_magnetic_field"
+def _attribute_names(property_names):
+    attribute_names = []
+    for name in property_names:
+        attribute = re.sub(r'\W', '_', name)
+        if not attribute or attribute[0].isdigit() or keyword.iskeyword(attribute) or attribute == 'timestamp':
+            attribute = '_' + attribute
+        while attribute in attribute_names:
+            attribute += '_'
+        attribute_names.append(attribute)
+    return attribute_names
+
+# ************************************************************************
+# Base class shared by all generated reading classes
+# ************************************************************************
+
+class Reading(object):
+    __slots__ = ()
+
+    # Filled in by make_reading_class for each generated class
+    TYPE_ID = None
+    INDEX_PROPERTY = None
+    PROPERTY_NAMES = ()
+    ATTRIBUTE_NAMES = ()
+
+    # Values are given in PROPERTY_NAMES order, or by attribute name;
+    # any value that is not given is left unset and is not sent
+    def __init__(self, timestamp, *values, **named_values):
+        if len(values) > len(self.ATTRIBUTE_NAMES):
+            raise TypeError('{0} takes at most {1} values ({2} given)'.format(
+                type(self).__name__, len(self.ATTRIBUTE_NAMES), len(values)))
+        self.timestamp = timestamp
+        for attribute, value in zip(self.ATTRIBUTE_NAMES, values):
+            setattr(self, attribute, value)
+        for attribute, value in named_values.items():
+            setattr(self, attribute, value)
+
+    # Builds a reading from one event of an existing OMF "values" array
+    @classmethod
+    def from_omf_values(cls, event):
+        reading = cls(parse_iso_timestamp(event[cls.INDEX_PROPERTY]))
+        for name, attribute in zip(cls.PROPERTY_NAMES, cls.ATTRIBUTE_NAMES):
+            if name in event:
+                setattr(reading, attribute, event[name])
+        return reading
+
+    # Returns the OMF event for this reading, with the original property names
+    def to_omf_values(self):
+        event = {self.INDEX_PROPERTY: iso_timestamp(self.timestamp)}
+        for name, attribute in zip(self.PROPERTY_NAMES, self.ATTRIBUTE_NAMES):
+            value = getattr(self, attribute, None)
+            if value is not None:
+                event[name] = value
+        return event
+
+    def __repr__(self):
+        fields = ['timestamp=' + repr(self.timestamp)]
+        for attribute in self.ATTRIBUTE_NAMES:
+            fields.append(attribute + '=' + repr(getattr(self, attribute, None)))
+        return type(self).__name__ + '(' + ', '.join(fields) + ')'
+
+# ************************************************************************
+# Generate a reading class from an OMF dynamic type definition
+# ************************************************************************
+
+# For example, for the BeagleBone Blue script:
+#   BBBlueReading = make_reading_class(DYNAMIC_TYPES_MESSAGE_JSON[0])
+#   reading = BBBlueReading(time.time(), ax, ay, az, ...)
+#   reading.Board_Temperature   # the value of "Board Temperature"
+def make_reading_class(type_definition, class_name=None):
+    properties = type_definition['properties']
+    index_properties = [name for name, definition in properties.items() if definition.get('isindex')]
+    if len(index_properties) != 1:
+        raise ValueError('Type "{0}" must have exactly one "isindex" property'.format(type_definition['id']))
+    property_names = [name for name in properties if name != index_properties[0]]
+    attribute_names = _attribute_names(property_names)
+    if class_name is None:
+        class_name = re.sub(r'\W', '', type_definition['id'].title()) + 'Reading'
+        if not class_name[0].isalpha():
+            class_name = 'Reading' + class_name
+    return type(class_name, (Reading,), {
+        '__slots__': ('timestamp',) + tuple(attribute_names),
+        'TYPE_ID': type_definition['id'],
+        'INDEX_PROPERTY': index_properties[0],
+        'PROPERTY_NAMES': tuple(property_names),
+        'ATTRIBUTE_NAMES': tuple(attribute_names)
+    })
+
+# Assembles the OMF data message for a list of buffered readings; this is the
+# only point at which the per-event dicts are created
+def readings_to_omf_message(containerid, readings):
+    return [
+        {
+            "containerid": containerid,
+            "values": [reading.to_omf_values() for reading in readings]
+        }
+    ]
+
+# ************************************************************************
+# Even more compact: pack readings of an all-number type into one flat array
+# ************************************************************************
+
+# Each reading takes (1 + number of properties) * 8 bytes, with no per-reading
+# Python objects at all; readings come back out as reading class instances
+class PackedReadings(object):
+
+    def __init__(self, reading_class):
+        self.reading_class = reading_class
+        self.stride = 1 + len(reading_class.ATTRIBUTE_NAMES)
+        self.data = array.array('d')
+
+    def __len__(self):
+        return len(self.data) // self.stride
+
+    # Values are given in PROPERTY_NAMES order and must all be numbers
+    def append(self, timestamp, *values):
+        if len(values) != self.stride - 1:
+            raise ValueError('Expected {0} values, got {1}'.format(self.stride - 1, len(values)))
+        self.data.append(timestamp)
+        self.data.extend(values)
+
+    def append_reading(self, reading):
+        self.append(reading.timestamp, *[getattr(reading, a) for a in self.reading_class.ATTRIBUTE_NAMES])
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('reading index out of range')
+        start = index * self.stride
+        return self.reading_class(*self.data[start:start + self.stride])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    # Removes the oldest count readings (or all of them) and returns them
+    def take(self, count=None):
+        if count is None or count > len(self):
+            count = len(self)
+        readings = [self[index] for index in range(count)]
+        del self.data[:count * self.stride]
+        return readings
+
+    def clear(self):
+        del self.data[:]
+
+    def to_omf_message(self, containerid):
+        return readings_to_omf_message(containerid, self)
+
+# ************************************************************************
+# The readings of one container waiting to be sent, as the runner keeps them
+# ************************************************************************
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+# Readings of a type whose properties are all numbers (the usual sensor type)
+# are packed into a PackedReadings array; a reading that cannot be packed (a
+# value that is missing, None or not a number, or a property that is not in
+# the type) is kept as its OMF event instead, together with every reading
+# after it until the buffer has been emptied, so that their order is kept and
+# nothing is lost or changed.  Events are only built when they are taken out.
+#
+# Typical use:
+#   buffer = ReadingBuffer(DYNAMIC_TYPES_MESSAGE_JSON[0])
+#   buffer.append(time.time(), {"X Acceleration": 0.02, ...})
+#   ... when sending:
+#   message = [{"containerid": DATA_VALUES_CONTAINER_ID, "values": buffer.take(1000)}]
+class ReadingBuffer(object):
+
+    def __init__(self, type_definition):
+        self.reading_class = make_reading_class(type_definition)
+        properties = type_definition['properties']
+        self.packable = all(properties[name].get('type') == 'number' for name in self.reading_class.PROPERTY_NAMES)
+        self.packed = PackedReadings(self.reading_class) if self.packable else None
+        self.events = []
+
+    def __len__(self):
+        return len(self.events) + (len(self.packed) if self.packed is not None else 0)
+
+    # Keeps the packed readings as events from now on
+    def _unpack(self):
+        self.events.extend(reading.to_omf_values() for reading in self.packed.take())
+        self.packed = None
+
+    # Packs one reading, if it can be; returns False if it cannot
+    def _pack(self, timestamp, values):
+        row = [values.get(name) for name in self.reading_class.PROPERTY_NAMES]
+        if len(values) != len(row) or not all(_is_number(value) for value in row):
+            return False
+        self.packed.append(timestamp, *row)
+        return True
+
+    # Adds one reading; timestamp is in seconds since the epoch, and values
+    # maps property names to values
+    def append(self, timestamp, values):
+        if self.packed is not None:
+            if self._pack(timestamp, values):
+                return
+            self._unpack()
+        event = {self.reading_class.INDEX_PROPERTY: iso_timestamp(timestamp)}
+        event.update(values)
+        self.events.append(event)
+
+    # Adds the events of an OMF "values" array
+    def extend_events(self, events):
+        index_property = self.reading_class.INDEX_PROPERTY
+        for event in events:
+            if self.packed is not None:
+                values = dict(event)
+                try:
+                    timestamp = parse_iso_timestamp(values.pop(index_property))
+                except (KeyError, ValueError):
+                    timestamp = None
+                if timestamp is not None and self._pack(timestamp, values):
+                    continue
+                self._unpack()
+            self.events.append(event)
+
+    # Removes the oldest count readings and returns them as OMF events
+    def take(self, count):
+        taken = self.events[:count]
+        del self.events[:count]
+        if self.packed is not None and len(taken) < count:
+            taken.extend(reading.to_omf_values() for reading in self.packed.take(count - len(taken)))
+        if self.packed is None and self.packable and not self.events:
+            self.packed = PackedReadings(self.reading_class)
+        return taken
@@ -0,0 +1,330 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Retry engine: sends OMF messages on its own thread, and decides what to
+# do with each response by its class: transient errors (the endpoint could
+# not be reached, or was busy) are retried after a capped, exponentially
+# growing delay with random jitter; a batch that was too large (413) is
+# split in half and both halves are sent again; and messages that can never
+# succeed (such as a 400 for a value that does not match its type) are
+# written to a dead-letter file.  Sampling never waits on any of this
+# ************************************************************************
+
+# Import packages
+import collections
+import datetime
+import heapq
+import itertools
+import json
+import random
+import threading
+
+from omf_edge.compat import monotonic, string_types
+from omf_edge.log import get_logger
+from omf_edge.schema import OMFValidationError
+
+log = get_logger('omf.retry')
+
+# ************************************************************************
+# Helper function: the class of a response
+# ************************************************************************
+
+SUCCESS = 'success'
+TRANSIENT = 'transient'
+TOO_LARGE = 'too large'
+PERMANENT = 'permanent'
+
+# Status codes that mean that the same message may be accepted later
+TRANSIENT_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+# status_code is None if the endpoint could not be reached at all
+def classify_response(status_code):
+    if status_code is None or status_code in TRANSIENT_STATUS_CODES:
+        return TRANSIENT
+    if status_code < 300:
+        return SUCCESS
+    if status_code == 413:
+        return TOO_LARGE
+    return PERMANENT
+
+# Splits the entries of an OMF data message into two messages with about
+# half of the events each; returns None if the message holds a single event.
+# A message that is already JSON text is read back first
+def split_data_message(data_message):
+    if isinstance(data_message, string_types):
+        data_message = json.loads(data_message)
+    if len(data_message) > 1:
+        middle = len(data_message) // 2
+        return data_message[:middle], data_message[middle:]
+    entry = data_message[0]
+    values = entry['values']
+    if len(values) < 2:
+        return None
+    middle = len(values) // 2
+    first, second = dict(entry), dict(entry)
+    first['values'], second['values'] = values[:middle], values[middle:]
+    return [first], [second]
+
+def _event_count(data_message):
+    return sum(len(entry.get('values', ())) for entry in data_message)
+
+# ************************************************************************
+# The retry engine
+# ************************************************************************
+
+# One message waiting to be sent, or sent again
+class _Delivery(object):
+
+    def __init__(self, action, message_type, message_json, events=None):
+        self.action = action
+        self.message_type = message_type
+        self.message_json = message_json
+        self.events = events
+        self.attempts = 0
+
+# sender is an OMFSender; encode(message_type, message_json) returns the JSON
+# text of a message (data messages are kept as objects until they are sent,
+# so that they can be split, unless they were submitted as JSON text).  A delivery gets at most max_attempts attempts;
+# after attempt n fails, it waits a random time between 0 and
+# min(max_delay_seconds, base_delay_seconds * 2 ** n) ("full jitter", so that
+# many devices retrying against one relay do not all retry at once).  A data
+# message that runs out of attempts is spooled by the sender, if it has a
+# spool file, so that it is sent once the endpoint is back; otherwise, and
+# for permanent errors, it goes to the dead-letter file, one JSON object per
+# line.  A type or container message that is waiting to be retried holds back
+# every other message (new ones and retries alike) until it is sent.  At most
+# max_queued new data messages wait to be sent; after that, new data messages
+# are dropped (and counted) rather than filling memory while the endpoint is
+# down.  Type and container messages are always queued.  observe, if given,
+# is called after every attempt with (message_type, events, message_bytes,
+# latency_seconds, status_code), for example by the adaptive batch
+# controller; acknowledged, if given, is called with (message_type,
+# message_json) for every message that the endpoint accepted.
+#
+# Typical use:
+#   retry_engine = RetryEngine(sender, encode_message, dead_letter_path='omf_dead_letters.jsonl')
+#   retry_engine.start()
+#   retry_engine.submit("create", "Data", data_message_json)
+class RetryEngine(object):
+
+    def __init__(self, sender, encode, max_attempts=6, base_delay_seconds=0.5, max_delay_seconds=60.0,
+                 dead_letter_path=None, observe=None, max_queued=10000, acknowledged=None):
+        self.sender = sender
+        self.encode = encode
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.dead_letter_path = dead_letter_path
+        self.observe = observe
+        self.max_queued = max_queued
+        self.acknowledged = acknowledged
+        # New messages, in the order they were submitted
+        self._fresh = collections.deque()
+        # Messages waiting to be retried: a heap of (due time, sequence number, delivery)
+        self._waiting = []
+        self._sequence = itertools.count()
+        # A type or container message that failed holds back every other
+        # message (which may use that type or container) until it is sent; it
+        # is kept here, with the time it is due, rather than in _waiting
+        self._blocking = None
+        self._blocking_due = None
+        self._wake = threading.Condition()
+        self._stop = False
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread = None
+        # One counter per outcome
+        self.counters = dict((outcome, 0) for outcome in (
+            'sent', 'retried', 'split', 'spooled', 'dead lettered', 'encode errors', 'dropped'))
+        self.responses = dict((response_class, 0) for response_class in (SUCCESS, TRANSIENT, TOO_LARGE, PERMANENT))
+
+    def start(self):
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='omf retry engine')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._wake:
+            self._stop = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # Queues one message and returns at once; returns False if it was
+    # dropped because too many data messages are waiting already.  events is
+    # the number of events in a data message (counted from message_json if
+    # it is not given)
+    def submit(self, action, message_type, message_json, events=None):
+        with self._wake:
+            if message_type.lower() == 'data' and len(self._fresh) >= self.max_queued:
+                self.counters['dropped'] += 1
+                dropped = True
+            else:
+                self._fresh.append(_Delivery(action, message_type, message_json, events))
+                self._idle.clear()
+                self._wake.notify()
+                dropped = False
+        if dropped:
+            log.warning('{0} data messages are waiting to be sent; dropping new ones', self.max_queued,
+                        key='retry queue full')
+        return not dropped
+
+    # Blocks until no message is waiting to be sent or retried; returns False
+    # on timeout
+    def join(self, timeout=None):
+        return self._idle.wait(timeout)
+
+    def pending(self):
+        with self._wake:
+            return len(self._fresh) + len(self._waiting) + (1 if self._blocking else 0)
+
+    def _delay(self, attempts):
+        return random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2 ** attempts))
+
+    # Returns the next delivery that is due, waiting for one if needed
+    def _next_delivery(self):
+        with self._wake:
+            while not self._stop:
+                now = monotonic()
+                if self._blocking is not None:
+                    # Only the blocking message itself is sent (it stays
+                    # blocking until _done is called for it)
+                    if self._blocking_due is not None and self._blocking_due <= now:
+                        self._blocking_due = None
+                        return self._blocking
+                    timeout = self._blocking_due - now if self._blocking_due is not None else None
+                else:
+                    if self._waiting and self._waiting[0][0] <= now:
+                        return heapq.heappop(self._waiting)[2]
+                    if self._fresh:
+                        return self._fresh.popleft()
+                    if not self._waiting:
+                        self._idle.set()
+                    timeout = self._waiting[0][0] - now if self._waiting else None
+                self._wake.wait(timeout)
+            return None
+
+    def _retry_later(self, delivery):
+        due = monotonic() + self._delay(delivery.attempts)
+        with self._wake:
+            if delivery.message_type.lower() != 'data':
+                self._blocking = delivery
+                self._blocking_due = due
+            else:
+                heapq.heappush(self._waiting, (due, next(self._sequence), delivery))
+
+    def _done(self, delivery):
+        if delivery is self._blocking:
+            with self._wake:
+                self._blocking = None
+                self._blocking_due = None
+
+    # status_code is that of the last attempt (None if the message was never
+    # sent, or the endpoint could not be reached)
+    def _dead_letter(self, delivery, reason, status_code=None, body=None):
+        self.counters['dead lettered'] += 1
+        log.error('Giving up on a message of type "{0}": {1}', delivery.message_type, reason)
+        if self.dead_letter_path is None:
+            return
+        if body is None:
+            body = delivery.message_json
+            if not isinstance(body, string_types):
+                body = json.dumps(body)
+        with open(self.dead_letter_path, 'a') as dead_letter_file:
+            dead_letter_file.write(json.dumps({
+                'time': str(datetime.datetime.now()),
+                'messagetype': delivery.message_type,
+                'action': delivery.action,
+                'status': status_code,
+                'reason': reason,
+                'body': body
+            }) + '\n')
+
+    def _attempt(self, delivery):
+        is_data = delivery.message_type.lower() == 'data'
+        try:
+            body = self.encode(delivery.message_type, delivery.message_json)
+        except OMFValidationError as ex:
+            log.error('Values that do not match their type were not sent: {0}', ex, key='validation')
+            self.counters['encode errors'] += 1
+            self._dead_letter(delivery, 'values do not match their type: ' + str(ex))
+            self._done(delivery)
+            return
+        except Exception as ex:
+            self.counters['encode errors'] += 1
+            self._dead_letter(delivery, 'could not be encoded: ' + str(ex))
+            self._done(delivery)
+            return
+        delivery.attempts += 1
+        self.sender.send(delivery.message_type, body, delivery.action, spool=False)
+        status_code = self.sender.last_status_code
+        if self.observe is not None:
+            events = 0
+            if is_data:
+                events = delivery.events
+                if events is None:
+                    events = _event_count(delivery.message_json)
+            self.observe(delivery.message_type, events, self.sender.last_message_bytes,
+                         self.sender.last_latency_seconds, status_code)
+        response_class = classify_response(status_code)
+        self.responses[response_class] += 1
+        if response_class == SUCCESS:
+            self.counters['sent'] += 1
+            if self.acknowledged is not None:
+                self.acknowledged(delivery.message_type, delivery.message_json)
+            self._done(delivery)
+            if is_data:
+                # The endpoint can be reached again, so send anything that was spooled
+                self.sender.replay_spool()
+        elif response_class == TOO_LARGE and is_data and split_data_message(delivery.message_json):
+            self.counters['split'] += 1
+            self._done(delivery)
+            halves = split_data_message(delivery.message_json)
+            with self._wake:
+                # Both halves go first, in order, ahead of newer messages
+                for half in reversed(halves):
+                    self._fresh.appendleft(_Delivery(delivery.action, delivery.message_type, half))
+        elif response_class == TRANSIENT and delivery.attempts < self.max_attempts:
+            self.counters['retried'] += 1
+            if self.sender.metrics is not None:
+                self.sender.metrics.retries.inc((self.sender.name or self.sender.url,))
+            self._retry_later(delivery)
+        elif response_class == TRANSIENT and is_data and self.sender.spool_path is not None:
+            self.counters['spooled'] += 1
+            self.sender.spool(delivery.message_type, body, delivery.action)
+            self._done(delivery)
+        else:
+            self._dead_letter(delivery, '{0} after {1} attempt(s) (status {2})'.format(
+                response_class, delivery.attempts, status_code), status_code, body)
+            self._done(delivery)
+
+    def _run(self):
+        while True:
+            delivery = self._next_delivery()
+            if delivery is None:
+                break
+            try:
+                self._attempt(delivery)
+            except Exception as ex:
+                log.error('Error in the retry engine: {0}', ex)
+                self._done(delivery)
+
+    def print_counters(self):
+        log.info('--- Retry engine: ' + ', '.join(
+            '{0} {1}'.format(count, outcome) for outcome, count in self.counters.items()) +
+            '; responses: ' + ', '.join(
+            '{0} {1}'.format(count, response_class) for response_class, count in self.responses.items()) +
+            '; {0} waiting'.format(self.pending()))
@@ -0,0 +1,866 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Configuration-driven device runner: does everything that the device
+# scripts have in common (defining types and containers, creating the
+# asset and its links, syncing the clock, and sampling, batching and
+# sending data values), for the devices and sensors that a JSON
+# configuration file describes; the sensors themselves are the sources
+# in omf_edge.sources
+# ************************************************************************
+
+# Import packages
+import copy
+import json
+import platform
+import time
+
+from omf_edge.aggregation import WindowAggregator
+from omf_edge.batching import AdaptiveBatchController
+from omf_edge.compat import monotonic, perf_counter, string_types
+from omf_edge.deadband import AbsoluteDeadband, ExceptionFilter, PercentDeadband, SwingingDoor
+from omf_edge.fanout import FanOutSender, make_fan_out_sender
+from omf_edge.log import default_writer, get_logger, set_level
+from omf_edge.message_format import make_message_format
+from omf_edge.metrics import MetricsServer, SendPathMetrics
+from omf_edge.precompress import MessagePreCompressor
+from omf_edge.profiler import LoopProfiler, StackSampler
+from omf_edge.records import ReadingBuffer
+from omf_edge.retry import RetryEngine
+from omf_edge.schema import OMFValidationError, SchemaRegistry
+from omf_edge.sender import OMFSender
+from omf_edge.sources import PollingSource, make_source
+from omf_edge.clock import now as clock_now, start_clock
+from omf_edge.startup import StartupOrchestrator
+from omf_edge.trace import open_trace_recorder
+
+log = get_logger('omf.runner')
+
+# ************************************************************************
+# The configuration file
+# ************************************************************************
+
+# Every setting that a configuration file may leave out, and its default;
+# the defaults match the constants of the device scripts.  To send to several
+# endpoints at once, a configuration file gives an "endpoints" list instead
+# of "endpoint"; each entry takes the same settings, plus an optional "name",
+# "spool_file", "queue_size", "retries" and "retry_seconds".
+#
+# Each entry of "containers" gives its "id", its "typeid", and its "source":
+# a source type and its options (see omf_edge.sources) or, from a device
+# script, a SensorSource object.  Optionally, "report_by_exception" only sends
+# the values that changed (its settings, and their defaults, are in the
+# "report_by_exception" section below; see omf_edge.deadband), and
+# "aggregate_window_seconds" sends the statistics of each window instead of
+# every value (see omf_edge.aggregation)
+DEFAULT_CONFIG = {
+    "endpoint": {
+        "url": "https://localhost:5460/ingress/messages",
+        "producer_token": "OMFv1",
+        "verify_ssl": False,
+        "timeout_seconds": 30,
+        # None, "gzip", or "deflate" (with a preset dictionary built from the
+        # types and containers, for a receiver that supports it; see
+        # omf_edge.precompress)
+        "compression": None,
+        "omf_cloud": False,
+        "print_messages": False,
+        # "JSON", or "msgpack" for a local aggregation tier that reads it
+        # (see omf_edge.message_format)
+        "message_format": "JSON"
+    },
+    "device": {
+        "name": platform.node(),
+        "location": "",
+        "assets_type": "{device}_assets_type",
+        # The "Device Type" attribute of the asset; None describes the platform
+        "device_type": None,
+        # Seconds to wait before the sensors are initialized, for sensors that
+        # need to warm up
+        "sensor_warm_up_seconds": 0,
+        # With "sync_clock", timestamps are the monotonic clock plus an offset
+        # measured against ntp_server (or the system clock, if it is None)
+        # at startup and every clock_resync_seconds
+        "sync_clock": False,
+        "ntp_server": "pool.ntp.org",
+        "clock_resync_seconds": 600
+    },
+    "send": {
+        "sample_interval_seconds": 2,
+        "send_interval_seconds": 2,
+        "max_events_per_message": 1000,
+        "spool_file": None,
+        "loops_between_counter_reports": 300,
+        # Seconds to wait before sending a type, container or asset message
+        # again, when it was not accepted at startup; data values are only
+        # sent once the types and containers are in place
+        "definition_retry_seconds": 10,
+        # With adaptive batching, max_events_per_message and send_interval_seconds
+        # are only the starting point; the batch controller then adjusts them
+        # to keep each request within target_latency_seconds
+        "adaptive_batching": False,
+        "target_latency_seconds": 1.0,
+        # With the retry engine, messages are sent on their own thread, and
+        # retried, split or dead-lettered according to the response; once
+        # retry_queue_size data messages are waiting, new ones are dropped
+        "retry_engine": False,
+        "max_attempts": 6,
+        "retry_base_delay_seconds": 0.5,
+        "retry_max_delay_seconds": 60,
+        "dead_letter_file": None,
+        "retry_queue_size": 10000,
+        # With "precompress", the events of several containers go into each
+        # data message (up to max_events_per_message), grouped by container
+        # and type, so that compression finds the repeated text close together
+        "precompress": False,
+        # Set "trace_file" to record every message sent, for omf_edge.trace
+        "trace_file": None
+    },
+    # Set "port" to serve the send path metrics at http://<host>:<port>/metrics
+    "metrics": {
+        "port": None,
+        "host": "127.0.0.1"
+    },
+    # "DEBUG" prints every outgoing message and response; with "json_lines",
+    # each line printed is a JSON object (for journald or a log shipper)
+    "log": {
+        "level": "INFO",
+        "json_lines": False
+    },
+    # With "enabled", the time of each phase of the loop (sample, build,
+    # encode, compress, send, sleep) is printed every report_interval_seconds;
+    # with "stack_sampler", so are the functions where the loop spends its
+    # time, and, if "collapsed_stacks_file" is set, the samples are written
+    # there for a flame graph
+    "profile": {
+        "enabled": False,
+        "report_interval_seconds": 60,
+        "window": 1000,
+        "stack_sampler": False,
+        "stack_interval_seconds": 0.005,
+        "collapsed_stacks_file": None
+    },
+    # The defaults of each container's "report_by_exception" settings: a
+    # heartbeat every max_interval_seconds (None for none), and, by property
+    # name, "absolute" deadbands, "percent" deadbands (of the property's
+    # "span", the range of its sensor, if given; otherwise of the last value
+    # sent), and "swinging_door" compression deviations
+    "report_by_exception": {
+        "max_interval_seconds": None,
+        "absolute": {},
+        "percent": {},
+        "span": {},
+        "swinging_door": {}
+    },
+    "types": [],
+    "containers": []
+}
+
+# Replaces "{device}" in every string of a configuration value with the device name
+def _expand(value, device_name):
+    if isinstance(value, string_types):
+        return value.replace("{device}", device_name)
+    if isinstance(value, list):
+        return [_expand(item, device_name) for item in value]
+    if isinstance(value, dict):
+        return dict((_expand(key, device_name), _expand(item, device_name)) for key, item in value.items())
+    return value
+
+# Reads a configuration file, fills in the defaults of the settings that it
+# leaves out, and expands "{device}" in type and container ids
+def load_config(path):
+    with open(path) as config_file:
+        loaded = json.load(config_file)
+    if not loaded.get("types") or not loaded.get("containers"):
+        raise ValueError('The configuration file "{0}" defines no types or no containers'.format(path))
+    return build_config(loaded)
+
+# The same, for the settings of a device script (in the sections of a
+# configuration file)
+def build_config(settings):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    for section, value in settings.items():
+        if isinstance(value, dict) and isinstance(config.get(section), dict):
+            config[section].update(value)
+        else:
+            config[section] = value
+    if "endpoints" in config:
+        config["endpoints"] = [
+            dict(DEFAULT_CONFIG["endpoint"], **endpoint) for endpoint in config["endpoints"]
+        ]
+    return _expand(config, config["device"]["name"])
+
+# The report-by-exception filter of a container's "report_by_exception"
+# settings; the settings it leaves out are taken from defaults
+def make_exception_filter(settings, defaults=DEFAULT_CONFIG["report_by_exception"]):
+    settings = dict(defaults, **settings)
+    max_interval = settings["max_interval_seconds"]
+    filters = {}
+    for name, deadband in settings["absolute"].items():
+        filters[name] = AbsoluteDeadband(deadband, max_interval=max_interval)
+    for name, percent in settings["percent"].items():
+        filters[name] = PercentDeadband(percent, span=settings["span"].get(name), max_interval=max_interval)
+    for name, deviation in settings["swinging_door"].items():
+        filters[name] = SwingingDoor(deviation, max_interval=max_interval)
+    return ExceptionFilter(filters)
+
+# The next deadline of a schedule that runs every interval seconds; when the
+# loop has fallen behind (a cycle took longer than an interval), the deadlines
+# that were missed are skipped, so that it never runs twice in a row to catch up
+def _next_deadline(deadline, interval, now):
+    if interval <= 0:
+        return now
+    deadline += interval
+    if deadline <= now:
+        deadline += (int((now - deadline) / interval) + 1) * interval
+    return deadline
+
+# ************************************************************************
+# The runner
+# ************************************************************************
+
+# Typical use:
+#   runner = DeviceRunner(load_config('configs/random.json'))
+#   if runner.start():
+#       runner.run()
+class DeviceRunner(object):
+
+    def __init__(self, config, sender=None):
+        self.config = config
+        endpoint = config["endpoint"]
+        set_level(config["log"]["level"])
+        default_writer().json_lines = config["log"]["json_lines"]
+        # Metrics are only recorded when they are served
+        self.metrics = None
+        self.metrics_server = None
+        if config["metrics"]["port"] is not None:
+            self.metrics = SendPathMetrics()
+        if sender is not None:
+            self.sender = sender
+        elif config.get("endpoints"):
+            self.sender = make_fan_out_sender(config["endpoints"], self.metrics)
+        else:
+            self.sender = OMFSender(
+                endpoint["url"],
+                endpoint["producer_token"],
+                verify_ssl=endpoint["verify_ssl"],
+                timeout_seconds=endpoint["timeout_seconds"],
+                compression=endpoint["compression"],
+                spool_path=config["send"]["spool_file"],
+                print_messages=endpoint["print_messages"],
+                metrics=self.metrics,
+                message_format=make_message_format(endpoint["message_format"])
+            )
+        self.fan_out = isinstance(self.sender, FanOutSender)
+        # The loop profiler, if profiling is enabled; the senders record the
+        # time spent compressing and sending in it
+        self.profiler = None
+        self.stack_sampler = None
+        if config["profile"]["enabled"]:
+            self.profiler = LoopProfiler(config["profile"]["window"], config["profile"]["report_interval_seconds"])
+            self.sender.profiler = self.profiler
+            if self.fan_out:
+                for fan_out_endpoint in self.sender.endpoints:
+                    fan_out_endpoint.sender.profiler = self.profiler
+        # Static types, assets and links are only sent if there is an endpoint
+        # that is not OSIsoft Cloud Services
+        if self.fan_out:
+            self.send_assets = any(not e.omf_cloud for e in self.sender.endpoints)
+        else:
+            self.send_assets = not endpoint["omf_cloud"]
+        self.schema_registry = SchemaRegistry()
+        self.trace_recorder = open_trace_recorder(config["send"]["trace_file"])
+        self.precompress = config["send"]["precompress"]
+        self.precompressor = None
+        if self.precompress:
+            self.precompressor = MessagePreCompressor()
+        # For "deflate" compression, the preset dictionary is built only from
+        # the types and containers that the endpoint has accepted, since the
+        # endpoint builds its own from the ones it has stored
+        self.dictionary_builder = None
+        if getattr(self.sender, "compression", None) == "deflate":
+            self.dictionary_builder = MessagePreCompressor()
+        elif self.fan_out and endpoint["compression"] == "deflate":
+            log.info('The "endpoint" section\'s "deflate" compression and its preset dictionary are not used '
+                     'when sending to several endpoints')
+        # One (container id, source) pair per container, in configuration order
+        self.sources = [
+            (container["id"], make_source(container["source"])) for container in config["containers"]
+        ]
+        # Gateways that find their own channels (see add_gateway)
+        self.gateways = []
+        # The window aggregator or report-by-exception filter of each container
+        # that has one, and the containers that data messages are sent to
+        self.aggregators = {}
+        self.exception_filters = {}
+        self.data_containerids = []
+        # Readings waiting to be sent, per container; they are only turned
+        # into OMF events when they are sent
+        self.pending = {}
+        for container in config["containers"]:
+            if container.get("aggregate_window_seconds"):
+                aggregator = WindowAggregator(
+                    container["id"],
+                    self._number_properties(container["typeid"]),
+                    container["aggregate_window_seconds"]
+                )
+                self.aggregators[container["id"]] = aggregator
+                self.data_containerids.extend(aggregator.containerids)
+                for containerid in aggregator.containerids:
+                    self.pending[containerid] = ReadingBuffer(aggregator.types_message()[0])
+                continue
+            if container.get("report_by_exception"):
+                self.exception_filters[container["id"]] = make_exception_filter(
+                    container["report_by_exception"], config["report_by_exception"])
+            self.data_containerids.append(container["id"])
+            self.pending[container["id"]] = ReadingBuffer(self._type_definition(container["typeid"]))
+        self.startup = StartupOrchestrator()
+        # Adaptive batching needs the latency of each request, so it is only
+        # used with a single endpoint (with several, each endpoint has its own
+        # queue, and the requests are timed on its worker thread)
+        self.batch_controller = None
+        send_config = config["send"]
+        if send_config["adaptive_batching"]:
+            if self.fan_out:
+                log.info('Adaptive batching is not used when sending to several endpoints')
+            else:
+                self.batch_controller = AdaptiveBatchController(
+                    target_latency_seconds=send_config["target_latency_seconds"],
+                    initial_batch_size=send_config["max_events_per_message"],
+                    initial_flush_seconds=send_config["send_interval_seconds"]
+                )
+        # The fan-out sender already retries and spools per endpoint, so the
+        # retry engine is used with a single endpoint
+        self.retry_engine = None
+        if send_config["retry_engine"]:
+            if self.fan_out:
+                log.info('The retry engine is not used when sending to several endpoints')
+            else:
+                self.retry_engine = RetryEngine(
+                    self.sender,
+                    self.encode_message,
+                    max_attempts=send_config["max_attempts"],
+                    base_delay_seconds=send_config["retry_base_delay_seconds"],
+                    max_delay_seconds=send_config["retry_max_delay_seconds"],
+                    dead_letter_path=send_config["dead_letter_file"],
+                    observe=self._observe,
+                    max_queued=send_config["retry_queue_size"],
+                    acknowledged=self._acknowledged
+                )
+
+    # Adds a gateway, such as omf_edge.phidget_gateway.PhidgetGateway, that
+    # finds its own channels while the runner runs, and registers their types,
+    # containers and assets with send_omf_message.  The runner starts it with
+    # the sensors, calls its register_new_channels() every sample, and sends
+    # the samples of its captures() together with those of the sources
+    def add_gateway(self, gateway):
+        self.gateways.append(gateway)
+
+    # Works like send_omf_message_to_endpoint in the device scripts: types and
+    # containers are recorded, and data values are checked against their type
+    # as they are encoded.  Returns True if the endpoint accepted the message
+    # (or, when sending to several endpoints, if they all queued it); with
+    # omf_cloud=False, the message is not sent to OSIsoft Cloud Services.
+    # events is the number of events in a data message, for adaptive batching
+    def send_omf_message(self, action, message_type, message_json, omf_cloud=True, events=0):
+        if self.trace_recorder is not None:
+            self.trace_recorder.write(action, message_type, message_json)
+        if self.retry_engine is not None:
+            # Encoded and sent on the retry engine's thread, in order
+            return self.retry_engine.submit(action, message_type, message_json, events)
+        try:
+            message_body = self.encode_message(message_type, message_json)
+        except OMFValidationError as ex:
+            log.error('Values that do not match their type were not sent: {0}', ex, key='validation')
+            return False
+        except Exception as ex:
+            log.error('Error when encoding a message: {0}', ex)
+            return False
+        if self.fan_out:
+            sent = self.sender.send(message_type, message_body, action, omf_cloud)
+        else:
+            sent = self.sender.send(message_type, message_body, action)
+            # Observed before the spool is replayed, since that sends again
+            # (and so changes the sender's last_* values)
+            self._observe(message_type, events, self.sender.last_message_bytes,
+                          self.sender.last_latency_seconds, self.sender.last_status_code)
+            if sent:
+                self._acknowledged(message_type, message_json)
+        if sent and message_type.lower() == "data":
+            # The endpoint can be reached again, so send anything that was spooled
+            self.sender.replay_spool()
+        return sent
+
+    # Returns the JSON text of a message, recording types and containers; a
+    # data message that is already JSON text (the samples of a capture
+    # buffer, see flush) is returned as it is
+    def encode_message(self, message_type, message_json):
+        if self.metrics is None and self.profiler is None:
+            return self._encode_message(message_type, message_json)
+        encode_start = perf_counter()
+        message_body = self._encode_message(message_type, message_json)
+        encode_seconds = perf_counter() - encode_start
+        if self.metrics is not None:
+            self.metrics.encode_seconds.observe(encode_seconds, (message_type.lower(),))
+        if self.profiler is not None:
+            self.profiler.record('encode', encode_seconds)
+        return message_body
+
+    # With a message format other than JSON, data values are not checked
+    # here: the format encodes them, and the endpoint checks them
+    def _encode_message(self, message_type, message_json):
+        if isinstance(message_json, string_types):
+            return message_json
+        message_format = getattr(self.sender, "message_format", None)
+        precompressor = self.precompressor
+        if message_type.lower() == "type":
+            self.schema_registry.add_types(message_json)
+            if message_format is not None:
+                message_format.add_types(message_json)
+            if precompressor is not None:
+                precompressor.add_types(message_json)
+        elif message_type.lower() == "container":
+            self.schema_registry.add_containers(message_json)
+            if message_format is not None:
+                message_format.add_containers(message_json)
+            if precompressor is not None:
+                precompressor.add_containers(message_json)
+        elif self.precompress and message_type.lower() == "data":
+            message_json = precompressor.group(message_json)
+        if message_format is not None and message_format.name != "JSON":
+            return message_format.encode(message_type, message_json)
+        if message_type.lower() == "data":
+            return self.schema_registry.encode_data_message(message_json)
+        return json.dumps(message_json)
+
+    # Called by the retry engine after every attempt
+    def _observe(self, message_type, events, message_bytes, latency_seconds, status_code):
+        if self.batch_controller is not None and message_type.lower() == "data" and events:
+            self.batch_controller.observe(events, message_bytes, latency_seconds, status_code)
+
+    # Called (also by the retry engine) for every message that the endpoint
+    # accepted: with "deflate" compression, the data messages that follow are
+    # compressed with a dictionary that includes its types or containers
+    def _acknowledged(self, message_type, message_json):
+        if self.dictionary_builder is None:
+            return
+        if message_type.lower() == "type":
+            self.dictionary_builder.add_types(message_json)
+        elif message_type.lower() == "container":
+            self.dictionary_builder.add_containers(message_json)
+        else:
+            return
+        self.sender.dictionary = self.dictionary_builder.dictionary()
+
+    # One of the configuration's types
+    def _type_definition(self, typeid):
+        for omf_type in self.config["types"]:
+            if omf_type["id"] == typeid:
+                return omf_type
+        raise ValueError('The container type "{0}" is not one of the configuration\'s types'.format(typeid))
+
+    # The capture buffer of a source whose samples are sent as they were
+    # captured, column-encoded; None for a source that has none, or whose
+    # events are needed (by its container's window or report-by-exception
+    # filter, or to encode them in a message format other than JSON)
+    def _capture_buffer(self, containerid, source):
+        if containerid in self.aggregators or containerid in self.exception_filters:
+            return None
+        message_format = getattr(self.sender, "message_format", None)
+        if message_format is not None and message_format.name != "JSON":
+            return None
+        return source.capture_buffer()
+
+    # The names of the number properties of one of the configuration's types
+    def _number_properties(self, typeid):
+        return [
+            name for name, omf_property in self._type_definition(typeid)["properties"].items()
+            if omf_property.get("type") in ("number", "integer") and not omf_property.get("isindex")
+        ]
+
+    # ************************************************************************
+    # The messages that set up the device, built from the configuration
+    # ************************************************************************
+
+    def dynamic_types_message(self):
+        message = list(self.config["types"])
+        for aggregator in self.aggregators.values():
+            message.extend(aggregator.types_message())
+        return message
+
+    def static_types_message(self):
+        return [
+            {
+                "id": self.config["device"]["assets_type"],
+                "type": "object",
+                "classification": "static",
+                "properties": {
+                    "Name": {
+                        "type": "string",
+                        "isindex": True
+                    },
+                    "Device Type": {
+                        "type": "string"
+                    },
+                    "Location": {
+                        "type": "string"
+                    },
+                    "Data Ingress Method": {
+                        "type": "string"
+                    }
+                }
+            }
+        ]
+
+    def containers_message(self):
+        message = [
+            {"id": container["id"], "typeid": container["typeid"]} for container in self.config["containers"]
+        ]
+        for aggregator in self.aggregators.values():
+            message.extend(aggregator.containers_message())
+        return message
+
+    # The asset for the device, a link that puts it under the root element,
+    # and a link from the asset to each container
+    def assets_and_links_message(self):
+        assets_type = self.config["device"]["assets_type"]
+        element_name = self.config["device"]["name"]
+        device_type = self.config["device"]["device_type"]
+        if not device_type:
+            device_type = platform.machine() + " - " + platform.platform() + " - " + platform.processor()
+        links = [
+            {
+                "Source": {"typeid": assets_type, "index": "_ROOT"},
+                "Target": {"typeid": assets_type, "index": element_name}
+            }
+        ]
+        for containerid, source in self.sources:
+            links.append({
+                "Source": {"typeid": assets_type, "index": element_name},
+                "Target": {"containerid": containerid}
+            })
+        for aggregator in self.aggregators.values():
+            links.extend(aggregator.link_values(assets_type, element_name))
+        return [
+            {
+                "typeid": assets_type,
+                "values": [
+                    {
+                        "Name": element_name,
+                        "Device Type": device_type,
+                        "Location": self.config["device"]["location"],
+                        "Data Ingress Method": "OMF"
+                    }
+                ]
+            },
+            {
+                "typeid": "__Link",
+                "values": links
+            }
+        ]
+
+    def _initialize_sources(self):
+        log.info("\n--- Sensors initializing...")
+        warm_up_seconds = self.config["device"]["sensor_warm_up_seconds"]
+        if warm_up_seconds:
+            log.info("--- Waiting {0} seconds for sensors to warm up...", warm_up_seconds)
+            time.sleep(warm_up_seconds)
+        for containerid, source in self.sources:
+            source.initialize()
+        for gateway in self.gateways:
+            gateway.start()
+        log.info("--- Sensors initialized!")
+
+    # Starts every startup phase, and waits for the ones that the first data
+    # message needs; returns False if any of them failed (then run() should
+    # not be called)
+    def start(self):
+        startup = self.startup
+        log.info(
+            '\n--- Setup: targeting endpoint "' + self.sender.url + '"...' +
+            '\n--- Now sending types, defining containers, and creating assets and links...' +
+            '\n--- (Note: a successful message will return a 20X response code.)\n'
+        )
+        retry_seconds = self.config["send"]["definition_retry_seconds"]
+        waiting_for = ['sensors']
+        # A configuration with only gateways has no types or containers of its
+        # own (the gateways send those of their channels)
+        types_phase = []
+        containers_phase = []
+        if self.dynamic_types_message():
+            startup.add_phase('dynamic types',
+                lambda: self.send_omf_message("create", "Type", self.dynamic_types_message()),
+                retry_seconds=retry_seconds)
+            types_phase.append('dynamic types')
+        if self.containers_message():
+            startup.add_phase('containers',
+                lambda: self.send_omf_message("create", "Container", self.containers_message()),
+                after=types_phase, retry_seconds=retry_seconds)
+            containers_phase.append('containers')
+            waiting_for.append('containers')
+        # !!! Note: if sending data to OCS, static types and assets are not included!
+        if self.send_assets:
+            startup.add_phase('static types',
+                lambda: self.send_omf_message("create", "Type", self.static_types_message(), omf_cloud=False),
+                retry_seconds=retry_seconds)
+            startup.add_phase('assets and links',
+                lambda: self.send_omf_message("create", "Data", self.assets_and_links_message(), omf_cloud=False),
+                after=['static types'] + containers_phase, retry_seconds=retry_seconds)
+            if self.gateways:
+                # The elements of the gateways' channels are linked under the device's element
+                waiting_for.append('assets and links')
+        sensors_after = []
+        if self.config["device"]["sync_clock"]:
+            device_config = self.config["device"]
+            startup.add_phase('clock',
+                lambda: start_clock(device_config["ntp_server"], device_config["clock_resync_seconds"]))
+            waiting_for.append('clock')
+            # Capturing sources stamp their samples as they are taken, so
+            # they are only started once the clock offset has been measured
+            sensors_after.append('clock')
+        startup.add_phase('sensors', self._initialize_sources, after=sensors_after)
+        if self.metrics is not None:
+            self._start_metrics_server()
+        if self.fan_out:
+            self.sender.start()
+        if self.retry_engine is not None:
+            self.retry_engine.start()
+        startup.start()
+        return startup.wait_for(*waiting_for)
+
+    # Adds the gauges that are read at scrape time (queue depths, and the
+    # batch controller's decisions), and starts serving /metrics
+    def _start_metrics_server(self):
+        metrics = self.metrics
+        metrics.add_gauge('omf_pending_events', 'Events read but not yet sent, per container',
+            lambda: dict(((containerid,), len(readings)) for containerid, readings in self.pending.items()),
+            ['container'])
+        if self.retry_engine is not None:
+            metrics.add_gauge('omf_retry_engine_pending_messages', 'Messages waiting to be sent or retried',
+                self.retry_engine.pending)
+            metrics.add_counter('omf_retry_engine_outcomes_total', 'Messages by outcome',
+                lambda: dict(((outcome,), count) for outcome, count in self.retry_engine.counters.items()),
+                ['outcome'])
+        if self.fan_out:
+            metrics.add_gauge('omf_endpoint_queue_messages', 'Messages queued for each endpoint',
+                lambda: dict(((e.sender.name,), e.queue.qsize()) for e in self.sender.endpoints),
+                ['endpoint'])
+        if self.batch_controller is not None:
+            controller = self.batch_controller
+            metrics.add_gauge('omf_batch_size_events', 'Events per message chosen by the batch controller',
+                lambda: controller.batch_size)
+            metrics.add_gauge('omf_flush_interval_seconds', 'Seconds between flushes chosen by the batch controller',
+                lambda: controller.flush_interval_seconds)
+        metrics_config = self.config["metrics"]
+        self.metrics_server = MetricsServer(metrics.registry, metrics_config["port"], metrics_config["host"])
+        self.metrics_server.start()
+        log.info('--- Serving metrics at http://{0}:{1}/metrics', metrics_config["host"], self.metrics_server.port)
+
+    # ************************************************************************
+    # Sampling and sending
+    # ************************************************************************
+
+    def sample(self):
+        for gateway in self.gateways:
+            try:
+                gateway.register_new_channels()
+            except Exception as ex:
+                log.error('Error when registering new channels: {0}', ex, key='gateway')
+        for containerid, source in self.sources:
+            try:
+                if self.metrics is None:
+                    self._read(containerid, source)
+                    continue
+                read_start = perf_counter()
+                events = self._read(containerid, source)
+                self.metrics.sensor_read_seconds.observe(perf_counter() - read_start, (containerid,))
+                self.metrics.events_read.inc((containerid,), events)
+            except Exception as ex:
+                log.error('Error when reading sensors: {0}', ex, key=containerid)
+
+    # Reads a source, and returns the number of events read.  The values of a
+    # polling source go straight into its container's buffer, with no event
+    # built, unless its window or report-by-exception filter needs the event;
+    # the samples of a capture buffer are left in it until they are sent, or
+    # go straight into the container's window
+    def _read(self, containerid, source):
+        if self._capture_buffer(containerid, source) is not None:
+            return 0
+        aggregator = self.aggregators.get(containerid)
+        if (isinstance(source, PollingSource) and aggregator is None
+                and containerid not in self.exception_filters):
+            values = source.read_values()
+            if values is None:
+                return 0
+            self.pending[containerid].append(clock_now(), values)
+            return 1
+        capture = source.capture_buffer()
+        if aggregator is not None and capture is not None:
+            timestamps_us, values = capture.take_block()
+            for timestamp_us, row in zip(timestamps_us.tolist(), values.tolist()):
+                sample = dict(zip(capture.property_names, row))
+                aggregator.add(timestamp_us / 1000000.0, [sample.get(name) for name in aggregator.property_names])
+            return len(timestamps_us)
+        events = source.read_events()
+        self._add_events(containerid, events)
+        return len(events)
+
+    # Adds the events read for a container to its window, or to the events to
+    # send (those that its report-by-exception filter lets through, if any)
+    def _add_events(self, containerid, events):
+        aggregator = self.aggregators.get(containerid)
+        if aggregator is not None:
+            for event in events:
+                aggregator.add_event(event)
+            return
+        exception_filter = self.exception_filters.get(containerid)
+        if exception_filter is not None and events:
+            events = exception_filter.filter_values(containerid, events)
+        self.pending[containerid].extend_events(events)
+
+    # The number of events per message, and the seconds between flushes
+    def batch_size(self):
+        if self.batch_controller is not None:
+            return self.batch_controller.batch_size
+        return self.config["send"]["max_events_per_message"]
+
+    def send_interval(self):
+        if self.batch_controller is not None:
+            return self.batch_controller.flush_interval_seconds
+        return self.config["send"]["send_interval_seconds"]
+
+    # Sends every pending event, in messages of at most batch_size() events
+    # (for one container each, unless precompress is set), and then the
+    # samples of every capture buffer, in shared messages
+    def flush(self):
+        # The statistics of every window that has closed
+        for aggregator in self.aggregators.values():
+            for entry in aggregator.take_message(clock_now()) or []:
+                self.pending[entry["containerid"]].extend_events(entry["values"])
+        message = []
+        message_events = 0
+        for containerid in self.data_containerids:
+            readings = self.pending[containerid]
+            while len(readings):
+                build_start = perf_counter()
+                # Read for every message, since the controller may change it
+                batch = readings.take(max(1, self.batch_size() - message_events))
+                message.append({"containerid": containerid, "values": batch})
+                message_events += len(batch)
+                if self.profiler is not None:
+                    self.profiler.record('build', perf_counter() - build_start)
+                if not self.precompress or message_events >= self.batch_size():
+                    self._send_data_message(message, message_events)
+                    message = []
+                    message_events = 0
+        if message:
+            self._send_data_message(message, message_events)
+        captures = [
+            (containerid, self._capture_buffer(containerid, source)) for containerid, source in self.sources
+        ]
+        captures = [(containerid, capture) for containerid, capture in captures if capture is not None]
+        for gateway in self.gateways:
+            captures.extend(gateway.captures())
+        if captures:
+            self._send_captured(captures)
+
+    # Sends the samples of (containerid, capture buffer) pairs as data message
+    # bodies that are encoded as the samples are taken, column by column
+    def _send_captured(self, captures):
+        from omf_edge.capture import take_multiplexed_messages
+        build_start = perf_counter()
+        taken = {} if self.metrics is not None else None
+        messages = take_multiplexed_messages(captures, self.batch_size(), counts=True, taken=taken)
+        if self.profiler is not None:
+            self.profiler.record('build', perf_counter() - build_start)
+        if taken:
+            for containerid, events in taken.items():
+                self.metrics.events_read.inc((containerid,), events)
+        for message_body, events in messages:
+            self._send_data_message(message_body, events)
+
+    def _send_data_message(self, message, events):
+        # The batch controller observes the request as it is sent (here, or
+        # on the retry engine's thread); a message that could not be encoded
+        # was not sent, so it is not observed
+        sent = self.send_omf_message("create", "Data", message, events=events)
+        if sent:
+            # Track how long it took from startup until the first data point went out
+            self.startup.mark_first_data_point()
+
+    def print_counters(self):
+        for containerid, source in self.sources:
+            source.print_counters()
+        for gateway in self.gateways:
+            gateway.print_counters()
+        for exception_filter in self.exception_filters.values():
+            exception_filter.print_counters()
+        self.sender.print_counters()
+        if self.retry_engine is not None:
+            self.retry_engine.print_counters()
+        if self.batch_controller is not None:
+            self.batch_controller.print_metrics()
+
+    # Prints the loop profile (and the stack samples) once its report interval has gone by
+    def _report_profile(self):
+        if not self.profiler.maybe_print_report() or self.stack_sampler is None:
+            return
+        self.stack_sampler.print_report()
+        collapsed_stacks_file = self.config["profile"]["collapsed_stacks_file"]
+        if collapsed_stacks_file:
+            self.stack_sampler.write_collapsed(collapsed_stacks_file)
+            log.info('--- Stack samples written to ' + collapsed_stacks_file)
+
+    # Samples every sample_interval_seconds and sends every send_interval_seconds, forever
+    def run(self):
+        send_config = self.config["send"]
+        sample_interval = send_config["sample_interval_seconds"]
+        log.info(
+            '\n--- Now sending live data every ' + str(self.send_interval()) +
+            ' second(s) for device "' + self.config["device"]["name"] + '"... (press CTRL+C to quit at any time)\n'
+        )
+        if self.send_assets:
+            log.info('--- (Look for a new AF Element named "' + self.config["device"]["name"] + '".)\n')
+        profiler = self.profiler
+        if profiler is not None and self.config["profile"]["stack_sampler"]:
+            # Samples this thread, the one that runs the loop
+            self.stack_sampler = StackSampler(self.config["profile"]["stack_interval_seconds"])
+            self.stack_sampler.start()
+        loop_count = 0
+        next_sample = next_send = monotonic()
+        while True:
+            now = monotonic()
+            if now >= next_sample:
+                if profiler is None:
+                    self.sample()
+                else:
+                    with profiler.phase('sample'):
+                        self.sample()
+                next_sample = _next_deadline(next_sample, sample_interval, monotonic())
+                loop_count += 1
+                if loop_count % send_config["loops_between_counter_reports"] == 0:
+                    self.print_counters()
+            if now >= next_send:
+                self.flush()
+                next_send = _next_deadline(next_send, self.send_interval(), monotonic())
+            now = monotonic()
+            delay = min(next_sample, next_send) - now
+            if profiler is not None:
+                self._report_profile()
+                with profiler.phase('sleep'):
+                    if delay > 0:
+                        time.sleep(delay)
+            elif delay > 0:
+                time.sleep(delay)
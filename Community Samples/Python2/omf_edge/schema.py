@@ -0,0 +1,314 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# OMF type schema compiler: reads the OMF type definitions that a script
+# sends (with their "type"/"format" keywords and enums) and generates, for
+# each type, a function that checks an event against the type and encodes
+# it to JSON in the same pass, so that a value that does not match its type
+# is caught on the device, instead of being rejected by the relay
+# ************************************************************************
+
+# Import packages
+import json
+import numbers
+import re
+
+from omf_edge.compat import PY2, isfinite, string_types
+
+# Raised when an event does not match the OMF type of its container; the
+# senders log it as a validation error, apart from errors sending the message
+class OMFValidationError(ValueError):
+    pass
+
+# The classes of plain integers (Python 2 also has long)
+if PY2:
+    _INTEGER_CLASSES = (int, long)
+else:
+    _INTEGER_CLASSES = (int,)
+
+# Ranges for the OMF integer formats
+INTEGER_FORMAT_RANGES = {
+    'int16': (-2 ** 15, 2 ** 15 - 1),
+    'int32': (-2 ** 31, 2 ** 31 - 1),
+    'int64': (-2 ** 63, 2 ** 63 - 1),
+    'uint16': (0, 2 ** 16 - 1),
+    'uint32': (0, 2 ** 32 - 1),
+    'uint64': (0, 2 ** 64 - 1)
+}
+
+# Accepts timestamps such as "2018-05-10T20:22:47.360123Z" or "2018-05-10T20:22:47+02:00"
+DATE_TIME_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})\Z')
+
+# What an endpoint takes, with strict=False: the time zone may be left out
+# (the time is then taken as UTC), and "Z" may be lower case
+LENIENT_DATE_TIME_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?([Zz]|[+-]\d{2}:\d{2})?\Z')
+
+# The names that generated code can refer to
+_GLOBALS = {
+    'OMFValidationError': OMFValidationError,
+    '_encode_string': json.encoder.encode_basestring_ascii,
+    '_float_repr': float.__repr__,
+    # On Python 2, repr adds an "L" to a long, and int.__repr__ does not take one
+    '_int_repr': str if PY2 else int.__repr__,
+    '_isfinite': isfinite,
+    '_Real': numbers.Real,
+    '_Integral': numbers.Integral,
+    '_integer_classes': _INTEGER_CLASSES,
+    '_string_types': string_types,
+    '_enum_classes': _INTEGER_CLASSES + (float,) + string_types,
+    '_date_time': DATE_TIME_PATTERN.match,
+    '_MISSING': object()
+}
+
+# ************************************************************************
+# Code generation: one block of checks and encoding per property
+# ************************************************************************
+
+# Returns the lines of code that check the value "v" of one property and
+# append its encoded text to "parts"; constants (such as enum lookup tables)
+# are added to the generated function's namespace.  The checks accept what
+# PI and OCS accept: any string (str or, on Python 2, unicode), integral
+# floats (such as 5.0) for integers, and ints for numbers
+def _property_code(name, definition, constant_prefix, namespace):
+    key = json.dumps(name) + ':'
+    problem = 'raise OMFValidationError({0} + repr(v))'
+    property_type = definition.get('type')
+    property_format = definition.get('format')
+    lines = []
+
+    # A type such as ["number", "null"] also allows null values
+    if isinstance(property_type, list):
+        types = [t for t in property_type if t != 'null']
+        if len(types) != 1:
+            raise ValueError('Property "{0}" has unsupported type {1!r}'.format(name, property_type))
+        nullable_code = _property_code(name, dict(definition, type=types[0]), constant_prefix, namespace)
+        if len(types) == len(property_type):
+            return nullable_code
+        return [
+            'if v is None:',
+            '    parts.append({0!r})'.format(key + 'null'),
+            'else:'
+        ] + ['    ' + line for line in nullable_code]
+
+    if 'enum' in definition:
+        # Precomputed lookup table from each allowed value to its encoded text,
+        # so a single dict lookup both checks and encodes the value
+        table = constant_prefix + '_enum'
+        namespace[table] = dict((value, key + json.dumps(value)) for value in definition['enum'])
+        # Also checks the class, since 1 == True == 1.0 would all match an integer key
+        if property_type == 'integer':
+            lookup = ('text = {0}.get(v) if v.__class__ is int or '
+                      '(isinstance(v, _Real) and v.__class__ is not bool) else None').format(table)
+        elif property_type == 'string':
+            lookup = 'text = {0}.get(v) if isinstance(v, _string_types) else None'.format(table)
+        else:
+            lookup = 'text = {0}.get(v) if isinstance(v, _enum_classes) else None'.format(table)
+        lines += [
+            lookup,
+            'if text is None:',
+            '    ' + problem.format(repr('"{0}" must be one of {1}, not '.format(name, definition['enum']))),
+            'parts.append(text)'
+        ]
+    elif property_type == 'number':
+        # Plain floats and ints take the fast path; other numbers (such as
+        # the NumPy floats that some sensor libraries return) are converted
+        lines += [
+            'if v.__class__ is float:',
+            '    if not _isfinite(v):',
+            '        ' + problem.format(repr('"{0}" must be a finite number, not '.format(name))),
+            '    parts.append({0!r} + _float_repr(v))'.format(key),
+            'elif v.__class__ is int:',
+            '    parts.append({0!r} + _int_repr(v))'.format(key),
+            'elif isinstance(v, _Real) and v.__class__ is not bool and _isfinite(v):',
+            '    parts.append({0!r} + _float_repr(float(v)))'.format(key),
+            'else:',
+            '    ' + problem.format(repr('"{0}" must be a finite number, not '.format(name)))
+        ]
+    elif property_type == 'integer':
+        low, high = INTEGER_FORMAT_RANGES.get(property_format, INTEGER_FORMAT_RANGES['int64'])
+        # Other integers (such as NumPy ints), and floats with an integral
+        # value, are converted
+        lines += [
+            'if v.__class__ is not int and v.__class__ is not bool:',
+            '    if isinstance(v, _Integral):',
+            '        v = int(v)',
+            '    elif isinstance(v, _Real) and float(v).is_integer():',
+            '        v = int(v)',
+            'if v.__class__ not in _integer_classes or not {0} <= v <= {1}:'.format(low, high),
+            '    ' + problem.format(repr('"{0}" must be an integer ({1}), not '.format(name, property_format or 'int64'))),
+            'parts.append({0!r} + _int_repr(v))'.format(key)
+        ]
+    elif property_type == 'string':
+        lines += [
+            'if v.__class__ is not str and not isinstance(v, _string_types):',
+            '    ' + problem.format(repr('"{0}" must be a string, not '.format(name)))
+        ]
+        if property_format == 'date-time':
+            lines += [
+                'if _date_time(v) is None:',
+                '    ' + problem.format(repr('"{0}" must be an ISO 8601 date-time, not '.format(name)))
+            ]
+        lines += ['parts.append({0!r} + _encode_string(v))'.format(key)]
+    elif property_type == 'boolean':
+        lines += [
+            'if v is True:',
+            '    parts.append({0!r})'.format(key + 'true'),
+            'elif v is False:',
+            '    parts.append({0!r})'.format(key + 'false'),
+            'else:',
+            '    ' + problem.format(repr('"{0}" must be true or false, not '.format(name)))
+        ]
+    else:
+        raise ValueError('Property "{0}" has unsupported type {1!r}'.format(name, property_type))
+    return lines
+
+# Generates the source of the encoder function for one type
+def _encoder_source(type_definition, namespace):
+    properties = type_definition['properties']
+    lines = [
+        'def encode(event):',
+        '    parts = []',
+        '    found = 0'
+    ]
+    for number, (name, definition) in enumerate(properties.items()):
+        constant_prefix = '_p{0}'.format(number)
+        namespace[constant_prefix + '_name'] = name
+        lines += [
+            '    v = event.get({0}_name, _MISSING)'.format(constant_prefix),
+            '    if v is not _MISSING:',
+            '        found += 1'
+        ]
+        property_code = _property_code(name, definition, constant_prefix, namespace)
+        if not definition.get('isindex') and property_code[0] != 'if v is None:':
+            # Like PI and OCS, a null value is taken for any property but the index
+            property_code = [
+                'if v is None:',
+                '    parts.append({0!r})'.format(json.dumps(name) + ':null'),
+                'else:'
+            ] + ['    ' + line for line in property_code]
+        lines += ['        ' + line for line in property_code]
+        if definition.get('isindex'):
+            # The index (the timestamp, for dynamic types) is always required
+            lines += [
+                '    else:',
+                '        raise OMFValidationError({0!r})'.format('missing index property "{0}"'.format(name))
+            ]
+    lines += [
+        '    if found != len(event):',
+        '        _unknown_properties(event)',
+        "    return '{' + ','.join(parts) + '}'"
+    ]
+    return '\n'.join(lines) + '\n'
+
+# ************************************************************************
+# A compiled OMF type
+# ************************************************************************
+
+# The scripts check their own events strictly (strict=True); the ingress
+# emulator uses strict=False, to take what an OMF endpoint takes: properties
+# that are not part of the type are ignored (and left out of the encoded
+# event), and date-times may leave out the time zone
+class CompiledType(object):
+
+    def __init__(self, type_definition, strict=True):
+        self.id = type_definition['id']
+        self.definition = type_definition
+        self.property_names = frozenset(type_definition['properties'])
+        namespace = dict(_GLOBALS)
+        if strict:
+            namespace['_unknown_properties'] = self._unknown_properties
+        else:
+            namespace['_unknown_properties'] = _ignore_unknown_properties
+            namespace['_date_time'] = LENIENT_DATE_TIME_PATTERN.match
+        self.source = _encoder_source(type_definition, namespace)
+        exec(compile(self.source, '<OMF type {0}>'.format(self.id), 'exec'), namespace)
+        self._encode = namespace['encode']
+
+    def _unknown_properties(self, event):
+        unknown = sorted(set(event) - self.property_names)
+        raise OMFValidationError('properties {0} are not defined in type "{1}"'.format(unknown, self.id))
+
+    # Checks one event and returns its JSON text
+    def encode_event(self, event):
+        try:
+            return self._encode(event)
+        except OMFValidationError as ex:
+            raise OMFValidationError('Type "{0}": {1}'.format(self.id, ex))
+
+    # Checks a list of events and returns the JSON text of the "values" array
+    def encode_values(self, events):
+        encode = self.encode_event
+        return '[' + ','.join([encode(event) for event in events]) + ']'
+
+    def validate(self, event):
+        self.encode_event(event)
+
+def _ignore_unknown_properties(event):
+    pass
+
+def compile_type(type_definition, strict=True):
+    return CompiledType(type_definition, strict)
+
+# ************************************************************************
+# A registry of the compiled types and containers a script has defined
+# ************************************************************************
+
+# Typical use, inside send_omf_message_to_endpoint:
+#   if message_type == "Type": registry.add_types(message_json)
+#   if message_type == "Container": registry.add_containers(message_json)
+#   if message_type == "Data": body = registry.encode_data_message(message_json)
+class SchemaRegistry(object):
+
+    def __init__(self, strict=True):
+        self.strict = strict
+        self.types = {}
+        self.containers = {}
+
+    def add_types(self, types_message):
+        for type_definition in types_message:
+            self.types[type_definition['id']] = compile_type(type_definition, self.strict)
+
+    def add_containers(self, containers_message):
+        for container in containers_message:
+            self.containers[container['id']] = container['typeid']
+
+    def _compiled_type(self, typeid):
+        compiled = self.types.get(typeid)
+        if compiled is None:
+            raise OMFValidationError('Type "{0}" has not been defined'.format(typeid))
+        return compiled
+
+    # Checks every event of a data message against its type, and returns the
+    # message body as JSON text; links ("__Link") are passed through unchecked
+    def encode_data_message(self, data_message):
+        parts = []
+        for entry in data_message:
+            if 'containerid' in entry:
+                containerid = entry['containerid']
+                if containerid not in self.containers:
+                    raise OMFValidationError('Container "{0}" has not been defined'.format(containerid))
+                compiled = self._compiled_type(self.containers[containerid])
+                head = '{"containerid":' + json.dumps(containerid)
+            elif entry.get('typeid') == '__Link':
+                parts.append(json.dumps(entry))
+                continue
+            else:
+                compiled = self._compiled_type(entry.get('typeid'))
+                head = '{"typeid":' + json.dumps(entry['typeid'])
+            parts.append(head + ',"values":' + compiled.encode_values(entry['values']) + '}')
+        return '[' + ','.join(parts) + ']'
+
+    def validate_data_message(self, data_message):
+        self.encode_data_message(data_message)
@@ -0,0 +1,287 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# OMF sender: sends OMF messages to one endpoint over a pooled HTTP
+# connection (a requests.Session keeps the TCP and TLS connection open,
+# instead of setting up a new one for every message), optionally gzipped
+# (or, for a receiver that supports it, compressed with a preset dictionary);
+# data messages that could not be delivered are written to a spool file,
+# and are sent again once the endpoint can be reached
+# ************************************************************************
+
+# Import packages
+import base64
+import json
+import os
+
+import requests
+
+from omf_edge.compat import ZLIB_PRESET_DICTIONARIES, gzip_compress, monotonic, perf_counter
+from omf_edge.log import get_logger
+from omf_edge.message_format import JSONFormat
+from omf_edge.precompress import deflate
+
+log = get_logger('omf.sender')
+
+# ************************************************************************
+# Helper function: the OMF headers of a message
+# ************************************************************************
+
+def omf_headers(producer_token, message_type, action='create', compression=None, omf_version='1.0',
+                message_format='JSON'):
+    headers = {
+        'producertoken': producer_token,
+        'messagetype': message_type,
+        'action': action,
+        'messageformat': message_format,
+        'omfversion': omf_version
+    }
+    if compression:
+        headers['compression'] = compression
+    return headers
+
+# ************************************************************************
+# The sender for one endpoint
+# ************************************************************************
+
+# message_format is one of the formats of omf_edge.message_format (JSON, if
+# None); it only sets the "messageformat" header, since message bodies are
+# encoded by the caller, with message_format.encode.
+#
+# compression is None, "gzip", or "deflate": the zlib format, with the preset
+# dictionary in the dictionary attribute (see omf_edge.precompress) for data
+# messages; only a receiver that builds the same dictionary, such as the
+# ingress emulator, can read it.  The caller sets the dictionary once the
+# endpoint has accepted the types and containers it is built from; until
+# then, data messages are compressed without one.
+#
+# Typical use:
+#   sender = OMFSender(TARGET_URL, PRODUCER_TOKEN, verify_ssl=False, compression='gzip',
+#                      spool_path='omf_spool.jsonl')
+#   sender.send("Data", message_body)
+class OMFSender(object):
+
+    def __init__(self, url, producer_token, verify_ssl=True, timeout_seconds=30,
+                 compression=None, spool_path=None, omf_version='1.0', print_messages=False, name=None,
+                 metrics=None, message_format=None):
+        if compression not in (None, 'gzip', 'deflate'):
+            raise ValueError('Unsupported compression "{0}"; use None, "gzip" or "deflate"'.format(compression))
+        if compression == 'deflate' and not ZLIB_PRESET_DICTIONARIES:
+            raise ValueError('"deflate" compression needs Python 3.3 or later')
+        self.url = url
+        self.producer_token = producer_token
+        self.verify_ssl = verify_ssl
+        self.timeout_seconds = timeout_seconds
+        self.compression = compression
+        # The preset dictionary for "deflate" compression (or None)
+        self.dictionary = None
+        self.message_format = message_format or JSONFormat()
+        self.spool_path = spool_path
+        self.omf_version = omf_version
+        self.print_messages = print_messages
+        # Shown before each response line, when sending to more than one endpoint
+        self.name = name
+        # A SendPathMetrics, to record request latency, status codes, message
+        # sizes and compression ratios in (or None)
+        self.metrics = metrics
+        # A LoopProfiler, to record the time spent compressing and sending in (or None)
+        self.profiler = None
+        self.session = requests.Session()
+        self.messages_sent = 0
+        self.messages_failed = 0
+        self.messages_spooled = 0
+        # The status code of the last response, or None if the last message
+        # could not be sent at all; how long its request took; and its size
+        # in bytes, before compression
+        self.last_status_code = None
+        self.last_latency_seconds = None
+        self.last_message_bytes = 0
+        self.last_sent_bytes = 0
+        self.last_compress_seconds = 0.0
+        # Bytes of all the messages posted, before and after compression
+        self.bytes_before_compression = 0
+        self.bytes_after_compression = 0
+
+    # Posts one message and returns the response; raises requests.RequestException
+    # if the endpoint could not be reached.  gzipped_body, if given, is the
+    # already compressed body (so that a message sent to several endpoints is
+    # only compressed once)
+    def post(self, message_type, body, action='create', gzipped_body=None):
+        # Sizes are counted in bytes, so that text is encoded first
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.last_message_bytes = len(body)
+        self.last_compress_seconds = 0.0
+        if self.compression == 'deflate':
+            if message_type.lower() == 'data' and self.dictionary is None:
+                log.warning('Data messages are compressed without a preset dictionary until the endpoint '
+                            'has accepted a type or container', key='no dictionary')
+            compress_start = perf_counter()
+            payload = deflate(body, self.dictionary if message_type.lower() == 'data' else None)
+            self.last_compress_seconds = perf_counter() - compress_start
+        elif self.compression == 'gzip' and gzipped_body is None:
+            compress_start = perf_counter()
+            payload = gzip_compress(body)
+            self.last_compress_seconds = perf_counter() - compress_start
+        elif self.compression == 'gzip':
+            payload = gzipped_body
+        else:
+            payload = body
+        self.last_sent_bytes = len(payload)
+        self.bytes_before_compression += len(body)
+        self.bytes_after_compression += len(payload)
+        return self.session.post(
+            self.url,
+            headers=omf_headers(self.producer_token, message_type, action, self.compression, self.omf_version,
+                                self.message_format.name),
+            data=payload,
+            verify=self.verify_ssl,
+            timeout=self.timeout_seconds
+        )
+
+    # Sends one message (its JSON text, or the bytes of a binary format) and returns True if it was accepted;
+    # data messages that failed because the endpoint could not be reached, or
+    # answered with a server error, are spooled (if there is a spool file and
+    # spool is True)
+    def send(self, message_type, body, action='create', gzipped_body=None, spool=True):
+        prefix = '[' + self.name + '] ' if self.name else ''
+        # With print_messages, outgoing messages are printed at INFO rather than DEBUG
+        if self.print_messages:
+            log.info('{0}Outgoing message: {1}', prefix, body)
+        else:
+            log.debug('{0}Outgoing message: {1}', prefix, body)
+        request_start = monotonic()
+        try:
+            response = self.post(message_type, body, action, gzipped_body)
+        except requests.RequestException as ex:
+            self.last_latency_seconds = monotonic() - request_start
+            self._record(message_type)
+            log.error('{0}Error during web request: {1}', prefix, ex, key=self.url)
+            self.last_status_code = None
+            self.messages_failed += 1
+            if spool:
+                self.spool(message_type, body, action)
+            return False
+        self.last_latency_seconds = monotonic() - request_start
+        self.last_status_code = response.status_code
+        self._record(message_type)
+        if response.status_code >= 300:
+            log.warning('{0}Response from sending a message of type "{1}" with action "{2}": {3} {4}',
+                        prefix, message_type, action, response.status_code, response.text,
+                        key=(self.url, response.status_code))
+            self.messages_failed += 1
+            if spool and self.can_retry():
+                self.spool(message_type, body, action)
+            return False
+        log.debug('{0}Response from sending a message of type "{1}" with action "{2}": {3} {4}',
+                  prefix, message_type, action, response.status_code, response.text)
+        self.messages_sent += 1
+        return True
+
+    def _record(self, message_type):
+        if self.profiler is not None:
+            self.profiler.record('compress', self.last_compress_seconds)
+            self.profiler.record('send', self.last_latency_seconds - self.last_compress_seconds)
+        if self.metrics is None:
+            return
+        endpoint = self.name or self.url
+        message_type = message_type.lower()
+        self.metrics.request_seconds.observe(self.last_latency_seconds, (endpoint, message_type))
+        self.metrics.responses.inc((endpoint, str(self.last_status_code or 0)))
+        self.metrics.message_bytes.observe(self.last_message_bytes, (message_type,))
+        if self.compression and self.last_sent_bytes:
+            self.metrics.compression_ratio.observe(float(self.last_message_bytes) / self.last_sent_bytes, (endpoint,))
+
+    # Whether the last message that failed might go through if sent again:
+    # the endpoint could not be reached, or answered with a server error
+    def can_retry(self):
+        return self.last_status_code is None or self.last_status_code >= 500
+
+    # Bytes before compression divided by bytes sent, over all the messages
+    # posted (or None, if nothing was posted)
+    def compression_ratio(self):
+        if not self.bytes_after_compression:
+            return None
+        return float(self.bytes_before_compression) / self.bytes_after_compression
+
+    def print_counters(self):
+        ratio = self.compression_ratio() if self.compression else None
+        log.info('--- Sender{0}: {1} messages sent, {2} failed, {3} spooled{4}',
+                 ' ' + self.name if self.name else '', self.messages_sent, self.messages_failed, self.messages_spooled,
+                 ', compression ratio {0:.2f}'.format(ratio) if ratio else '')
+
+    # ************************************************************************
+    # The spool file: one JSON object per line, oldest first; the bodies of
+    # binary message formats are kept in base64
+    # ************************************************************************
+
+    def spool(self, message_type, body, action='create'):
+        if self.spool_path is None or message_type.lower() != 'data':
+            return
+        entry = {'messagetype': message_type, 'action': action, 'body': body}
+        if isinstance(body, bytes):
+            entry['body'] = base64.b64encode(body).decode('ascii')
+            entry['encoding'] = 'base64'
+        with open(self.spool_path, 'a') as spool_file:
+            spool_file.write(json.dumps(entry) + '\n')
+        self.messages_spooled += 1
+
+    def spooled_count(self):
+        if self.spool_path is None or not os.path.exists(self.spool_path):
+            return 0
+        with open(self.spool_path) as spool_file:
+            return sum(1 for line in spool_file if line.strip())
+
+    # Sends up to max_messages spooled messages, oldest first, stopping at the
+    # first one that fails; the rest stay in the spool file.  Returns the
+    # number of messages sent
+    def replay_spool(self, max_messages=100):
+        if self.spool_path is None or not os.path.exists(self.spool_path):
+            return 0
+        with open(self.spool_path) as spool_file:
+            entries = [json.loads(line) for line in spool_file if line.strip()]
+        # The spool file is emptied first, so that a message that fails again
+        # is spooled again (by send) rather than duplicated
+        os.remove(self.spool_path)
+        sent = 0
+        for index, entry in enumerate(entries):
+            body = entry['body']
+            if entry.get('encoding') == 'base64':
+                body = base64.b64decode(body)
+            if sent >= max_messages or not self.send(entry['messagetype'], body, entry['action']):
+                # Put back the messages that were not sent, in their original order
+                remaining = entries[index + 1:] if sent < max_messages else entries[index:]
+                self._restore(remaining)
+                break
+            sent += 1
+        return sent
+
+    def _restore(self, entries):
+        if not entries:
+            return
+        existing = []
+        if os.path.exists(self.spool_path):
+            with open(self.spool_path) as spool_file:
+                existing = [line for line in spool_file if line.strip()]
+        with open(self.spool_path, 'w') as spool_file:
+            # A message that failed during the replay was spooled again by
+            # send, and is kept first, since it is the oldest
+            for line in existing:
+                spool_file.write(line if line.endswith('\n') else line + '\n')
+            for entry in entries:
+                spool_file.write(json.dumps(entry) + '\n')
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,172 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Sense HAT sampler: rather than calling get_orientation_degrees, get_compass
+# and get_accelerometer_raw one after another for every message (each of which
+# polls the IMU and sleeps, and get_compass even switches the gyroscope and
+# accelerometer off and on, which restarts the sensor fusion), the IMU is
+# read continuously at a fixed fusion rate on a background thread, and
+# orientation, heading and acceleration all come from the same fused
+# snapshot; the slow environmental sensors are read at their own lower rate
+# ************************************************************************
+
+# Import packages
+import math
+import threading
+import time
+
+from omf_edge.compat import monotonic
+from omf_edge.log import get_logger
+
+log = get_logger('omf.sense_hat_sampler')
+
+# Converts an angle in radians to degrees between 0 and 360, like the Sense HAT library
+def _degrees(radians):
+    degrees = math.degrees(radians)
+    return degrees + 360 if degrees < 0 else degrees
+
+# ************************************************************************
+# The sampler
+# ************************************************************************
+
+# sense is a sense_hat.SenseHat.  With fusion_rate_hz set to 0, the IMU is read
+# at the poll interval that RTIMULib recommends for it.  Each read returns the
+# fused pose (of the gyroscope, accelerometer and compass), the acceleration
+# and the compass field of the same sample; the heading is the yaw of the
+# fused pose, which, unlike a compass-only reading, is tilt-compensated.
+#
+# Typical use:
+#   sense_sampler = SenseHatSampler(sense, fusion_rate_hz=0, environment_seconds=10)
+#   sense_sampler.start()
+#   sense_sampler.wait_until_ready(10)
+#   ... for every message: values = sense_sampler.snapshot()
+class SenseHatSampler(object):
+
+    def __init__(self, sense, fusion_rate_hz=0, environment_seconds=10):
+        self.sense = sense
+        self.fusion_rate_hz = fusion_rate_hz
+        self.environment_seconds = environment_seconds
+        # Counters: IMU reads that returned a new sample, IMU reads that did
+        # not, and reads of the environmental sensors
+        self.imu_samples = 0
+        self.imu_misses = 0
+        self.environment_samples = 0
+        self.last_error = None
+        # Each snapshot is replaced as a whole, so readers always see the
+        # values of a single sample
+        self._imu_values = None
+        self._environment_values = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        # Enable the compass, gyroscope and accelerometer once; they are not
+        # reconfigured again
+        self.sense.set_imu_config(True, True, True)
+        imu = self.sense._imu
+        if self.fusion_rate_hz:
+            period = 1.0 / self.fusion_rate_hz
+        else:
+            period = imu.IMUGetPollInterval() / 1000.0
+        self._stop.clear()
+        for name, target, args in (('imu fusion', self._run_imu, (imu, period)),
+                                   ('environment', self._run_environment, ())):
+            thread = threading.Thread(target=target, args=args, name=name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    # Waits until both the IMU and the environmental sensors have been read at
+    # least once; returns False if that did not happen within the timeout
+    def wait_until_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def _check_ready(self):
+        if self._imu_values is not None and self._environment_values is not None:
+            self._ready.set()
+
+    def _read_imu(self, imu):
+        # The IMU is read through the RTIMULib object that the Sense HAT
+        # library itself uses, since its public methods each poll the IMU again
+        if not imu.IMURead():
+            self.imu_misses += 1
+            return
+        data = imu.getIMUData()
+        if not data['fusionPoseValid'] or not data['accelValid']:
+            self.imu_misses += 1
+            return
+        roll, pitch, yaw = data['fusionPose']
+        accelerationx, accelerationy, accelerationz = data['accel']
+        self._imu_values = {
+            "Pitch": _degrees(pitch),
+            "Roll": _degrees(roll),
+            "Yaw": _degrees(yaw),
+            "Heading": _degrees(yaw),
+            "X Acceleration": accelerationx,
+            "Y Acceleration": accelerationy,
+            "Z Acceleration": accelerationz
+        }
+        self.imu_samples += 1
+        self._check_ready()
+
+    def _run_imu(self, imu, period):
+        # The fusion filter needs regular samples, so reads are kept on a fixed
+        # schedule (the time each read takes does not add up into a slower rate)
+        next_read = monotonic()
+        while not self._stop.is_set():
+            try:
+                self._read_imu(imu)
+            except Exception as ex:
+                self.last_error = ex
+            next_read += period
+            delay = next_read - monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_read = monotonic()
+
+    def _run_environment(self):
+        while not self._stop.is_set():
+            try:
+                self._environment_values = {
+                    "Humidity": self.sense.get_humidity(),
+                    "Temperature": self.sense.get_temperature_from_humidity() * 9/5 + 32
+                }
+                self.environment_samples += 1
+                self._check_ready()
+            except Exception as ex:
+                self.last_error = ex
+            self._stop.wait(self.environment_seconds)
+
+    # Returns the latest values of all sensors, as one dict keyed by OMF
+    # property name; this never touches the sensors, so it returns at once
+    def snapshot(self):
+        values = {}
+        values.update(self._environment_values or {})
+        values.update(self._imu_values or {})
+        return values
+
+    def print_counters(self):
+        line = '--- Sense HAT sampler: {0} IMU samples ({1} reads without a new sample), {2} environment samples'.format(
+            self.imu_samples, self.imu_misses, self.environment_samples)
+        if self.last_error is not None:
+            line += '; last error: ' + str(self.last_error)
+        log.info(line)
@@ -0,0 +1,345 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Sensor sources for the configuration-driven runner: each kind of hardware
+# (or the random sample data) is one SensorSource class, which is all that
+# differs between devices; the OMF setup, batching and sending are shared
+# ************************************************************************
+
+# Import packages
+import random
+
+from omf_edge.clock import iso_now
+from omf_edge.compat import monotonic
+from omf_edge.log import get_logger
+from omf_edge.records import iso_timestamp
+
+log = get_logger('omf.sources')
+
+# ************************************************************************
+# The interface that every source implements
+# ************************************************************************
+
+# A source is created with the "options" object of its container's "source"
+# entry in the configuration file.  initialize() is called once at startup
+# (on a startup thread), and read_events() is called once per sample interval
+# from the main loop; it returns a list of OMF events for the source's
+# container, each with a "Time" index.  Hardware libraries are only imported
+# in initialize(), so that a configuration only needs the libraries of the
+# sources it uses.  A device script can also define its own source class, and
+# give an instance of it as a container's "source".  A source that captures
+# samples on its own returns its capture buffer (see omf_edge.capture) from
+# capture_buffer(); the runner then takes its samples in blocks, and sends
+# them column-encoded, without building an event for each sample.
+class SensorSource(object):
+
+    def __init__(self, options):
+        self.options = options
+
+    def initialize(self):
+        pass
+
+    def read_events(self):
+        raise NotImplementedError
+
+    # The source's capture buffer, or None if it has none (called once the
+    # source is initialized)
+    def capture_buffer(self):
+        return None
+
+    # Prints any counters the source keeps (called periodically by the runner)
+    def print_counters(self):
+        pass
+
+# Most sources take one reading per sample interval: they only implement
+# read_values, which returns a dict of OMF property values
+class PollingSource(SensorSource):
+
+    def read_values(self):
+        raise NotImplementedError
+
+    def read_events(self):
+        values = self.read_values()
+        if values is None:
+            return []
+        event = {"Time": iso_now()}
+        event.update(values)
+        return [event]
+
+# The events of a block of samples taken from a capture buffer
+def _block_events(property_names, timestamps_us, values):
+    events = []
+    for timestamp_us, row in zip(timestamps_us.tolist(), values.tolist()):
+        event = {"Time": iso_timestamp(timestamp_us / 1000000.0)}
+        event.update(zip(property_names, row))
+        events.append(event)
+    return events
+
+# ************************************************************************
+# Random sample data, for trying out an endpoint without any hardware
+# ************************************************************************
+
+# Options: "properties" maps each property name to its [minimum, maximum];
+# the default matches the "Raw Sensor Reading" values of the base script
+class RandomSource(PollingSource):
+
+    def read_values(self):
+        properties = self.options.get("properties", {
+            "Raw Sensor Reading 1": [0, 100],
+            "Raw Sensor Reading 2": [0, 100]
+        })
+        return dict(
+            (name, random.uniform(low, high)) for name, (low, high) in properties.items()
+        )
+
+# ************************************************************************
+# Raspberry Pi Sense HAT
+# ************************************************************************
+
+# Options: "imu_fusion_rate_hz" (0 uses the rate that RTIMULib recommends),
+# "environment_sample_seconds", and "led_display" (true to show the Z
+# acceleration on the LEDs) with "night_mode" (true to turn them off between
+# 10 PM and 7 AM)
+class SenseHatSource(PollingSource):
+
+    def initialize(self):
+        import datetime
+        import sense_hat
+        from omf_edge.sense_hat_sampler import SenseHatSampler
+        self.sense = sense_hat.SenseHat()
+        self.sampler = SenseHatSampler(
+            self.sense,
+            self.options.get("imu_fusion_rate_hz", 0),
+            self.options.get("environment_sample_seconds", 10)
+        )
+        self.sampler.start()
+        if not self.sampler.wait_until_ready(10):
+            log.error('The Sense HAT sensors did not return values within 10 seconds')
+        self.led_display = None
+        if self.options.get("led_display", False):
+            import webcolors
+            from omf_edge.led_display import LedBarGraph
+            night_mode = self.options.get("night_mode", True)
+            def is_night_time():
+                hour = datetime.datetime.now().hour
+                return night_mode and (hour > 22 or hour < 7)
+            colors = ['MAGENTA', 'RED', 'ORANGE', 'YELLOW', 'YELLOWGREEN', 'GREEN', 'LightSeaGreen', 'BLUE']
+            self.led_display = LedBarGraph(
+                self.sense,
+                [webcolors.name_to_rgb(color) for color in colors],
+                webcolors.name_to_rgb('navy'),
+                is_dark=is_night_time
+            )
+            self.sense.show_message("Ready!")
+            self.led_display.start()
+
+    def read_values(self):
+        if not self.sampler.wait_until_ready(0):
+            return None
+        values = self.sampler.snapshot()
+        if self.led_display is not None:
+            self.led_display.add(values["Z Acceleration"])
+        return values
+
+    def print_counters(self):
+        self.sampler.print_counters()
+
+# ************************************************************************
+# BeagleBone Blue IMU, through the rcpy library
+# ************************************************************************
+
+# Options: "capture_rate_hz" (0, the default, reads the IMU once per sample
+# interval; otherwise, the IMU is read at this rate on a background thread,
+# and every sample is sent, which needs NumPy), "use_interrupts" (true to let
+# the IMU's digital motion processor pace the samples, at 4 to 200 samples
+# per second) and "buffer_seconds" (how many seconds of samples can wait to
+# be sent; if sending falls further behind, new samples are dropped)
+class RcpyImuSource(SensorSource):
+
+    PROPERTY_NAMES = (
+        "X-acceleration", "Y-acceleration", "Z-acceleration",
+        "X-rotation", "Y-rotation", "Z-rotation",
+        "X-magnetic field", "Y-magnetic field", "Z-magnetic field",
+        "Board Temperature"
+    )
+
+    def initialize(self):
+        import rcpy
+        import rcpy.mpu9250
+        self.imu = rcpy.mpu9250
+        rcpy.set_state(rcpy.RUNNING)
+        rate_hz = self.options.get("capture_rate_hz", 0)
+        use_interrupts = self.options.get("use_interrupts", False)
+        if rate_hz and use_interrupts:
+            # With the DMP enabled, rcpy.mpu9250.read() waits for the next sample
+            rcpy.mpu9250.initialize(enable_magnetometer = True, enable_dmp = True, dmp_sample_rate = rate_hz)
+        else:
+            rcpy.mpu9250.initialize(enable_magnetometer = True)
+        self.capture = None
+        # The board temperature changes slowly and takes a separate read, so in
+        # capture mode it is only read once per second, and the latest reading
+        # is repeated in every sample
+        self.temperature_seconds = 0
+        self.temperature = None
+        self.temperature_read_at = None
+        if rate_hz:
+            from omf_edge.capture import SampleCapture
+            self.temperature_seconds = 1
+            self.capture = SampleCapture(
+                self._read_sample,
+                self.PROPERTY_NAMES,
+                rate_hz,
+                capacity = int(rate_hz * self.options.get("buffer_seconds", 30)),
+                interrupt_driven = use_interrupts
+            )
+            self.capture.start()
+
+    # Returns one sample, in PROPERTY_NAMES order; acceleration is converted to Gs
+    def _read_sample(self):
+        now = monotonic()
+        if self.temperature_read_at is None or now - self.temperature_read_at >= self.temperature_seconds:
+            self.temperature = self.imu.read_imu_temp() * 9/5 + 32
+            self.temperature_read_at = now
+        data = self.imu.read()
+        acceleration = data['accel']
+        rotation = data['gyro']
+        magnetic_field = data['mag']
+        return (
+            acceleration[0]/9.80665, acceleration[1]/9.80665, acceleration[2]/9.80665,
+            rotation[0], rotation[1], rotation[2],
+            magnetic_field[0], magnetic_field[1], magnetic_field[2],
+            self.temperature
+        )
+
+    def read_events(self):
+        if self.capture is not None:
+            timestamps_us, values = self.capture.take_block()
+            return _block_events(self.PROPERTY_NAMES, timestamps_us, values)
+        event = {"Time": iso_now()}
+        event.update(zip(self.PROPERTY_NAMES, self._read_sample()))
+        return [event]
+
+    def capture_buffer(self):
+        return getattr(self, "capture", None)
+
+    def print_counters(self):
+        if self.capture is not None:
+            self.capture.print_counters()
+
+# ************************************************************************
+# Phidgets, read from their data events
+# ************************************************************************
+
+# Every value that the Phidget reports (at "data_interval_ms", or its fastest
+# rate if that is 0) is kept in a CallbackCapture buffer of "buffer_size"
+# values; read_events returns all of the values reported since the last call
+class PhidgetSource(SensorSource):
+
+    # Filled in by subclasses: the property names, and the name of the
+    # channel's change trigger setter (set to 0, so that every value is reported)
+    PROPERTY_NAMES = ()
+    CHANGE_TRIGGER_SETTER = None
+
+    def _open_channel(self):
+        raise NotImplementedError
+
+    def initialize(self):
+        from omf_edge.capture import CallbackCapture
+        from Phidget22.PhidgetException import PhidgetException
+        self.capture = CallbackCapture(self.PROPERTY_NAMES, self.options.get("buffer_size", 60000))
+        data_interval_ms = self.options.get("data_interval_ms", 0)
+
+        # The data interval is lost when the device is detached, so it is set on every attach
+        def attached(channel):
+            try:
+                channel.setDataInterval(data_interval_ms or channel.getMinDataInterval())
+                getattr(channel, self.CHANGE_TRIGGER_SETTER)(0)
+                log.info("--- Phidget attached: {0} (serial number {1}, channel {2}), data interval {3} ms",
+                         channel.getDeviceName(), channel.getDeviceSerialNumber(), channel.getChannel(),
+                         channel.getDataInterval())
+            except PhidgetException as e:
+                log.error("Phidget Exception {0}: {1}", e.code, e.details, key=e.code)
+
+        def detached(channel):
+            try:
+                log.info("--- Phidget detached: serial number {0}, channel {1}",
+                         channel.getDeviceSerialNumber(), channel.getChannel())
+            except PhidgetException as e:
+                log.error("Phidget Exception {0}: {1}", e.code, e.details, key=e.code)
+
+        def error(channel, code, description):
+            log.error('Phidget error {0}: {1}', code, description, key=code)
+
+        self.channel = self._open_channel()
+        self.channel.setOnAttachHandler(attached)
+        self.channel.setOnDetachHandler(detached)
+        self.channel.setOnErrorHandler(error)
+        log.info("--- Waiting for the Phidget to be attached...")
+        self.channel.openWaitForAttachment(self.options.get("attach_timeout_ms", 5000))
+
+    def read_events(self):
+        timestamps_us, values = self.capture.take_block()
+        return _block_events(self.PROPERTY_NAMES, timestamps_us, values)
+
+    def capture_buffer(self):
+        return getattr(self, "capture", None)
+
+    def print_counters(self):
+        self.capture.print_counters()
+
+class PhidgetAccelerometerSource(PhidgetSource):
+
+    PROPERTY_NAMES = ("X Acceleration", "Y Acceleration", "Z Acceleration")
+    CHANGE_TRIGGER_SETTER = "setAccelerationChangeTrigger"
+
+    def _open_channel(self):
+        from Phidget22.Devices.Accelerometer import Accelerometer
+        channel = Accelerometer()
+        channel.setOnAccelerationChangeHandler(
+            lambda phidget, acceleration, timestamp: self.capture.push(acceleration, timestamp))
+        return channel
+
+class PhidgetTemperatureSource(PhidgetSource):
+
+    PROPERTY_NAMES = ("Temperature",)
+    CHANGE_TRIGGER_SETTER = "setTemperatureChangeTrigger"
+
+    def _open_channel(self):
+        from Phidget22.Devices.TemperatureSensor import TemperatureSensor
+        channel = TemperatureSensor()
+        channel.setOnTemperatureChangeHandler(
+            lambda phidget, temperature: self.capture.push((temperature * 9/5 + 32,)))
+        return channel
+
+# ************************************************************************
+# The source types that a configuration file can name
+# ************************************************************************
+
+# To add a kind of hardware, write a SensorSource class and add it here
+SOURCE_TYPES = {
+    "random": RandomSource,
+    "sensehat": SenseHatSource,
+    "rcpy": RcpyImuSource,
+    "phidgets_accelerometer": PhidgetAccelerometerSource,
+    "phidgets_temperature": PhidgetTemperatureSource
+}
+
+def make_source(source_config):
+    if isinstance(source_config, SensorSource):
+        return source_config
+    source_type = source_config.get("type")
+    if source_type not in SOURCE_TYPES:
+        raise ValueError('Unknown source type "{0}"; use one of {1}'.format(source_type, sorted(SOURCE_TYPES)))
+    return SOURCE_TYPES[source_type](source_config.get("options", {}))
@@ -0,0 +1,183 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+# ************************************************************************
+# Startup orchestrator: runs the startup phases of a device script
+# (sensor warm-up, clock sync, OMF type/container/asset registration)
+# concurrently, while still honoring the order that they depend on
+# ************************************************************************
+
+# Import packages
+import threading
+import time
+
+from omf_edge.compat import monotonic
+from omf_edge.log import get_logger
+
+log = get_logger('omf.startup')
+
+# ************************************************************************
+# A single named startup phase, and the phases it has to wait for
+# ************************************************************************
+
+class StartupPhase(object):
+
+    def __init__(self, name, function, after, retry_seconds=None):
+        self.name = name
+        self.function = function
+        self.after = list(after)
+        self.retry_seconds = retry_seconds
+        self.attempts = 0
+        # Offsets, in seconds, from the moment the orchestrator was started
+        self.started = None
+        self.finished = None
+        # Set if the phase raised an exception or returned False, or was
+        # skipped because one of the phases it depends on did not complete
+        self.error = None
+        self.done = threading.Event()
+
+    def succeeded(self):
+        return self.done.is_set() and self.error is None
+
+# ************************************************************************
+# The orchestrator itself
+# ************************************************************************
+
+# Typical use, from a device script:
+#   startup = StartupOrchestrator()
+#   startup.add_phase('sensors', initialize_sensors)
+#   startup.add_phase('clock', lambda: start_clock('pool.ntp.org'))
+#   startup.add_phase('dynamic types', send_dynamic_types)
+#   startup.add_phase('containers', send_containers, after=['dynamic types'], retry_seconds=10)
+#   startup.start()
+#   if not startup.wait_for('sensors', 'clock', 'containers'):
+#       ... give up ...
+#   ... send the first data values ...
+#   startup.mark_first_data_point()
+class StartupOrchestrator(object):
+
+    def __init__(self):
+        self._phases = []
+        self._phases_by_name = {}
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._start_time = None
+        self.all_done = threading.Event()
+        # Tracked metric: seconds from start() until the first data value
+        # message was sent (None until mark_first_data_point() is called)
+        self.time_to_first_data_point = None
+
+    # Registers a phase; "after" lists the names of phases that must finish
+    # before this one may start.  Dependencies must be added first, which
+    # also guarantees that the phases can never wait on each other in a cycle.
+    # A phase fails if its function raises an exception or returns False (as
+    # the send functions do when a message was not accepted); with
+    # retry_seconds, a failed phase is run again after that many seconds,
+    # until it succeeds, so the phases after it wait for it rather than fail
+    def add_phase(self, name, function, after=(), retry_seconds=None):
+        if name in self._phases_by_name:
+            raise ValueError('Startup phase "{0}" was already added'.format(name))
+        for dependency in after:
+            if dependency not in self._phases_by_name:
+                raise ValueError(
+                    'Startup phase "{0}" depends on unknown phase "{1}"'.format(name, dependency)
+                )
+        phase = StartupPhase(name, function, after, retry_seconds)
+        self._phases.append(phase)
+        self._phases_by_name[name] = phase
+        return phase
+
+    def _elapsed(self):
+        return monotonic() - self._start_time
+
+    # Runs one phase on its own thread, once all of its dependencies are done
+    def _run_phase(self, phase):
+        for dependency in phase.after:
+            self._phases_by_name[dependency].done.wait()
+        failed = [d for d in phase.after if not self._phases_by_name[d].succeeded()]
+        phase.started = self._elapsed()
+        if failed:
+            phase.error = 'skipped, because "{0}" did not complete'.format('", "'.join(failed))
+        else:
+            self._attempt(phase)
+            while phase.error is not None and phase.retry_seconds is not None:
+                log.info('--- Retrying startup phase "{0}" in {1} seconds...', phase.name, phase.retry_seconds)
+                time.sleep(phase.retry_seconds)
+                self._attempt(phase)
+        phase.finished = self._elapsed()
+        phase.done.set()
+        with self._lock:
+            self._remaining -= 1
+            last_phase = (self._remaining == 0)
+        if last_phase:
+            self.print_timeline()
+            self.all_done.set()
+
+    def _attempt(self, phase):
+        phase.attempts += 1
+        phase.error = None
+        try:
+            if phase.function() is False:
+                phase.error = 'failed'
+        except Exception as ex:
+            phase.error = str(ex)
+        if phase.error is not None:
+            log.error('Error during startup phase "{0}": {1}', phase.name, phase.error, key=phase.name)
+
+    # Starts every phase; phases without dependencies begin immediately
+    def start(self):
+        self._start_time = monotonic()
+        self._remaining = len(self._phases)
+        if not self._phases:
+            self.all_done.set()
+        for phase in self._phases:
+            thread = threading.Thread(target=self._run_phase, args=(phase,), name='startup: ' + phase.name)
+            thread.daemon = True
+            thread.start()
+
+    # Blocks until the named phases are finished; returns True if they all succeeded
+    def wait_for(self, *names):
+        for name in names:
+            self._phases_by_name[name].done.wait()
+        return all(self._phases_by_name[name].succeeded() for name in names)
+
+    # Blocks until every phase is finished; returns True if they all succeeded
+    def join(self):
+        self.all_done.wait()
+        return all(phase.succeeded() for phase in self._phases)
+
+    # Records the time-to-first-data-point metric; later calls are ignored
+    def mark_first_data_point(self):
+        if self.time_to_first_data_point is None and self._start_time is not None:
+            self.time_to_first_data_point = self._elapsed()
+            log.info('--- Time to first data point: {0:.2f} s', self.time_to_first_data_point)
+
+    # Returns (name, started, finished, error) for each phase, in the order they were added
+    def timeline(self):
+        return [(p.name, p.started, p.finished, p.error) for p in self._phases]
+
+    def print_timeline(self):
+        lines = ['\n--- Startup timeline (seconds since start):']
+        for name, started, finished, error in self.timeline():
+            if started is None:
+                lines.append('    {0:>7}   {1:>7}   {2}'.format('-', '-', name))
+                continue
+            line = '    {0:7.2f} - {1:7.2f}   {2}'.format(started, finished, name)
+            attempts = self._phases_by_name[name].attempts
+            if attempts > 1:
+                line += ' ({0} attempts)'.format(attempts)
+            if error is not None:
+                line += ' (FAILED: ' + error + ')'
+            lines.append(line)
+        log.info('\n'.join(lines) + '\n')
@@ -0,0 +1,339 @@
+#Copyright 2018 OSIsoft, LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#<http://www.apache.org/licenses/LICENSE-2.0>
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+
+
+# ************************************************************************
+# Sensor traces: TraceRecorder writes every OMF message a script sends (its
+# types, containers, and the output of create_data_values_message) to a
+# compact file, with the time at which it was sent; TraceReplayer sends a
+# trace again through the same send path (the schema encoder, the sender,
+# and, with a runner configuration, fan-out, retries and compression), at
+# the recorded pace, N times faster, or as fast as possible, with every
+# timestamp shifted to the time of the replay.  This turns the traffic of a
+# real device into a repeatable load test, without the device:
+#   python3 -m omf_edge.trace info sensehat.omftrace
+#   python3 -m omf_edge.trace replay sensehat.omftrace --url http://localhost:8118/ingress/messages --speed max
+#
+# A trace file is a gzip stream holding TRACE_MAGIC, then one record per
+# message: a header (RECORD_HEADER: the message type and action, as indexes
+# into MESSAGE_TYPES and ACTIONS, seconds since recording started, and the
+# length of the body), then the body, as compact JSON text.  The recorder
+# flushes the stream every few seconds, so a trace cut short (by unplugging
+# the device, for example) can still be read up to its last flush
+# ************************************************************************
+
+# Import packages
+import argparse
+import atexit
+import copy
+import gzip
+import json
+import struct
+import threading
+import time
+import zlib
+
+from omf_edge.clock import now
+from omf_edge.compat import monotonic, string_types
+from omf_edge.log import get_logger
+from omf_edge.records import iso_timestamp, parse_iso_timestamp
+
+log = get_logger('omf.trace')
+
+TRACE_MAGIC = b'OMFTRACE1\n'
+RECORD_HEADER = struct.Struct('<BBdI')
+MESSAGE_TYPES = ('Type', 'Container', 'Data')
+ACTIONS = ('create', 'update', 'delete')
+
+# ************************************************************************
+# Recording
+# ************************************************************************
+
+# Typical use, inside send_omf_message_to_endpoint, once the message body
+# has been encoded:
+#   trace_recorder = open_trace_recorder(TRACE_FILE)
+#   ...
+#   if trace_recorder is not None:
+#       trace_recorder.write(action, message_type, message_body)
+# message may be the JSON text of the message, or the message itself.
+# Messages may be written from several threads
+class TraceRecorder(object):
+
+    def __init__(self, path, flush_interval_seconds=5.0):
+        self.path = path
+        self.flush_interval_seconds = flush_interval_seconds
+        self._file = gzip.open(path, 'wb', compresslevel=6)
+        self._file.write(TRACE_MAGIC)
+        self._lock = threading.Lock()
+        self._start = monotonic()
+        self._last_flush = self._start
+        self.messages = 0
+        # So that the end of the trace is written when the script exits
+        atexit.register(self.close)
+
+    def write(self, action, message_type, message):
+        if not isinstance(message, string_types):
+            message = json.dumps(message, separators=(',', ':'))
+        body = message.encode('utf-8')
+        header = RECORD_HEADER.pack(_index(MESSAGE_TYPES, message_type), _index(ACTIONS, action),
+                                    monotonic() - self._start, len(body))
+        with self._lock:
+            self._file.write(header)
+            self._file.write(body)
+            self.messages += 1
+            now_monotonic = monotonic()
+            if now_monotonic - self._last_flush >= self.flush_interval_seconds:
+                self._file.flush()
+                self._last_flush = now_monotonic
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def _index(names, name):
+    lower = name.lower()
+    for index, candidate in enumerate(names):
+        if candidate.lower() == lower:
+            return index
+    raise ValueError('Unknown "{0}"; use one of {1}'.format(name, ', '.join(names)))
+
+# Returns a TraceRecorder, or None if path is None (so that scripts can
+# leave recording off with TRACE_FILE = None)
+def open_trace_recorder(path):
+    if path is None:
+        return None
+    log.info('--- Recording every OMF message sent to the trace file {0}', path)
+    return TraceRecorder(path)
+
+# ************************************************************************
+# Reading
+# ************************************************************************
+
+# Yields (seconds since recording started, action, message type, message
+# body) for each record of a trace file, stopping quietly at the end of a
+# trace that was cut short
+def read_trace(path):
+    with gzip.open(path, 'rb') as trace_file:
+        if trace_file.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError('"{0}" is not a trace file'.format(path))
+        while True:
+            try:
+                header = trace_file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                message_type, action, elapsed_seconds, length = RECORD_HEADER.unpack(header)
+                body = trace_file.read(length)
+            except (EOFError, zlib.error):
+                return
+            if len(body) < length:
+                return
+            yield elapsed_seconds, ACTIONS[action], MESSAGE_TYPES[message_type], body.decode('utf-8')
+
+# ************************************************************************
+# Replaying
+# ************************************************************************
+
+# Loads a whole trace, and works out which properties of each data message
+# are timestamps (the "date-time" properties of each container's type, as
+# recorded in the trace's type and container messages).
+#
+# speed is how many times faster than recorded the messages are sent (None
+# for as fast as they can be sent); loops is how many times the data
+# messages are sent (the types and containers are only sent once).  With
+# time_shift, every timestamp is moved so that the trace starts at the time
+# of the replay, and spread over the replay's duration (so at 10x speed, the
+# events are 10 times closer together); each loop continues where the last
+# one ended, so no timestamp is sent twice.  Without it, the recorded
+# timestamps are sent as they are.
+#
+# Typical use:
+#   replayer = TraceReplayer('sensehat.omftrace', speed=10, loops=3)
+#   replayer.replay(send_omf_message_to_endpoint)
+class TraceReplayer(object):
+
+    def __init__(self, path, speed=1.0, loops=1, time_shift=True):
+        self.path = path
+        self.speed = speed
+        self.loops = loops
+        self.time_shift = time_shift
+        self.definitions = []
+        self.data = []
+        self._load()
+        self.messages_sent = 0
+        self.events_sent = 0
+        self.max_lag_seconds = 0.0
+        self.replay_seconds = 0.0
+
+    def _load(self):
+        types = {}
+        containers = {}
+        first = last = None
+        for elapsed_seconds, action, message_type, body in read_trace(self.path):
+            message = json.loads(body)
+            if message_type != 'Data':
+                for definition in message:
+                    if message_type == 'Type':
+                        types[definition['id']] = [
+                            name for name, prop in definition.get('properties', {}).items()
+                            if prop.get('format') == 'date-time']
+                    else:
+                        containers[definition['id']] = definition['typeid']
+                self.definitions.append((elapsed_seconds, action, message_type, message))
+                continue
+            # The timestamps of the message: (entry, event, property, seconds since the epoch)
+            stamps = []
+            events = 0
+            for entry_index, entry in enumerate(message):
+                events += len(entry['values'])
+                names = types.get(containers.get(entry.get('containerid')), ())
+                for event_index, event in enumerate(entry['values']):
+                    for name in names:
+                        if isinstance(event.get(name), str):
+                            seconds = parse_iso_timestamp(event[name])
+                            stamps.append((entry_index, event_index, name, seconds))
+                            first = seconds if first is None else min(first, seconds)
+                            last = seconds if last is None else max(last, seconds)
+            self.data.append((elapsed_seconds, action, message, stamps, events))
+        self.first_timestamp = first
+        # How far in time one loop moves: the longer of the recording and
+        # the span of its timestamps, plus the mean time between messages
+        duration = self.data[-1][0] - self.data[0][0] if self.data else 0.0
+        span = last - first if first is not None else 0.0
+        gap = duration / (len(self.data) - 1) if len(self.data) > 1 else 1.0
+        self.loop_seconds = max(duration, span) + gap
+        self.events_per_loop = sum(record[4] for record in self.data)
+
+    # Returns a copy of a data message, with its timestamps moved
+    def _shifted(self, message, stamps, origin, scale):
+        copies = {}
+        shifted = [dict(entry) for entry in message]
+        for entry_index, event_index, name, seconds in stamps:
+            event = copies.get((entry_index, event_index))
+            if event is None:
+                values = shifted[entry_index]['values']
+                if values is message[entry_index]['values']:
+                    values = shifted[entry_index]['values'] = list(values)
+                event = copies[(entry_index, event_index)] = values[event_index] = dict(values[event_index])
+            event[name] = iso_timestamp(origin + (seconds - self.first_timestamp) * scale)
+        return shifted
+
+    # Sends the trace through send(action, message_type, message_json), such
+    # as a script's send_omf_message_to_endpoint or DeviceRunner.send_omf_message;
+    # drain, if given, is called at the end, to wait for messages that send
+    # only queued, before the time of the replay is taken
+    def replay(self, send, drain=None):
+        speed = self.speed
+        scale = 1.0 / speed if speed else 1.0
+        start = monotonic()
+        wall_start = now()
+        for elapsed_seconds, action, message_type, message in self.definitions:
+            send(action, message_type, message)
+            self.messages_sent += 1
+        data_start = self.data[0][0] if self.data else 0.0
+        for loop in range(self.loops):
+            origin = wall_start + loop * self.loop_seconds * scale
+            for elapsed_seconds, action, message, stamps, events in self.data:
+                if speed:
+                    due = start + (loop * self.loop_seconds + elapsed_seconds - data_start) * scale
+                    delay = due - monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        self.max_lag_seconds = max(self.max_lag_seconds, -delay)
+                if self.time_shift and stamps:
+                    message = self._shifted(message, stamps, origin, scale)
+                send(action, 'Data', message)
+                self.messages_sent += 1
+                self.events_sent += events
+        if drain is not None:
+            drain()
+        self.replay_seconds = monotonic() - start
+
+    def print_report(self):
+        rate = self.events_sent / self.replay_seconds if self.replay_seconds else 0.0
+        log.info('--- Replayed {0} messages ({1} events) in {2:.2f} s: {3:,.0f} events per second{4}',
+                 self.messages_sent, self.events_sent, self.replay_seconds, rate,
+                 '; at most {0:.3f} s behind schedule'.format(self.max_lag_seconds) if self.speed else '')
+
+# ************************************************************************
+# Command line
+# ************************************************************************
+
+def print_info(path):
+    replayer = TraceReplayer(path)
+    containers = set()
+    for record in replayer.data:
+        containers.update(entry.get('containerid') or entry.get('typeid') for entry in record[2])
+    print('--- {0}: {1} type and container messages, {2} data messages, {3} events, {4} streams'.format(
+        path, len(replayer.definitions), len(replayer.data), replayer.events_per_loop, len(containers)))
+    if replayer.data:
+        print('    recorded over {0:.1f} s{1}'.format(
+            replayer.data[-1][0] - replayer.data[0][0],
+            ', timestamps from ' + iso_timestamp(replayer.first_timestamp) if replayer.first_timestamp else ''))
+
+def _speed(text):
+    return None if text == 'max' else float(text)
+
+def main():
+    # Imported here, since the runner imports this module
+    from omf_edge.runner import DEFAULT_CONFIG, DeviceRunner, load_config
+    parser = argparse.ArgumentParser(description='Record and replay OMF sensor traces')
+    commands = parser.add_subparsers(dest='command')
+    info_parser = commands.add_parser('info', help='describe a trace file')
+    info_parser.add_argument('trace')
+    replay_parser = commands.add_parser('replay', help='send a trace file to an endpoint')
+    replay_parser.add_argument('trace')
+    replay_parser.add_argument('--config', help='a runner configuration file, for its endpoint and send settings')
+    replay_parser.add_argument('--url', help='the endpoint (instead of the configuration file\'s)')
+    replay_parser.add_argument('--producer-token', default=None)
+    replay_parser.add_argument('--speed', type=_speed, default=1.0, help='times faster than recorded, or "max"')
+    replay_parser.add_argument('--loops', type=int, default=1, help='how many times to send the data messages')
+    replay_parser.add_argument('--no-time-shift', action='store_true', help='send the recorded timestamps')
+    args = parser.parse_args()
+    if args.command == 'info':
+        print_info(args.trace)
+        return
+    if args.command != 'replay':
+        parser.error('use "info" or "replay"')
+    if args.config:
+        config = load_config(args.config)
+    else:
+        config = copy.deepcopy(DEFAULT_CONFIG)
+    if args.url:
+        config["endpoint"]["url"] = args.url
+    if args.producer_token:
+        config["endpoint"]["producer_token"] = args.producer_token
+    # The types and containers come from the trace
+    config["types"] = []
+    config["containers"] = []
+    runner = DeviceRunner(config)
+    replayer = TraceReplayer(args.trace, args.speed, args.loops, not args.no_time_shift)
+    log.info('--- Replaying {0} ({1} events per loop) {2}',
+             args.trace, replayer.events_per_loop, 'as fast as possible' if args.speed is None else
+             'at {0}x speed'.format(args.speed))
+    if runner.retry_engine is not None:
+        drain = runner.retry_engine.join
+    elif runner.fan_out:
+        drain = runner.sender.join
+    else:
+        drain = None
+    try:
+        replayer.replay(runner.send_omf_message, drain)
+    except KeyboardInterrupt:
+        pass
+    replayer.print_report()
+    runner.print_counters()
+
+if __name__ == '__main__':
+    main()